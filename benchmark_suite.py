@@ -0,0 +1,237 @@
+"""Throughput and memory benchmarks of the import pipeline.
+
+Generates a seeded run_groups.config and country spreadsheet for each size
+with synthetic_data, then runs every stage (ParseRunGroupsConfig, Parser,
+Merger, ToCSV and the Scout import against InMemoryWorkflowService) in its
+own process, so one stage's allocations do not hide another's peak.  Results
+are written as JSON; pass an earlier result file with --compare to see the
+change since another commit.
+
+usage: benchmark_suite.py [--sizes 1000,10000,100000] [--seed N]
+                          [--out results.json] [--compare baseline.json]
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import parse_run_groups_config
+from google3.cityblock.special.legacy import synthetic_data
+from google3.cityblock.special.workflow.tools import in_memory_workflow_service
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def _CurrentRss():
+  """Returns the resident set size of this process in KiB."""
+  with open('/proc/self/statm') as f:
+    pages = int(f.read().split()[1])
+  return pages * resource.getpagesize() // 1024
+
+
+def _PeakRss():
+  """Returns the peak resident set size of this process in KiB."""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _LegacySites(files):
+  with open(files['config']) as f:
+    return parse_run_groups_config.ParseRunGroupsConfig(f)
+
+
+def _CurrentSites(files):
+  return collects_to_scout.Parser(files['csv'], synthetic_data.StubGeocode)
+
+
+def _MergedSites(files):
+  return collects_to_scout.Merger(_CurrentSites(files), _LegacySites(files))
+
+
+def _Import(sites):
+  datastore = bulk_import.WorkflowServiceDatastore(
+      in_memory_workflow_service.InMemoryWorkflowService())
+  results = bulk_import.BulkImport(
+      sites,
+      lambda site, datastore, result: collects_to_scout.ImportSite(
+          site, isinstance(site, parse_run_groups_config.LegacyIssue),
+          datastore, result),
+      datastore)
+  return sum(1 for result in results if result.ok)
+
+
+# stage name -> (setup(files) -> state, run(files, state) -> records)
+STAGES = [
+    ('parse_run_groups_config', lambda files: None,
+     lambda files, _: len(_LegacySites(files))),
+    ('parser', lambda files: None,
+     lambda files, _: len(_CurrentSites(files))),
+    ('merger', lambda files: (_CurrentSites(files), _LegacySites(files)),
+     lambda files, state: len(collects_to_scout.Merger(*state))),
+    ('to_csv', _MergedSites,
+     lambda files, sites: collects_to_scout.ToCSV(files['csv'], sites)
+     or len(sites)),
+    ('import', _MergedSites, lambda files, sites: _Import(sites)),
+]
+
+
+def _RunStage(stage, files, conn):
+  """Runs one stage in a child process and sends its measurements back."""
+  _, setup, run = stage
+  state = setup(files)
+  rss_before = _CurrentRss()
+  start = time.time()
+  records = run(files, state)
+  seconds = time.time() - start
+  conn.send((records, seconds, max(0, _PeakRss() - rss_before)))
+  conn.close()
+
+
+def MeasureStage(stage, files):
+  """Returns a result dictionary for one stage on one set of input files.
+
+  Peak memory is the growth of the peak RSS over the RSS the stage started
+  with, after its inputs were prepared.
+
+  Raises:
+    RuntimeError: The stage's process exited without sending its
+      measurements, e.g. because the stage raised.
+  """
+  parent, child = multiprocessing.Pipe(duplex=False)
+  process = multiprocessing.Process(target=_RunStage,
+                                    args=(stage, files, child))
+  process.start()
+  # only the child may hold the sending end, so recv sees it exit
+  child.close()
+  try:
+    records, seconds, peak_kib = parent.recv()
+  except EOFError:
+    process.join()
+    raise RuntimeError('Stage {} failed with exit code {}'.format(
+        stage[0], process.exitcode))
+  finally:
+    parent.close()
+  process.join()
+  return {
+      'stage': stage[0],
+      'sites': files['sites'],
+      'records': records,
+      'seconds': round(seconds, 4),
+      'records_per_second': round(records / seconds, 1) if seconds else None,
+      'peak_mib': round(peak_kib / 1024.0, 1),
+  }
+
+
+def RunSuite(sizes, seed=0, stages=None, directory=None):
+  """Generates inputs and measures every stage at every size.
+
+  Args:
+    sizes: Iterable of site counts.
+    seed: Seed of the synthetic inputs.
+    stages: List of STAGES entries to run, defaults to all.
+    directory: Scratch directory, defaults to a new temporary one that is
+      removed afterwards.
+
+  Returns:
+    List of result dictionaries.
+  """
+  scratch = directory or tempfile.mkdtemp()
+  results = []
+  try:
+    for size in sizes:
+      files = {
+          'sites': size,
+          'config': os.path.join(scratch, 'run_groups_{}.config'.format(size)),
+          'csv': os.path.join(scratch, 'sites_{}.csv'.format(size)),
+      }
+      synthetic_data.GenerateRunGroupsConfig(files['config'], size, seed)
+      synthetic_data.GenerateSpreadsheet(files['csv'], size, seed)
+      for stage in stages or STAGES:
+        result = MeasureStage(stage, files)
+        print >>sys.stderr, '{stage:24} {sites:>7} {seconds:>9.3f}s'.format(
+            **result)
+        results.append(result)
+  finally:
+    if directory is None:
+      shutil.rmtree(scratch)
+  return results
+
+
+def _Revision():
+  """Returns the commit the suite runs at, or None outside a checkout."""
+  try:
+    return subprocess.check_output(
+        ['git', 'rev-parse', '--short', 'HEAD'],
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        stderr=open(os.devnull, 'w')).strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def Compare(baseline, results):
+  """Returns a table of throughput and memory changes against a baseline.
+
+  Args:
+    baseline: Result dictionaries of an earlier run.
+    results: Result dictionaries of this run.
+  """
+  old = dict(((r['stage'], r['sites']), r) for r in baseline)
+  lines = ['{:24} {:>7} {:>12} {:>12} {:>8} {:>10}'.format(
+      'stage', 'sites', 'old rec/s', 'new rec/s', 'speedup', 'peak MiB')]
+  for result in results:
+    before = old.get((result['stage'], result['sites']))
+    if before is None or not before['records_per_second']:
+      continue
+    lines.append('{:24} {:>7} {:>12.0f} {:>12.0f} {:>7.2f}x {:>4.0f}->{:<5.0f}'
+                 .format(result['stage'], result['sites'],
+                         before['records_per_second'],
+                         result['records_per_second'] or 0,
+                         (result['records_per_second'] or 0) /
+                         before['records_per_second'],
+                         before['peak_mib'], result['peak_mib']))
+  return '\n'.join(lines)
+
+
+def main():
+  args = sys.argv[1:]
+  sizes = DEFAULT_SIZES
+  seed = 0
+  out_path = None
+  baseline_path = None
+  while args:
+    flag = args.pop(0)
+    if flag == '--sizes':
+      sizes = [int(size) for size in args.pop(0).split(',')]
+    elif flag == '--seed':
+      seed = int(args.pop(0))
+    elif flag == '--out':
+      out_path = args.pop(0)
+    elif flag == '--compare':
+      baseline_path = args.pop(0)
+    else:
+      sys.exit(__doc__)
+
+  report = {'revision': _Revision(), 'seed': seed,
+            'results': RunSuite(sizes, seed)}
+  output = json.dumps(report, indent=2, sort_keys=True)
+  if out_path:
+    with open(out_path, 'w') as f:
+      f.write(output + '\n')
+  print output
+
+  if baseline_path:
+    with open(baseline_path) as f:
+      baseline = json.load(f)
+    print 'Compared with {}:'.format(baseline.get('revision') or baseline_path)
+    print Compare(baseline['results'], report['results'])
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,209 @@
+"""Bounded-concurrency bulk import of sites into Scout.
+
+Importing a site takes several dependent RPCs (create the site, then its
+collection, then its run groups).  BulkImport runs that sequence for many
+sites at once on a fixed number of threads, retries RPCs that fail with
+transient errors and records what happened to every site.
+"""
+
+import random
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from google3.cityblock.special.workflow.proto import scout_pb2
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class SiteResult(object):
+  """Outcome of importing one site."""
+
+  def __init__(self, name):
+    self.name = name
+    self.site_id = None
+    self.collection_id = None
+    self.status = None
+    self.retries = 0
+    self.error = None
+
+  @property
+  def ok(self):
+    return self.error is None
+
+  def __str__(self):
+    if self.ok:
+      return '{}: OK site_id={} collection_id={} retries={}'.format(
+          self.name, self.site_id, self.collection_id, self.retries)
+    return '{}: FAILED site_id={} collection_id={} retries={} error={}'.format(
+        self.name, self.site_id, self.collection_id, self.retries, self.error)
+
+
+def IsTransient(error):
+  """Returns whether a failed RPC is worth retrying.
+
+  Errors raised while building requests (bad or missing field values) fail
+  the same way every time; anything else is assumed to be an RPC or network
+  error.
+  """
+  return not isinstance(error, (AttributeError, KeyError, TypeError,
+                                ValueError))
+
+
+class RetryingDatastore(object):
+  """Wraps a datastore so each RPC is retried with exponential backoff."""
+
+  def __init__(self, datastore, result, max_attempts=3, backoff=0.5,
+               is_transient=IsTransient, sleep=time.sleep):
+    """Constructor.
+
+    Args:
+      datastore: Scout datastore object to forward RPCs to.
+      result: SiteResult whose retry count is updated.
+      max_attempts: Maximum number of attempts per RPC.
+      backoff: Delay in seconds before the first retry, doubled each time.
+      is_transient: Function deciding whether an error is retried.
+      sleep: Function sleeping for a number of seconds.
+    """
+    self._datastore = datastore
+    self._result = result
+    self._max_attempts = max_attempts
+    self._backoff = backoff
+    self._is_transient = is_transient
+    self._sleep = sleep
+
+  def __getattr__(self, method):
+    def RetryingCall(*args):
+      delay = self._backoff
+      for attempt in range(1, self._max_attempts + 1):
+        try:
+          return getattr(self._datastore, method)(*args)
+        except Exception as e:  # pylint: disable=broad-except
+          if attempt == self._max_attempts or not self._is_transient(e):
+            raise
+        self._result.retries += 1
+        # jitter keeps retrying threads from hitting the backend in lockstep
+        self._sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+    return RetryingCall
+
+
+def ImportOne(site, import_site, datastore, max_attempts=3, backoff=0.5,
+              is_transient=IsTransient, sleep=time.sleep):
+  """Imports one site, retrying its RPCs, and returns its SiteResult.
+
+  Args:
+    site: Site object.
+    import_site: Function (site, scout_datastore_obj, result) running the
+      RPCs for the site in order and recording ids on the SiteResult.
+    datastore: Scout datastore object.
+    max_attempts: Maximum number of attempts per RPC.
+    backoff: Delay in seconds before the first retry of an RPC.
+    is_transient: Function deciding whether an RPC error is retried.
+    sleep: Function sleeping for a number of seconds.
+  """
+  result = SiteResult(site.issue_name)
+  retrying = RetryingDatastore(datastore, result, max_attempts, backoff,
+                               is_transient, sleep)
+  try:
+    import_site(site, retrying, result)
+  except Exception as e:  # pylint: disable=broad-except
+    result.error = '{}: {}'.format(type(e).__name__, e)
+  return result
+
+
+def BulkImport(sites, import_site, datastore,
+               max_concurrency=DEFAULT_MAX_CONCURRENCY,
+               max_attempts=3, backoff=0.5, is_transient=IsTransient,
+               sleep=time.sleep):
+  """Imports many sites concurrently.
+
+  Args:
+    sites: List of site objects.
+    import_site: Function (site, scout_datastore_obj, result) running the
+      RPCs for one site in order and recording ids on the SiteResult.
+    datastore: Scout datastore object shared by all threads.
+    max_concurrency: Maximum number of sites imported at once.
+    max_attempts: Maximum number of attempts per RPC.
+    backoff: Delay in seconds before the first retry of an RPC.
+    is_transient: Function deciding whether an RPC error is retried.
+    sleep: Function sleeping for a number of seconds.
+
+  Returns:
+    List of SiteResult objects in the order of sites.
+  """
+  pool = ThreadPool(max_concurrency)
+  try:
+    return pool.map(
+        lambda site: ImportOne(site, import_site, datastore, max_attempts,
+                               backoff, is_transient, sleep),
+        sites, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def Summary(results):
+  """Returns a report of which sites were imported and which failed."""
+  failed = [result for result in results if not result.ok]
+  lines = ['Imported {} of {} sites, {} failed, {} retries'.format(
+      len(results) - len(failed), len(results), len(failed),
+      sum(result.retries for result in results))]
+  lines.extend(str(result) for result in results)
+  return '\n'.join(lines)
+
+
+class WorkflowServiceDatastore(object):
+  """Datastore interface on top of a workflow service.
+
+  Lets CreateSite, CreateCollection and WriteRunGroups run against a workflow
+  service such as InMemoryWorkflowService, and lists its sites and
+  collections a page at a time.
+  """
+
+  def __init__(self, workflow_service):
+    self.workflow_service = workflow_service
+    self._lock = threading.Lock()
+
+  def CreateSite(self, new_site):
+    request = scout_pb2.CreateSiteRequest()
+    request.site_metadata.CopyFrom(new_site.metadata)
+    with self._lock:
+      return self.workflow_service.CreateSite(request).site_id
+
+  def CreateCollection(self, site_id, collection):
+    request = scout_pb2.CreateCollectionRequest()
+    request.site_id = site_id
+    request.collection_metadata.CopyFrom(collection.metadata)
+    with self._lock:
+      return self.workflow_service.CreateCollection(request).collection_id
+
+  def WriteRunGroups(self, run_group):
+    request = scout_pb2.WriteRunGroupsRequest()
+    request.run_group.add().CopyFrom(run_group)
+    with self._lock:
+      return self.workflow_service.WriteRunGroups(request)
+
+  def WriteRunGroupsBatch(self, run_groups):
+    request = scout_pb2.WriteRunGroupsRequest()
+    for run_group in run_groups:
+      request.run_group.add().CopyFrom(run_group)
+    with self._lock:
+      return self.workflow_service.WriteRunGroups(request)
+
+  def ListSites(self, page_token, page_size):
+    request = scout_pb2.GetSitesRequest()
+    request.page_token = page_token
+    request.page_size = page_size
+    with self._lock:
+      response = self.workflow_service.GetSites(request)
+    return list(response.site), response.next_page_token
+
+  def ListCollections(self, page_token, page_size):
+    request = scout_pb2.GetCollectionsRequest()
+    request.page_token = page_token
+    request.page_size = page_size
+    with self._lock:
+      response = self.workflow_service.GetCollections(request)
+    return list(response.collection), response.next_page_token
@@ -0,0 +1,115 @@
+"""Tests for the bulk import engine."""
+
+import threading
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.workflow.tools import in_memory_workflow_service
+
+
+class FlakyDatastore(object):
+  """Datastore whose CreateSite fails the first time for every site."""
+
+  def __init__(self):
+    self.calls = []
+    self._lock = threading.Lock()
+
+  def CreateSite(self, new_site):
+    name = new_site.metadata.name.localized_string[0].translation
+    with self._lock:
+      self.calls.append(('CreateSite', name))
+      if self.calls.count(('CreateSite', name)) == 1:
+        raise IOError('deadline exceeded')
+    return 'site-' + name
+
+  def CreateCollection(self, site_id, collection):
+    with self._lock:
+      self.calls.append(('CreateCollection', site_id))
+    return 'collection-' + site_id
+
+  def WriteRunGroups(self, run_group):
+    with self._lock:
+      self.calls.append(('WriteRunGroups', list(run_group.run_id)))
+    return True
+
+
+class RejectingDatastore(FlakyDatastore):
+  """Datastore that rejects one site as invalid and fails no other RPC."""
+
+  def __init__(self, rejected_name):
+    super(RejectingDatastore, self).__init__()
+    self._rejected_name = rejected_name
+
+  def CreateSite(self, new_site):
+    name = new_site.metadata.name.localized_string[0].translation
+    with self._lock:
+      self.calls.append(('CreateSite', name))
+    if name == self._rejected_name:
+      raise ValueError('invalid site')
+    return 'site-' + name
+
+
+class BulkImportTests(googletest.TestCase):
+
+  def _Sites(self, num_sites):
+    sites = []
+    for i in range(num_sites):
+      site = collects_to_scout.CurrentIssue('Site {}'.format(i), '')
+      site.method = 'Car'
+      site.lat = 1.0 + i
+      site.lon = 2.0
+      site.runs = ['run{}'.format(i)]
+      sites.append(site)
+    return sites
+
+  def _ImportSite(self, site, datastore, result):
+    collects_to_scout.ImportSite(site, False, datastore, result)
+
+  def testBulkImportInMemory(self):
+    """Test importing sites into an InMemoryWorkflowService."""
+    workflow_service = in_memory_workflow_service.InMemoryWorkflowService()
+    datastore = bulk_import.WorkflowServiceDatastore(workflow_service)
+
+    results = bulk_import.BulkImport(self._Sites(10), self._ImportSite,
+                                     datastore, max_concurrency=4)
+
+    self.assertEqual(10, len(results))
+    self.assertTrue(all(result.ok for result in results))
+    self.assertEqual(10, len(set(result.site_id for result in results)))
+    self.assertEqual(['Site {}'.format(i) for i in range(10)],
+                     [result.name for result in results])
+
+  def testTransientErrorsAreRetried(self):
+    """Test that failed RPCs are retried and steps stay in order."""
+    datastore = FlakyDatastore()
+
+    results = bulk_import.BulkImport(self._Sites(3), self._ImportSite,
+                                     datastore, max_concurrency=2,
+                                     sleep=lambda seconds: None)
+
+    self.assertTrue(all(result.ok for result in results))
+    self.assertEqual([1, 1, 1], [result.retries for result in results])
+    self.assertEqual('collection-site-Site 1', results[1].collection_id)
+    for i in range(3):
+      site_id = 'site-Site {}'.format(i)
+      self.assertLess(datastore.calls.index(('CreateSite', 'Site %d' % i)),
+                      datastore.calls.index(('CreateCollection', site_id)))
+
+  def testPermanentErrorsAreReported(self):
+    """Test that errors that are not transient fail the site at once."""
+    datastore = RejectingDatastore('Site 0')
+
+    results = bulk_import.BulkImport(self._Sites(2), self._ImportSite,
+                                     datastore, sleep=lambda seconds: None)
+
+    self.assertFalse(results[0].ok)
+    self.assertEqual(0, results[0].retries)
+    self.assertEqual(1, datastore.calls.count(('CreateSite', 'Site 0')))
+    self.assertTrue(results[1].ok)
+    self.assertIn('1 failed', bulk_import.Summary(results))
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -6,17 +6,48 @@ packages data into a protocol buffer, and invokes the RPC system
 """
 
 import csv
+import itertools
 import json
+import multiprocessing
+import os
 import re
 import sys
 import urllib
 
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import command_line
+from google3.cityblock.special.legacy import external_sort
+from google3.cityblock.special.legacy import gazetteer
+from google3.cityblock.special.legacy import geocode_cache
+from google3.cityblock.special.legacy import geocode_pool
+from google3.cityblock.special.legacy import import_journal
+from google3.cityblock.special.legacy import name_index
 from google3.cityblock.special.legacy import parse_run_groups_config
-from google3.cityblock.special.workflow.client import scout_client
+from google3.cityblock.special.legacy import pipeline
+from google3.cityblock.special.legacy import run_group_writer
+from google3.cityblock.special.legacy import run_table
+from google3.cityblock.special.legacy import scout_pool
+from google3.cityblock.special.legacy import site_manifest
+from google3.cityblock.special.legacy import site_records
+from google3.cityblock.special.legacy import spatial_index
+from google3.cityblock.special.legacy import stage_metrics
 from google3.cityblock.special.workflow.proto import scout_pb2
 
+GEOCODE_CACHE_PATH = os.path.expanduser('~/.collects_to_scout_geocode.json')
+IMPORT_JOURNAL_PATH = os.path.expanduser('~/.collects_to_scout_journal')
+GEOCODE_BATCH_SIZE = 1000
+SORT_BUFFER_SIZE = 100000
+OUTPUT_BUFFER_SIZE = 1 << 16
+CSV_HEADERS = ['SITE', 'METHOD', 'ADDRESS', 'LATITUDE', 'LONGITUDE', 'RUNS']
+
+
+class GeocodeError(IOError):
+  """The geocoding API answered with an error status such as a quota error."""
+
 
 class CurrentIssue(object):
+  __slots__ = ('issue_name', 'address', 'lat', 'lon', '_method', '_runs')
+
   def __init__(self, issue_name, address):
     self.issue_name = issue_name
     self.address = address
@@ -25,13 +56,87 @@ class CurrentIssue(object):
     self.method = []
     self.runs = []
 
+  @property
+  def method(self):
+    return self._method
+
+  @method.setter
+  def method(self, method):
+    # a handful of equipment names repeat across every row
+    self._method = intern(method) if isinstance(method, str) else method
+
+  @property
+  def runs(self):
+    return self._runs
+
+  @runs.setter
+  def runs(self, runs):
+    self._runs = run_table.RunList(runs)
+
+  def __getstate__(self):
+    return (self.issue_name, self.address, self.lat, self.lon, self.method,
+            list(self.runs))
+
+  def __setstate__(self, state):
+    (self.issue_name, self.address, self.lat, self.lon, self.method,
+     self.runs) = state
+
   def __str__(self):
     return '{}, {}, {}, {}, {}'.format(
         self.issue_name, self.method, self.address,
         self.lat, self.lon, self.runs)
 
 
-def Parser(arg_file):
+def _ReadSites(arg_file):
+  """Yields a site object without coordinates for each spreadsheet row."""
+  with open(arg_file, 'rb') as csvfile:
+    readme = csv.DictReader(csvfile, fieldnames=None)
+
+    for row in readme:
+      # print row
+      issue_name = row['Location Name'].strip()
+      method = row['Equipment'].strip()
+      address = row['Address'].strip()
+
+      site = CurrentIssue(issue_name, address)
+      site.method = method
+      yield site
+
+
+def _GeocodeSites(sites, geocode, num_workers, batch_size=None):
+  """Yields sites in order after filling in their coordinates.
+
+  Args:
+    sites: Iterable of site objects.
+    geocode: Function mapping an address to (lat, lon).
+    num_workers: Number of addresses to geocode concurrently.
+    batch_size: Number of sites geocoded together when num_workers is more
+      than one, or None to geocode all sites together.
+
+  Yields:
+    Site objects with lat and lon set.
+  """
+  if num_workers <= 1:
+    for site in sites:
+      site.lat, site.lon = geocode(site.address)
+      yield site
+    return
+
+  batch = []
+  for site in itertools.chain(sites, [None]):
+    if site is not None:
+      batch.append(site)
+      if batch_size is None or len(batch) < batch_size:
+        continue
+    coordinates = geocode_pool.GeocodeAll(
+        [batch_site.address for batch_site in batch], geocode, num_workers)
+    for batch_site in batch:
+      batch_site.lat, batch_site.lon = coordinates[batch_site.address]
+      yield batch_site
+    batch = []
+
+
+def Parser(arg_file, geocode=None, num_workers=1):
   """Parses a spreadsheet for relevent data.
 
   Parses through a csv file (spreadsheet) and extracts required information
@@ -40,107 +145,294 @@ def Parser(arg_file):
   Args:
     arg_file: CSV file containing all collection information for a particular
       country.
+    geocode: Function mapping an address to (lat, lon), e.g. a cached
+      geocoder.  Defaults to Geocode.
+    num_workers: Number of addresses to geocode concurrently.  With more than
+      one worker, each distinct address is geocoded once after all rows are
+      read; geocode must then be thread-safe.
 
   Returns:
     List of sites objects
   """
-  sites = []
+  sites = list(_GeocodeSites(_ReadSites(arg_file), geocode or Geocode,
+                             num_workers))
 
-  with open(arg_file, 'rb') as csvfile:
-    readme = csv.DictReader(csvfile, fieldnames=None)
+  # sort the list of site objects based on the site name
+  sites = sorted(sites, key=lambda CurrentIssue: CurrentIssue.issue_name)
 
-    for row in readme:
-      # print row
-      issue_name = row['Location Name'].strip()
-      method = row['Equipment'].strip()
-      address = row['Address'].strip()
-      lat, lon = Geocode(address)
+  return sites
 
-      site = CurrentIssue(issue_name, address)
-      site.method = method
-      site.lat = lat
-      site.lon = lon
-      sites.append(site)
 
-  # sort the list of site objects based on the site name
-  sites = sorted(sites, key=lambda CurrentIssue: CurrentIssue.issue_name)
+def IterParser(arg_file, geocode=None, num_workers=1, sort=False,
+               batch_size=GEOCODE_BATCH_SIZE, max_in_memory=SORT_BUFFER_SIZE):
+  """Streams the sites of a spreadsheet with bounded memory.
+
+  Args:
+    arg_file: CSV file containing all collection information for a particular
+      country.
+    geocode: Function mapping an address to (lat, lon), defaults to Geocode.
+    num_workers: Number of addresses to geocode concurrently.
+    sort: Whether to yield sites in the order Parser returns them, using an
+      external sort that spills to temporary files; otherwise sites are
+      yielded in file order.
+    batch_size: Number of rows geocoded together when num_workers is more
+      than one.
+    max_in_memory: Maximum number of sites held in memory while sorting.
 
+  Returns:
+    Iterator of site objects.
+  """
+  sites = _GeocodeSites(_ReadSites(arg_file), geocode or Geocode, num_workers,
+                        batch_size)
+  if sort:
+    sites = external_sort.ExternalSort(
+        sites, lambda CurrentIssue: CurrentIssue.issue_name, max_in_memory)
   return sites
 
 
+def _OutputName(arg_file, extension):
+  return re.sub(r'(\w+).csv', r'\1_toScout.' + extension, arg_file)
+
+
 def ToCSV(arg_file, sites):
   """Write to a new csv file comprising all required fields.
 
   Create a new csv file containing site and collection information to be
-  imported to Scout.
+  imported to Scout.  Fields are quoted as needed and runs are written space
+  separated in a single column.
 
   Args:
     arg_file: CSV file of collections specific to country where the name is
       modified to create new csv file name.
-    sites: List of site objects
+    sites: Iterable of site objects
+  """
+  name_change = _OutputName(arg_file, 'csv')
+
+  with open(name_change, 'wb', OUTPUT_BUFFER_SIZE) as out_file:
+    writer = csv.writer(out_file)
+
+    # Write headers for site data
+    writer.writerow(CSV_HEADERS)
+
+    for site in sites:
+      writer.writerow(_CSVRow(site))
+
+
+def _CSVRow(site):
+  return [site.issue_name, getattr(site, 'method', None) or '',
+          getattr(site, 'address', None) or '',
+          '' if site.lat is None else repr(site.lat),
+          '' if site.lon is None else repr(site.lon),
+          ' '.join(site.runs)]
+
+
+def ReadCSV(csv_file):
+  """Yields the site objects of a csv file written by ToCSV."""
+  with open(csv_file, 'rb', OUTPUT_BUFFER_SIZE) as in_file:
+    reader = csv.reader(in_file)
+    next(reader)
+    for name, method, address, lat, lon, runs in reader:
+      site = CurrentIssue(name, address or None)
+      site.method = method
+      site.lat = float(lat) if lat else None
+      site.lon = float(lon) if lon else None
+      site.runs = runs.split()
+      yield site
+
+
+def ToRecordFile(arg_file, sites, is_legacy):
+  """Write sites to a binary file of SiteProto and RunGroupProto records.
+
+  Args:
+    arg_file: CSV file of collections specific to country where the name is
+      modified to create the record file name.
+    sites: Iterable of site objects.
+    is_legacy: boolean value whether data is is legacy data.
+
+  Returns:
+    Number of records written.
+  """
+  def Records():
+    for site in sites:
+      new_site = NewSiteProto(site, is_legacy)
+      AddCollectionProto(new_site, site, is_legacy)
+      run_group = scout_pb2.RunGroupProto()
+      run_group.run_id.extend(site.runs)
+      fields = {'country_code': getattr(site, 'country_code', None),
+                'address': getattr(site, 'address', None),
+                'method': getattr(site, 'method', None) or None}
+      yield new_site, run_group, fields
+
+  return site_records.WriteRecords(_OutputName(arg_file, 'rec'), Records())
+
+
+def _Bytes(value):
+  # json and proto strings decode to unicode while site fields are byte
+  # strings
+  return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def LoadRecordFile(record_file):
+  """Yields site objects for the records written by ToRecordFile.
+
+  Legacy sites come back as LegacyIssue objects and the others as
+  CurrentIssue objects.
   """
-  name_change = re.sub(r'(\w+).csv', r'\1_toScout.csv', arg_file)
+  for new_site, run_group, fields in site_records.ReadRecords(record_file):
+    name = _Bytes(new_site.metadata.name.localized_string[0].translation)
+    if fields['country_code'] is not None:
+      site = parse_run_groups_config.LegacyIssue(
+          name, _Bytes(fields['country_code']))
+    else:
+      site = CurrentIssue(name, _Bytes(fields['address']))
+      site.method = _Bytes(fields['method']) or []
+    if new_site.metadata.HasField('lat'):
+      site.lat = new_site.metadata.lat
+      site.lon = new_site.metadata.lng
+    site.runs = list(run_group.run_id)
+    yield site
+
+
+def LoadRecordFiles(record_files):
+  """Returns the sites of record files written by ToRecordFile, in order."""
+  sites = []
+  for record_file in record_files:
+    sites.extend(LoadRecordFile(record_file))
+  return sites
+
 
-  out_file = open(name_change, 'w')
+def _ExtendRuns(site, runs):
+  """Appends the run ids of runs that site does not already have."""
+  seen = set(site.runs)
+  for run in runs:
+    if run not in seen:
+      seen.add(run)
+      site.runs.append(run)
 
-  # Write headers for site data
-  headers = 'SITE, METHOD, ADDRESS, LATITUDE, LONGITUDE, RUNS'
-  out_file.write(headers + '\n')
 
-  # Write site data into a comma separated string
+def _FoldByName(sites):
+  """Merges sites sharing a name into the first one seen.
+
+  Returns:
+    A tuple (dictionary of name -> site, list of sites in first-seen order).
+  """
+  merged = {}
+  order = []
   for site in sites:
-    site_data = str(site)
-    site_data += '\n'
-    out_file.write(site_data)
+    existing = merged.get(site.issue_name)
+    if existing is None:
+      merged[site.issue_name] = site
+      order.append(site)
+    else:
+      _ExtendRuns(existing, site.runs)
+  return merged, order
+
+
+def IndexLegacySites(legacy_sites):
+  """Prepares legacy sites once for merging with many spreadsheets.
+
+  Args:
+    legacy_sites: List of site objects containing legacy collections.
 
-  out_file.close()
+  Returns:
+    List of legacy sites, one per name, sorted by name.
+  """
+  _, order = _FoldByName(legacy_sites)
+  return sorted(order, key=lambda CurrentIssue: CurrentIssue.issue_name)
 
 
-def Merger(current_sites, legacy_sites):
+def Merger(current_sites, legacy_sites, legacy_index=None,
+           fuzzy_threshold=None):
   """Combine sites' data from two different sources.
 
   Find data from two list of site objects from csv files and legacy collections
   and merge indentical sites with necessary information (site name, location,
-  method, and runs).
+  method, and runs).  Sites are matched on issue_name through a dictionary
+  index, so the merge is linear in the number of sites.
 
   Args:
     current_sites: List of site objects containing data from spreadsheets.
     legacy_sites: List of site objects containing legacy collections.
+    legacy_index: Result of IndexLegacySites(legacy_sites), to avoid
+      preparing the legacy sites again for every spreadsheet.
+    fuzzy_threshold: If set, legacy sites without an exact match are also
+      merged into the spreadsheet site without one whose name is most
+      similar, if the similarity (0 to 1) is at least this high.
 
   Returns:
-    List of merged site objects.
+    List of merged site objects, one per site name, sorted by name.
   """
-  match = False
-
-  # merge runs from legacy sites to current site objects
-  for site in current_sites[:]:
-    for legacy_data in sorted(legacy_sites,
-                              key=lambda CurrentIssue: CurrentIssue.issue_name):
-      if site.issue_name == legacy_data.issue_name:
-        site.runs.extend(legacy_data.runs)
-        match = True
-      # no match found, just add site object to the list
-      if not match:
-        current_sites.append(legacy_data)
-      else:
-        match = False
-
-  return sorted(current_sites,
+  if legacy_index is None:
+    legacy_index = IndexLegacySites(legacy_sites)
+
+  # the first site seen for a name absorbs the runs of later duplicates
+  merged, order = _FoldByName(current_sites)
+  unmatched = []
+  matched_names = set()
+  for legacy_data in legacy_index:
+    existing = merged.get(legacy_data.issue_name)
+    if existing is None:
+      unmatched.append(legacy_data)
+    else:
+      matched_names.add(legacy_data.issue_name)
+      _ExtendRuns(existing, legacy_data.runs)
+
+  if fuzzy_threshold and unmatched:
+    absorbed = set()
+    for current, legacy_data, _ in name_index.FindSimilar(
+        [site for site in order if site.issue_name not in matched_names],
+        unmatched, fuzzy_threshold):
+      _ExtendRuns(current, legacy_data.runs)
+      absorbed.add(id(legacy_data))
+    unmatched = [site for site in unmatched if id(site) not in absorbed]
+
+  # both lists are sorted, so the final sort only merges two runs
+  order.sort(key=lambda CurrentIssue: CurrentIssue.issue_name)
+  return sorted(order + unmatched,
                 key=lambda CurrentIssue: CurrentIssue.issue_name)
 
 
-def CreateSite(site, is_legacy):
-  """Create a new site.
+def MergeColocated(sites, max_distance_m, apply=False):
+  """Finds legacy sites that Merger left next to a differently named site.
 
-  The following functions invoke functions that use the Stubby interface
-  to create a site and import to Scout.
+  Args:
+    sites: List of merged site objects, as returned by Merger.
+    max_distance_m: Largest distance in meters between co-located sites.
+    apply: Whether to merge the runs of each legacy site into the spreadsheet
+      site next to it and drop the legacy site.
+
+  Returns:
+    A tuple (sites, pairs) of the resulting sites and the list of
+    spatial_index.ColocatedPair objects found.
+  """
+  legacy_sites = []
+  current_sites = []
+  for site in sites:
+    if isinstance(site, parse_run_groups_config.LegacyIssue):
+      legacy_sites.append(site)
+    else:
+      current_sites.append(site)
+  pairs = spatial_index.FindColocated(current_sites, legacy_sites,
+                                      max_distance_m)
+  if not apply:
+    return sites, pairs
+
+  absorbed = set()
+  for pair in pairs:
+    _ExtendRuns(pair.current, pair.legacy.runs)
+    absorbed.add(id(pair.legacy))
+  return [site for site in sites if id(site) not in absorbed], pairs
+
+
+def NewSiteProto(site, is_legacy):
+  """Builds the SiteProto sent to Scout for a site.
 
   Args:
     site: site object containing site information.
     is_legacy: boolean value whether data is is legacy data.
 
   Returns:
-    New site id, SiteProto object, and Scout Datastore object.
+    SiteProto object.
   """
   new_site = scout_pb2.SiteProto()
 
@@ -148,13 +440,14 @@ def CreateSite(site, is_legacy):
   site_name.translation = site.issue_name
   site_name.locale = 'en-US'   # default to en-US locale
 
-  new_site.metadata.lat = site.lat
-  new_site.metadata.lng = site.lon
+  if site.lat is not None:
+    new_site.metadata.lat = site.lat
+    new_site.metadata.lng = site.lon
 
   if is_legacy:   # LAUNCHED
-    new_site.metadata.state = site.CLOSED
+    new_site.metadata.state = new_site.metadata.CLOSED
   else:   # NOT LAUNCHED
-    new_site.metadata.state = site.ACTIVE
+    new_site.metadata.state = new_site.metadata.ACTIVE
 
   # building = new_site.metadata.building.add()
   # bldg_name = building.name   #building name-TranslatedStringProto (optional)
@@ -172,47 +465,84 @@ def CreateSite(site, is_legacy):
   # local_abbr.translation = changeme  # (ex. 1 for ground floor)
   # local_abbr.locale = 'en-US'
 
-  scout_datastore_obj = scout_client.NewStubbyScoutDatastore()
+  return new_site
+
+
+def CreateSite(site, is_legacy, scout_datastore_obj=None):
+  """Create a new site.
+
+  The following functions invoke functions that use the Stubby interface
+  to create a site and import to Scout.
+
+  Args:
+    site: site object containing site information.
+    is_legacy: boolean value whether data is is legacy data.
+    scout_datastore_obj: Scout Datastore object, defaults to one backed by the
+      process-wide stub pool.
+
+  Returns:
+    New site id, SiteProto object, and Scout Datastore object.
+  """
+  new_site = NewSiteProto(site, is_legacy)
+
+  if scout_datastore_obj is None:
+    scout_datastore_obj = scout_pool.PooledDatastore(scout_pool.SharedPool())
   site_id = scout_datastore_obj.CreateSite(new_site)
 
   return site_id, new_site, scout_datastore_obj
 
 
-def CreateCollection(site_id, new_site, scout_datastore_obj,
-                     site, is_legacy):
-  """Create a new collection for the site.
-
-  The new collection shall include the type of equipment
-  used to obtain the collection currently set to only
-  have one method (e.g. Car, Trike, Trolley, etc.).
+def AddCollectionProto(new_site, site, is_legacy):
+  """Adds the CollectionProto for a site's collection to its SiteProto.
 
   Args:
-    site_id: Site id.
     new_site: SiteProto object.
-    scout_datastore_obj: Scout Datastore object.
     site: site object containing site data.
     is_legacy: State of collection
 
   Returns:
-    New collection id and CollectionProto object.
+    CollectionProto object.
   """
   collection = new_site.metadata.collection.add()
   collect_method = collection.metadata.method.add()
-  collect_method = site.method.upper()
+  # legacy sites have no equipment column
+  collect_method = (getattr(site, 'method', None) or '').upper()
 
   if is_legacy:   # LAUNCHED
-    collection.metadata.state = new_site.metadata.collection.LAUNCHED
+    collection.metadata.state = collection.metadata.LAUNCHED
   else:   # NOT LAUNCHED
     if site.runs:   # runs are uploaded so collection has been collected
       if site.method == 'CAR' or 'TRIKE' or 'SNOWMOBILE' or 'TREKKER':
         collection.metadata.state = (
-            (new_site.metadata.collection.GEOMETRY_REVIEW_COMPLETE))
+            (collection.metadata.GEOMETRY_REVIEW_COMPLETE))
       else:   # TROLLEY
         collection.metadata.state = (
-            (new_site.metadata.collection.HOUSECAT_COMPLETE))
+            (collection.metadata.HOUSECAT_COMPLETE))
     else:  # NEED TO MANUALLY CHECK COLLECTION
-      collection.metadata.state = new_site.metadata.collection.COLLECTED
+      collection.metadata.state = collection.metadata.COLLECTED
+
+  return collection
+
+
+def CreateCollection(site_id, new_site, scout_datastore_obj,
+                     site, is_legacy):
+  """Create a new collection for the site.
+
+  The new collection shall include the type of equipment
+  used to obtain the collection currently set to only
+  have one method (e.g. Car, Trike, Trolley, etc.).
+
+  Args:
+    site_id: Site id.
+    new_site: SiteProto object.
+    scout_datastore_obj: Scout Datastore object.
+    site: site object containing site data.
+    is_legacy: State of collection
 
+  Returns:
+    New collection id and CollectionProto object.
+  """
+  collection = AddCollectionProto(new_site, site, is_legacy)
   collection_id = scout_datastore_obj.CreateCollection(site_id, collection)
   return collection_id, collection
 
@@ -233,16 +563,77 @@ def WriteRunGroups(new_collect, scout_datastore_obj, site):
   """
   run_group = scout_pb2.RunGroupProto()
 
-  for run_id in site.runs:
+  for run_id in run_group_writer.DedupeRuns(site.runs):
     # run = new_collect.metadata.run.add()
     # run.id = run_id
-    run = run_group.run_id.add()
-    run = run_id
+    run_group.run_id.append(run_id)
 
   status = scout_datastore_obj.WriteRunGroups(run_group)
   return status
 
 
+def ImportSite(site, is_legacy, scout_datastore_obj, result, journal=None,
+               writer=None, scout_index=None, known=None):
+  """Imports one site, its collection and its run groups to Scout.
+
+  Args:
+    site: site object containing site data.
+    is_legacy: boolean value whether data is is legacy data.
+    scout_datastore_obj: Scout datastore object.
+    result: bulk_import.SiteResult recording each completed step.
+    journal: import_journal.ImportJournal; steps it already holds for the
+      site are skipped and newly completed ones are recorded in it.
+    writer: run_group_writer.RunGroupWriter to queue the runs on instead of
+      writing them here; result.status, a failure and the journal record of
+      the run groups are then filled in once the writer sends them.
+    scout_index: scout_prefetch.ScoutIndex of the sites already in Scout;
+      the steps it shows are done are skipped like journaled ones.
+    known: Dictionary of import_journal step -> value for steps done by an
+      earlier import, such as the ids site_manifest kept for a changed site;
+      they are skipped like journaled ones.
+  """
+  done = journal.Completed(site.issue_name) if journal else {}
+  for step, value in (known or {}).iteritems():
+    done.setdefault(step, value)
+  if scout_index is not None:
+    for step, value in scout_index.Decide(site).Completed().iteritems():
+      done.setdefault(step, value)
+
+  if import_journal.SITE_ID in done:
+    result.site_id = done[import_journal.SITE_ID]
+    new_site = NewSiteProto(site, is_legacy)
+  else:
+    result.site_id, new_site, _ = CreateSite(site, is_legacy,
+                                             scout_datastore_obj)
+    if journal:
+      journal.Record(site.issue_name, import_journal.SITE_ID, result.site_id)
+
+  if import_journal.COLLECTION_ID in done:
+    result.collection_id = done[import_journal.COLLECTION_ID]
+    new_collect = AddCollectionProto(new_site, site, is_legacy)
+  else:
+    result.collection_id, new_collect = CreateCollection(
+        result.site_id, new_site, scout_datastore_obj, site, is_legacy)
+    if journal:
+      journal.Record(site.issue_name, import_journal.COLLECTION_ID,
+                     result.collection_id)
+
+  if import_journal.RUN_GROUPS in done:
+    result.status = done[import_journal.RUN_GROUPS]
+  elif writer:
+    def Written(status, error):
+      result.status = status
+      if error is not None:
+        result.error = '{}: {}'.format(type(error).__name__, error)
+      elif journal:
+        journal.Record(site.issue_name, import_journal.RUN_GROUPS, True)
+    writer.Add(site.runs, Written)
+  else:
+    result.status = WriteRunGroups(new_collect, scout_datastore_obj, site)
+    if journal:
+      journal.Record(site.issue_name, import_journal.RUN_GROUPS, True)
+
+
 def Geocode(address):
   """Uses Google API to geocode site addresses.
 
@@ -253,7 +644,12 @@ def Geocode(address):
     address: The address to convert to latitude and longitude.
 
   Returns:
-    Latitude and longitude or empty lat and lon if no address is present.
+    Latitude and longitude or empty lat and lon if no address is present or
+    the address has no results.
+
+  Raises:
+    GeocodeError: The API answered with any other error status, e.g. because
+      the quota was exceeded, so the result must not be cached.
   """
   if not address:
     return None, None
@@ -262,6 +658,11 @@ def Geocode(address):
          'sensor=false' % address)
   google_response = urllib.urlopen(url)
   json_response = json.loads(google_response.read())
+  status = json_response.get('status', 'OK')
+  if status not in ('OK', 'ZERO_RESULTS'):
+    raise GeocodeError('{} for {}'.format(status, address))
+  if not json_response['results']:
+    return None, None
   # for s in json_response['results']:
   s = json_response['results'][0]
   latlong = s['geometry']['location']
@@ -271,12 +672,456 @@ def Geocode(address):
   return lat, lon
 
 
+def ProcessFile(arg_file, geocode, num_workers=1, is_legacy=False,
+                legacy_index=None, write_csv=False, write_records=False,
+                metrics=None, max_distance_m=None, merge_colocated=False,
+                fuzzy_threshold=None):
+  """Parses one spreadsheet, merges it with legacy sites and writes it out.
+
+  Args:
+    arg_file: CSV file containing all collection information for a particular
+      country.
+    geocode: Function mapping an address to (lat, lon).
+    num_workers: Number of addresses to geocode concurrently.
+    is_legacy: Whether to merge with legacy sites.
+    legacy_index: Result of IndexLegacySites for the legacy sites.
+    write_csv: Whether to write the merged sites with ToCSV.
+    write_records: Whether to write the merged sites with ToRecordFile.
+    metrics: stage_metrics.Metrics recording the time of each stage.
+    max_distance_m: If set, legacy sites within this many meters of a
+      differently named spreadsheet site are reported.
+    merge_colocated: Whether to also merge those legacy sites.
+    fuzzy_threshold: Name similarity at which Merger also merges sites
+      without an exact name match, or None to only merge exact matches.
+
+  Returns:
+    A tuple (current_sites, sites, report) of the parsed and the merged sites
+    and the colocation report, or None when max_distance_m is not set.  The
+    report is returned rather than printed so --jobs workers do not
+    interleave their output.
+  """
+  metrics = metrics or stage_metrics.Metrics()
+  with metrics.Stage('parse'):
+    current_sites = Parser(arg_file, geocode, num_workers)
+  metrics.Count('spreadsheets')
+  metrics.Count('current_sites', len(current_sites))
+  report = None
+  if is_legacy:
+    with metrics.Stage('merge'):
+      sites = Merger(current_sites, None, legacy_index, fuzzy_threshold)
+    if max_distance_m:
+      with metrics.Stage('colocate'):
+        sites, pairs = MergeColocated(sites, max_distance_m, merge_colocated)
+      metrics.Count('colocated_pairs', len(pairs))
+      report = spatial_index.Report(pairs, merge_colocated)
+  else:
+    sites = current_sites
+  metrics.Count('merged_sites', len(sites))
+  if write_csv:
+    # Write site information to csv file
+    with metrics.Stage('write_csv'):
+      ToCSV(arg_file, sites)
+  if write_records:
+    with metrics.Stage('write_records'):
+      ToRecordFile(arg_file, sites, is_legacy)
+  return current_sites, sites, report
+
+
+def StreamFile(arg_file, geocode, num_workers=1, write_csv=False,
+               write_records=False, metrics=None):
+  """Converts one spreadsheet without holding its sites in memory.
+
+  The sites come from IterParser, so they are written in the order
+  ProcessFile writes them while only a sort buffer is kept.  When both
+  outputs are asked for they are written in the same pass, so each row is
+  geocoded once.
+
+  Args:
+    arg_file: CSV file containing all collection information for a particular
+      country.
+    geocode: Function mapping an address to (lat, lon).
+    num_workers: Number of addresses to geocode concurrently.
+    write_csv: Whether to write the sites like ToCSV.
+    write_records: Whether to write the sites with ToRecordFile.
+    metrics: stage_metrics.Metrics recording the time of each stage.
+  """
+  metrics = metrics or stage_metrics.Metrics()
+  sites = IterParser(arg_file, geocode, num_workers, sort=True)
+  metrics.Count('spreadsheets')
+  with metrics.Stage('stream'):
+    if not write_records:
+      ToCSV(arg_file, sites)
+      return
+    if not write_csv:
+      ToRecordFile(arg_file, sites, False)
+      return
+    with open(_OutputName(arg_file, 'csv'), 'wb',
+              OUTPUT_BUFFER_SIZE) as out_file:
+      writer = csv.writer(out_file)
+      writer.writerow(CSV_HEADERS)
+
+      def Written(sites):
+        for site in sites:
+          writer.writerow(_CSVRow(site))
+          yield site
+
+      ToRecordFile(arg_file, Written(sites), False)
+
+
+_job = None
+
+
+def _InitJob(job):
+  global _job
+  _job = job
+  if _job['cache']:
+    _job['cache'].hits = _job['cache'].misses = 0
+    # lookups are handed back to the parent after each file
+    _job['cache'].track_updates = True
+  if _job['metrics']:
+    # drop what the parent collected before forking
+    _job['metrics'].Take()
+
+
+def _RunJob(arg_file):
+  """Processes one spreadsheet in a worker process."""
+  cache = _job['cache']
+  metrics = _job['metrics']
+  args = (arg_file, _job['geocode'], _job['num_workers'], _job['is_legacy'],
+          _job['legacy_index'], _job['write_csv'], _job['write_records'],
+          metrics, _job['max_distance_m'], _job['merge_colocated'],
+          _job['fuzzy_threshold'])
+  if _job['profile']:
+    (current_sites, _, report), stats = stage_metrics.ProfileCall(
+        ProcessFile, *args)
+  else:
+    (current_sites, _, report), stats = ProcessFile(*args), None
+  metrics = metrics.Take() if metrics else None
+  if not cache:
+    return current_sites, report, [], 0, 0, metrics, stats
+  hits, misses = cache.hits, cache.misses
+  cache.hits = cache.misses = 0
+  return (current_sites, report, cache.TakeUpdates(), hits, misses, metrics,
+          stats)
+
+
+def ProcessFiles(arg_files, jobs, geocode, cache=None, num_workers=1,
+                 is_legacy=False, legacy_index=None, write_csv=False,
+                 write_records=False, metrics=None, max_distance_m=None,
+                 merge_colocated=False, fuzzy_threshold=None,
+                 worker_stats=None):
+  """Runs ProcessFile for many spreadsheets in worker processes.
+
+  Workers are forked after the legacy index is built, so they share it
+  without reparsing.  Per-file outputs are written by the workers; new
+  geocoding results are copied back into the parent's cache.
+
+  Args:
+    arg_files: CSV files to process.
+    jobs: Number of worker processes.
+    geocode: Function mapping an address to (lat, lon), wrapping cache.
+    cache: GeocodeCache used by geocode, or None.
+    num_workers: Number of addresses each worker geocodes concurrently.
+    is_legacy: Whether to merge with legacy sites.
+    legacy_index: Result of IndexLegacySites for the legacy sites.
+    write_csv: Whether to write the merged sites with ToCSV.
+    write_records: Whether to write the merged sites with ToRecordFile.
+    metrics: stage_metrics.Metrics, also used by geocode, to which the
+      workers' stage timings and counters are added.
+    max_distance_m: If set, legacy sites within this many meters of a
+      differently named spreadsheet site are reported.
+    merge_colocated: Whether to also merge those legacy sites.
+    fuzzy_threshold: Name similarity at which Merger also merges sites
+      without an exact name match, or None to only merge exact matches.
+    worker_stats: List yielded by stage_metrics.Profile to add the workers'
+      profiles to, or None to not profile them.
+
+  Returns:
+    A tuple (sites, reports) of the sites of every file merged by
+    MergeFiles and the colocation report of each file as returned by
+    ProcessFile.
+  """
+  job = {'geocode': geocode, 'cache': cache, 'num_workers': num_workers,
+         'is_legacy': is_legacy, 'legacy_index': legacy_index,
+         'write_csv': write_csv, 'write_records': write_records,
+         'metrics': metrics, 'max_distance_m': max_distance_m,
+         'merge_colocated': merge_colocated,
+         'fuzzy_threshold': fuzzy_threshold,
+         'profile': worker_stats is not None}
+  pool = multiprocessing.Pool(min(jobs, len(arg_files)), _InitJob, (job,))
+  try:
+    results = pool.map(_RunJob, arg_files, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+  for _, _, updates, hits, misses, job_metrics, stats in results:
+    if stats is not None:
+      worker_stats.append(stats)
+    if metrics:
+      metrics.Merge(job_metrics)
+    if cache:
+      for address, lat_lon in updates:
+        cache.Put(address, lat_lon)
+      cache.hits += hits
+      cache.misses += misses
+
+  current_sites = []
+  for result in results:
+    current_sites.extend(result[0])
+  reports = [result[1] for result in results]
+  return (MergeFiles(current_sites, is_legacy, legacy_index, max_distance_m,
+                     merge_colocated, fuzzy_threshold), reports)
+
+
+def MergeFiles(current_sites, is_legacy=False, legacy_index=None,
+               max_distance_m=None, merge_colocated=False,
+               fuzzy_threshold=None):
+  """Merges the sites of every spreadsheet of a run into the sites to import.
+
+  Like the pipelined import, each name is imported once, with the runs of
+  every spreadsheet row and of the legacy site of that name.
+
+  Args:
+    current_sites: Parsed sites of all spreadsheets, as ProcessFile returns
+      them.
+    is_legacy: Whether to merge with legacy sites.
+    legacy_index: Result of IndexLegacySites for the legacy sites.
+    max_distance_m: Largest distance in meters at which merge_colocated
+      merges a legacy site into a differently named spreadsheet site.
+    merge_colocated: Whether to merge those legacy sites.
+    fuzzy_threshold: Name similarity at which Merger also merges sites
+      without an exact name match, or None to only merge exact matches.
+
+  Returns:
+    List of merged site objects sorted by name.
+  """
+  if not is_legacy:
+    return Merger(current_sites, [])
+  sites = Merger(current_sites, None, legacy_index, fuzzy_threshold)
+  if max_distance_m and merge_colocated:
+    sites, _ = MergeColocated(sites, max_distance_m, True)
+  return sites
+
+
+def _StreamMerge(sites, legacy_index=None):
+  """Merges legacy runs into sites as they arrive.
+
+  Streaming counterpart of Merger: each name is passed on once, with the runs
+  of the legacy site of the same name, and the legacy sites no spreadsheet
+  row named follow once the input ends.
+
+  Args:
+    sites: Iterable of site objects from spreadsheets.
+    legacy_index: Result of IndexLegacySites, or None.
+
+  Yields:
+    Merged site objects.
+  """
+  legacy_by_name = dict((site.issue_name, site)
+                        for site in legacy_index or ())
+  seen = set()
+  for site in sites:
+    if site.issue_name in seen:
+      continue
+    seen.add(site.issue_name)
+    legacy_data = legacy_by_name.get(site.issue_name)
+    if legacy_data is not None:
+      _ExtendRuns(site, legacy_data.runs)
+    yield site
+  for legacy_data in legacy_index or ():
+    if legacy_data.issue_name not in seen:
+      yield legacy_data
+
+
+def PipelinedImport(arg_files, geocode, import_site, datastore,
+                    legacy_index=None, geocode_workers=1, import_workers=8,
+                    queue_size=pipeline.DEFAULT_QUEUE_SIZE):
+  """Imports spreadsheets with reading, geocoding, merging and RPCs overlapped.
+
+  Rows flow through bounded queues, so sites are sent to Scout while later
+  rows are still being read and geocoded, and a slow stage holds back the
+  ones before it instead of letting sites pile up in memory.
+
+  Args:
+    arg_files: CSV files to import.
+    geocode: Thread-safe function mapping an address to (lat, lon).
+    import_site: Function (site, scout_datastore_obj, result) as taken by
+      bulk_import.BulkImport.
+    datastore: Scout datastore object shared by the import threads.
+    legacy_index: Result of IndexLegacySites to merge with, or None.
+    geocode_workers: Number of geocoding threads.
+    import_workers: Number of sites imported at once.
+    queue_size: Number of items each queue between stages holds.
+
+  Returns:
+    A tuple (results, report) of the SiteResult objects in the order the
+    imports finished and the pipeline.Pipeline report.
+  """
+  def Read(_):
+    for arg_file in arg_files:
+      for site in _ReadSites(arg_file):
+        yield site
+
+  def GeocodeSites(sites):
+    for site in sites:
+      site.lat, site.lon = geocode(site.address)
+      yield site
+
+  def Import(sites):
+    for site in sites:
+      yield bulk_import.ImportOne(site, import_site, datastore)
+
+  stages = pipeline.Pipeline(queue_size)
+  stages.AddStage('read', Read)
+  stages.AddStage('geocode', GeocodeSites, geocode_workers)
+  stages.AddStage('merge', lambda sites: _StreamMerge(sites, legacy_index))
+  stages.AddStage('import', Import, import_workers)
+  results = list(stages.Run())
+  return results, stages.Report()
+
+
+def SiteImporter(is_legacy, journal=None, writer=None, scout_index=None,
+                 diff=None):
+  """Returns the import_site function of an import run.
+
+  Both the bulk and the pipelined import use it, so every site of a run is
+  imported with the run's is_legacy, whether or not it was merged with a
+  legacy site.
+
+  Args:
+    is_legacy: Whether the run imports legacy data.
+    journal: import_journal.ImportJournal, or None.
+    writer: run_group_writer.RunGroupWriter, or None.
+    scout_index: scout_prefetch.ScoutIndex, or None.
+    diff: site_manifest.ManifestDiff whose known ids changed sites reuse, or
+      None.
+
+  Returns:
+    Function (site, scout_datastore_obj, result) calling ImportSite.
+  """
+  def ImportOne(site, scout_datastore_obj, result):
+    ImportSite(site, is_legacy, scout_datastore_obj, result, journal, writer,
+               scout_index, diff.Known(site.issue_name) if diff else None)
+  return ImportOne
+
+
+def _CountImport(metrics, results, pool, writer):
+  """Records import outcomes, run-group writes and datastore pool reuse."""
+  metrics.Count('import.ok', sum(1 for result in results if result.ok))
+  metrics.Count('import.failed', sum(1 for result in results if not result.ok))
+  metrics.Count('import.retries', sum(result.retries for result in results))
+  metrics.Count('datastore_pool.created', pool.created)
+  metrics.Count('datastore_pool.reused', pool.reused)
+  metrics.Count('datastore_pool.recreated', pool.recreated)
+  metrics.Count('run_groups.rpcs', writer.rpcs)
+  metrics.Count('run_groups.rpcs_saved', writer.rpcs_saved)
+  metrics.Count('run_groups.retries', writer.retries)
+  metrics.Count('run_groups.bytes_sent', writer.bytes_sent)
+  metrics.Count('run_groups.duplicate_runs', writer.duplicate_runs)
+
+
+def _SkipGeocodeErrors(geocode, metrics):
+  """Returns a geocoding function leaving sites it fails on without coordinates.
+
+  The error is raised past the cache, so the address is looked up again on
+  the next run instead of being stored as a negative entry.
+  """
+  def LenientGeocode(address):
+    try:
+      return geocode(address)
+    except GeocodeError as e:
+      metrics.Count('geocode.errors')
+      sys.stderr.write('Could not geocode: {}\n'.format(e))
+      return None, None
+  return LenientGeocode
+
+
+def _GazetteerGeocoder(gazetteer_db, fallback, metrics):
+  """Returns a geocoding function answering from a gazetteer first.
+
+  Args:
+    gazetteer_db: gazetteer.Gazetteer to look addresses up in.
+    fallback: Function geocoding the addresses the gazetteer does not know,
+      or None to leave them without coordinates.
+    metrics: stage_metrics.Metrics counting gazetteer hits and misses.
+  """
+  def GazetteerGeocode(address):
+    lat_lon = gazetteer_db.Geocode(address)
+    if lat_lon[0] is not None:
+      metrics.Count('gazetteer.hits')
+      return lat_lon
+    metrics.Count('gazetteer.misses')
+    if fallback is None:
+      return lat_lon
+    return fallback(address)
+  return GazetteerGeocode
+
+
 def main():
   args = sys.argv[1:]
+  metrics_path = command_line.PopOption(args, '--metrics')
+  profile_path = command_line.PopOption(args, '--profile')
+  metrics = stage_metrics.Metrics()
+  with stage_metrics.Profile(profile_path) as worker_stats:
+    _Main(args, metrics, worker_stats)
+  if metrics_path:
+    metrics.Save(metrics_path)
+
+
+def _Main(args, metrics, worker_stats=None):
+  """Runs the import with the options left after main's own.
+
+  Args:
+    args: Command line arguments without main's own options.
+    metrics: stage_metrics.Metrics of the run.
+    worker_stats: List yielded by stage_metrics.Profile, or None.
+  """
   is_legacy = False
 
+  num_workers = command_line.PopOption(args, '--geocode-workers', int, 1)
+  qps = command_line.PopOption(args, '--geocode-qps', float)
+  legacy_jobs = command_line.PopOption(args, '--legacy-jobs', int, 1)
+  bulk_midpoints = command_line.PopFlag(args, '--bulk-midpoints')
+  import_workers = command_line.PopOption(args, '--import-workers', int, 0)
+  pool_size = command_line.PopOption(args, '--pool-size', int,
+                                     scout_pool.DEFAULT_POOL_SIZE)
+  run_group_size = command_line.PopOption(args, '--run-group-size', int,
+                                          run_group_writer.DEFAULT_MAX_RUNS)
+  journal_path = command_line.PopOption(args, '--journal',
+                                        default=IMPORT_JOURNAL_PATH)
+  resume = command_line.PopFlag(args, '--resume')
+  manifest_path = command_line.PopOption(args, '--manifest')
+  write_records = command_line.PopFlag(args, '--write-records')
+  records = command_line.PopFlag(args, '--records')
+  jobs = command_line.PopOption(args, '--jobs', int, 1)
+  max_distance_m = command_line.PopOption(args, '--colocate', float)
+  merge_colocated = command_line.PopFlag(args, '--merge-colocated')
+  fuzzy_threshold = command_line.PopOption(args, '--fuzzy-match', float)
+  gazetteer_path = command_line.PopOption(args, '--gazetteer')
+  offline = command_line.PopFlag(args, '--offline')
+  pipelined = command_line.PopFlag(args, '--pipeline')
+  stream = command_line.PopFlag(args, '--stream')
+  queue_size = command_line.PopOption(args, '--queue-size', int,
+                                      pipeline.DEFAULT_QUEUE_SIZE)
+  if offline and not gazetteer_path:
+    print '--offline needs a --gazetteer to geocode from'
+    sys.exit()
+  if merge_colocated and not max_distance_m:
+    max_distance_m = spatial_index.DEFAULT_MAX_DISTANCE_M
+
   if not args:
-    print 'usage: [--legacy] [--write csvFile1 ...]'
+    print ('usage: [--jobs N] [--geocode-workers N] [--geocode-qps QPS] '
+           '[--legacy-jobs N] [--bulk-midpoints] [--import-workers N] '
+           '[--pool-size N] '
+           '[--run-group-size N] '
+           '[--journal PATH] [--resume] [--manifest PATH] '
+           '[--write-records] [--records] '
+           '[--metrics PATH|-] [--profile PATH] '
+           '[--colocate METERS] '
+           '[--merge-colocated] [--fuzzy-match THRESHOLD] '
+           '[--gazetteer PATH [--offline]] [--pipeline [--queue-size N]] '
+           '[--stream] [--legacy] [--write csvFile1 ...]')
     sys.exit()
   else:
     if args[0] == '--legacy':
@@ -284,13 +1129,6 @@ def main():
 
   if is_legacy:
     args = args[1:]
-    # extract site and runs from legacy collects
-    with open('/home/cb-ops-sys/www/special/legacy/reports/run_groups.config',
-              'rU') as f:
-      lines = f.readlines()
-    legacy_results = parse_run_groups_config.ParseRunGroupsConfig(lines)
-    sites = legacy_results
-
   write_csv = False
   if args:
     if args[0] == '--write':
@@ -300,28 +1138,176 @@ def main():
         print 'No CSV file to write to'
         sys.exit()
 
-  for arg_file in args:
-    current_sites = Parser(arg_file)
-    if is_legacy:
-      all_sites = Merger(current_sites, legacy_results)
-      sites = all_sites
-    else:
-      sites = current_sites
-    if write_csv:
-      # Write site information to csv file
-      ToCSV(arg_file, sites)
+  if records and (write_csv or write_records or pipelined or jobs > 1 or
+                  max_distance_m or fuzzy_threshold or gazetteer_path):
+    # record files hold sites that were already geocoded and merged
+    print ('--records cannot be combined with --write, --write-records, '
+           '--pipeline, --jobs, --colocate, --fuzzy-match or --gazetteer')
+    sys.exit()
+
+  if manifest_path and not import_workers:
+    print '--manifest only applies to an import, add --import-workers N'
+    sys.exit()
+
+  if pipelined and (write_csv or write_records or manifest_path or jobs > 1 or
+                    max_distance_m or fuzzy_threshold):
+    # these need every site of a file before anything is sent
+    print ('--pipeline cannot be combined with --write, --write-records, '
+           '--manifest, --jobs, --colocate or --fuzzy-match')
+    sys.exit()
+
+  if stream and (is_legacy or records or pipelined or import_workers or
+                 jobs > 1 or max_distance_m or fuzzy_threshold or
+                 not (write_csv or write_records)):
+    # only the per-file outputs can be written without holding the sites
+    print ('--stream needs --write or --write-records and cannot be combined '
+           'with --legacy, --records, --pipeline, --import-workers, --jobs, '
+           '--colocate or --fuzzy-match')
+    sys.exit()
+
+  if is_legacy and not records:
+    # extract site and runs from legacy collects
+    with metrics.Stage('load_legacy'):
+      legacy_results = parse_run_groups_config.LoadRunGroupsConfig(
+          parse_run_groups_config.RUN_GROUPS_CONFIG,
+          parse_run_groups_config.SNAPSHOT_PATH, legacy_jobs, bulk_midpoints,
+          worker_stats)
+    metrics.Count('legacy_sites', len(legacy_results))
+    sites = legacy_results
+
+  cache = geocode_cache.GeocodeCache(GEOCODE_CACHE_PATH)
+  if not records:
+    with metrics.Stage('load_geocode_cache'):
+      cache.Load()
+  jobs = min(jobs, len(args))
+  if offline:
+    geocode = None
+  else:
+    # latency of lookups that miss the cache, including rate limiting
+    geocode = metrics.Timed('geocode', Geocode)
+    if qps:
+      # each worker process gets an equal share of the quota
+      geocode = geocode_pool.RateLimit(geocode, qps / max(jobs, 1))
+    geocode = _SkipGeocodeErrors(cache.Wrap(geocode), metrics)
+  if gazetteer_path:
+    geocode = _GazetteerGeocoder(gazetteer.Gazetteer(gazetteer_path),
+                                 geocode, metrics)
+  legacy_index = None
+  if is_legacy and not records:
+    with metrics.Stage('index_legacy'):
+      legacy_index = IndexLegacySites(legacy_results)
+
+  if pipelined:
+    pool = scout_pool.SharedPool(pool_size)
+    datastore = stage_metrics.TimedDatastore(
+        scout_pool.PooledDatastore(pool), metrics)
+    # the Scout client writes one run group per RPC, so groups are deduped
+    # and split but not batched
+    writer = run_group_writer.RunGroupWriter(datastore, run_group_size)
+    journal = import_journal.ImportJournal(journal_path, resume)
+    try:
+      with metrics.Stage('pipeline'):
+        results, report = PipelinedImport(
+            args, geocode,
+            SiteImporter(is_legacy, journal, writer),
+            datastore, legacy_index, num_workers,
+            import_workers or bulk_import.DEFAULT_MAX_CONCURRENCY,
+            queue_size)
+        writer.Flush()
+    finally:
+      journal.Close()
+      cache.Save()
+    stage_metrics.CacheCounters(metrics, cache)
+    _CountImport(metrics, results, pool, writer)
+    print cache.Stats()
+    print report
+    print bulk_import.Summary(results)
+    print writer.Report()
+    print pool.Stats()
+    return
+
+  if stream:
+    try:
+      for arg_file in args:
+        StreamFile(arg_file, geocode, num_workers, write_csv, write_records,
+                   metrics)
+    finally:
+      cache.Save()
+    stage_metrics.CacheCounters(metrics, cache)
+    print cache.Stats()
+    return
+
+  if records:
+    with metrics.Stage('load_records'):
+      sites = LoadRecordFiles(args)
+    metrics.Count('record_sites', len(sites))
+  elif jobs > 1:
+    with metrics.Stage('process_files'):
+      sites, reports = ProcessFiles(
+          args, jobs, geocode, cache, num_workers, is_legacy, legacy_index,
+          write_csv, write_records, metrics, max_distance_m, merge_colocated,
+          fuzzy_threshold, worker_stats)
+    for report in reports:
+      if report is not None:
+        print report
+  else:
+    current_sites = []
+    for arg_file in args:
+      file_sites, _, report = ProcessFile(
+          arg_file, geocode, num_workers, is_legacy, legacy_index, write_csv,
+          write_records, metrics, max_distance_m, merge_colocated,
+          fuzzy_threshold)
+      current_sites.extend(file_sites)
+      if report is not None:
+        print report
+    with metrics.Stage('merge_files'):
+      sites = MergeFiles(current_sites, is_legacy, legacy_index,
+                         max_distance_m, merge_colocated, fuzzy_threshold)
+
+  if not records:
+    with metrics.Stage('save_geocode_cache'):
+      cache.Save()
+    stage_metrics.CacheCounters(metrics, cache)
+    print cache.Stats()
 
   # test printing
   print '\n'.join([str(r) for r in sites])
 
-  """for site in sites:
-    site_id, new_site, scout_datastore_obj = CreateSite((site, is_legacy)
-    collection_id, new_collect = CreateCollection(
-        site_id, new_site, scout_datastore_obj, site, is_legacy)
-    status = WriteRunGroups(new_collection, scout_datastore_obj, site)
-    print 'Status of WriteRunGroups():'
-    print status
-  """
+  diff = None
+  if manifest_path:
+    with metrics.Stage('manifest_diff'):
+      manifest = site_manifest.Load(manifest_path)
+      diff = site_manifest.Diff(sites, manifest)
+    metrics.Count('manifest.added', len(diff.added))
+    metrics.Count('manifest.changed', len(diff.changed))
+    metrics.Count('manifest.removed', len(diff.removed))
+    metrics.Count('manifest.unlinked', len(diff.unlinked))
+    print diff.Report()
+    sites = diff.Pending()
+
+  if import_workers:
+    pool = scout_pool.SharedPool(pool_size)
+    datastore = stage_metrics.TimedDatastore(
+        scout_pool.PooledDatastore(pool), metrics)
+    # the Scout client writes one run group per RPC, so groups are deduped
+    # and split but not batched
+    writer = run_group_writer.RunGroupWriter(datastore, run_group_size)
+    journal = import_journal.ImportJournal(journal_path, resume)
+    try:
+      with metrics.Stage('import'):
+        results = bulk_import.BulkImport(
+            sites, SiteImporter(is_legacy, journal, writer, diff=diff),
+            datastore, import_workers)
+        writer.Flush()
+    finally:
+      journal.Close()
+    _CountImport(metrics, results, pool, writer)
+    print bulk_import.Summary(results)
+    print writer.Report()
+    print pool.Stats()
+    if manifest_path:
+      site_manifest.Save(manifest_path,
+                         site_manifest.Update(manifest, diff, results))
 
 
 if __name__ == '__main__':
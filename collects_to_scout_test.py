@@ -1,10 +1,17 @@
 """Tests for CollectsToScout."""
 
+import json
 import os
+import StringIO
+import tempfile
 
 from google3.testing.pybase import googletest
 
+from google3.cityblock.special.legacy import bulk_import
 from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import geocode_cache
+from google3.cityblock.special.legacy import parse_run_groups_config
+from google3.cityblock.special.legacy import stage_metrics
 from google3.cityblock.special.workflow.proto import scout_pb2
 from google3.cityblock.special.workflow.tools import in_memory_workflow_service
 
@@ -24,6 +31,88 @@ class CollectsToScoutTests(googletest.TestCase):
 
     self.assertEqual(expected_sites, merged_sites)
 
+  def testMergerCombinesRuns(self):
+    """Test that sites sharing a name are merged once with unique runs."""
+    current = collects_to_scout.CurrentIssue('Louvre', '99 Rue de Rivoli')
+    current.runs = ['run1']
+    other = collects_to_scout.CurrentIssue('Alcatraz', 'San Francisco')
+    legacy_1 = parse_run_groups_config.LegacyIssue('Louvre', 'FR')
+    legacy_1.runs = ['run1', 'run2']
+    legacy_2 = parse_run_groups_config.LegacyIssue('Louvre', 'FR')
+    legacy_2.runs = ['run2', 'run3']
+    legacy_3 = parse_run_groups_config.LegacyIssue('Ischgi', 'AT')
+
+    merged_sites = collects_to_scout.Merger(
+        [current, other], [legacy_1, legacy_2, legacy_3])
+
+    self.assertEqual([other, legacy_3, current], merged_sites)
+    self.assertEqual(['run1', 'run2', 'run3'], current.runs)
+
+  def testMergerFuzzy(self):
+    """Test that similar names are only merged when asked to."""
+    current = collects_to_scout.CurrentIssue('Louvre Museum', 'Paris')
+    current.runs = ['run1']
+    exact = collects_to_scout.CurrentIssue('Tour Eiffel', 'Paris')
+    legacy = parse_run_groups_config.LegacyIssue('Louvre Museum Paris', 'FR')
+    legacy.runs = ['run2']
+    # already matched exactly, so not offered to another site
+    legacy_exact = parse_run_groups_config.LegacyIssue('Tour Eiffel', 'FR')
+
+    self.assertEqual([current, legacy, exact], collects_to_scout.Merger(
+        [current, exact], [legacy, legacy_exact]))
+    self.assertEqual(['run1'], current.runs)
+
+    self.assertEqual([current, exact], collects_to_scout.Merger(
+        [current, exact], [legacy, legacy_exact], fuzzy_threshold=0.8))
+    self.assertEqual(['run1', 'run2'], current.runs)
+
+  def testMergeColocated(self):
+    """Test that nearby legacy sites with other names are merged on request."""
+    current = collects_to_scout.CurrentIssue('Louvre', 'Paris')
+    current.lat, current.lon = 48.8608, 2.3376
+    current.runs = ['run1']
+    legacy = parse_run_groups_config.LegacyIssue('Musee Du Louvre', 'FR')
+    legacy.lat, legacy.lon = 48.8609, 2.3377
+    legacy.runs = ['run2']
+    far = parse_run_groups_config.LegacyIssue('Tour Eiffel', 'FR')
+    far.lat, far.lon = 48.8584, 2.2945
+    sites = collects_to_scout.Merger([current], [legacy, far])
+
+    proposed, pairs = collects_to_scout.MergeColocated(sites, 100)
+    self.assertEqual(sites, proposed)
+    self.assertEqual([(current, legacy)],
+                     [(pair.current, pair.legacy) for pair in pairs])
+    self.assertEqual(['run1'], current.runs)
+
+    merged, _ = collects_to_scout.MergeColocated(sites, 100, apply=True)
+    self.assertEqual([current, far], merged)
+    self.assertEqual(['run1', 'run2'], current.runs)
+
+  def testParserConcurrent(self):
+    """Test that concurrent geocoding matches the serial path."""
+
+    def FakeGeocode(address):
+      return float(len(address)), float(address.count(' '))
+
+    serial = collects_to_scout.Parser('sample.csv', FakeGeocode)
+    concurrent = collects_to_scout.Parser('sample.csv', FakeGeocode,
+                                          num_workers=4)
+
+    self.assertEqual([str(s) for s in serial], [str(s) for s in concurrent])
+
+  def testIterParserSorted(self):
+    """Test that the streaming parser matches Parser when sorting."""
+
+    def FakeGeocode(address):
+      return float(len(address)), 0.0
+
+    expected = collects_to_scout.Parser('sample.csv', FakeGeocode)
+    actual = collects_to_scout.IterParser(
+        'sample.csv', FakeGeocode, num_workers=2, sort=True, batch_size=2,
+        max_in_memory=2)
+
+    self.assertEqual([str(s) for s in expected], [str(s) for s in actual])
+
   def testToCSV(self):
     """Test to writing to CSV."""
 
@@ -38,6 +127,215 @@ class CollectsToScoutTests(googletest.TestCase):
 
     self.assertEqual(expected_csv, actual_csv)
 
+  def testProcessFilesParallel(self):
+    """Test that --jobs gives the same outputs as a serial run."""
+    directory = tempfile.mkdtemp()
+    arg_files = []
+    for i in range(3):
+      arg_file = os.path.join(directory, 'country{}.csv'.format(i))
+      with open(arg_file, 'wb') as f:
+        f.write('Location Name,Equipment,Address\n'
+                'Louvre,Car,"99 Rue de Rivoli, Paris"\n'
+                'Site {0},Trike,{0} Main St\n'.format(i))
+      arg_files.append(arg_file)
+    legacy = parse_run_groups_config.LegacyIssue('Louvre', 'FR')
+    legacy.runs = ['run1']
+    legacy_index = collects_to_scout.IndexLegacySites([legacy])
+
+    def FakeGeocode(address):
+      return float(len(address)), 0.0
+
+    serial = []
+    current_sites = []
+    for arg_file in arg_files:
+      file_sites, _, _ = collects_to_scout.ProcessFile(
+          arg_file, FakeGeocode, is_legacy=True, legacy_index=legacy_index,
+          write_csv=True)
+      current_sites.extend(file_sites)
+      serial.append(open(arg_file.replace('.csv', '_toScout.csv')).read())
+    sites = collects_to_scout.MergeFiles(current_sites, True, legacy_index)
+
+    metrics = stage_metrics.Metrics()
+    parallel_sites, _ = collects_to_scout.ProcessFiles(
+        arg_files, 3, FakeGeocode, is_legacy=True, legacy_index=legacy_index,
+        write_csv=True, metrics=metrics)
+    parallel = [open(arg_file.replace('.csv', '_toScout.csv')).read()
+                for arg_file in arg_files]
+
+    self.assertEqual(serial, parallel)
+    self.assertEqual([str(s) for s in sites], [str(s) for s in parallel_sites])
+    # every file's sites are imported, each name once
+    self.assertEqual(['Louvre', 'Site 0', 'Site 1', 'Site 2'],
+                     [site.issue_name for site in parallel_sites])
+    self.assertEqual(['run1'], parallel_sites[0].runs)
+    report = metrics.Report()
+    self.assertEqual({'spreadsheets': 3, 'current_sites': 6,
+                      'merged_sites': 6}, report['counters'])
+    self.assertEqual(['parse', 'merge', 'write_csv'],
+                     [stage['name'] for stage in report['stages']])
+    self.assertEqual(3, report['stages'][0]['calls'])
+
+  def testStreamFileMatchesProcessFile(self):
+    """Test that streaming writes the same files as ProcessFile."""
+    arg_file = os.path.join(tempfile.mkdtemp(), 'country.csv')
+    with open(arg_file, 'wb') as f:
+      f.write('Location Name,Equipment,Address\n'
+              'Louvre,Car,"99 Rue de Rivoli, Paris"\n'
+              'Eiffel Tower,Trike,Champ de Mars\n'
+              'Arc de Triomphe,Car,\n')
+
+    def FakeGeocode(address):
+      return (float(len(address)), 0.0) if address else (None, None)
+
+    outputs = []
+    for process in (collects_to_scout.ProcessFile,
+                    collects_to_scout.StreamFile):
+      process(arg_file, FakeGeocode, write_csv=True, write_records=True)
+      outputs.append([open(arg_file.replace('.csv', '_toScout.' + ext),
+                           'rb').read() for ext in ('csv', 'rec')])
+
+    self.assertEqual(outputs[0], outputs[1])
+
+  def testProcessFilesReturnsColocationReports(self):
+    """Test that workers hand colocation reports back instead of printing."""
+    directory = tempfile.mkdtemp()
+    arg_files = []
+    for i in range(2):
+      arg_file = os.path.join(directory, 'country{}.csv'.format(i))
+      with open(arg_file, 'wb') as f:
+        f.write('Location Name,Equipment,Address\n'
+                'Louvre {},Car,Paris\n'.format(i))
+      arg_files.append(arg_file)
+    legacy = parse_run_groups_config.LegacyIssue('Musee Du Louvre', 'FR')
+    legacy.lat, legacy.lon = 48.8609, 2.3377
+    legacy.runs = ['run1']
+    legacy_index = collects_to_scout.IndexLegacySites([legacy])
+
+    worker_stats = []
+    _, reports = collects_to_scout.ProcessFiles(
+        arg_files, 2, lambda address: (48.8608, 2.3376), is_legacy=True,
+        legacy_index=legacy_index, max_distance_m=100,
+        worker_stats=worker_stats)
+
+    self.assertEqual(2, len(reports))
+    # each worker's profile is handed back for the --profile dump
+    self.assertEqual(2, len(worker_stats))
+    for report in reports:
+      self.assertTrue(report.startswith(
+          '1 co-located legacy sites proposed for merging'))
+
+  def testPipelinedImport(self):
+    """Test that pipelined imports merge legacy runs and import every site."""
+    directory = tempfile.mkdtemp()
+    arg_files = []
+    for i in range(2):
+      arg_file = os.path.join(directory, 'country{}.csv'.format(i))
+      with open(arg_file, 'wb') as f:
+        f.write('Location Name,Equipment,Address\n'
+                'Louvre,Car,"99 Rue de Rivoli, Paris"\n'
+                'Site {0},Trike,{0} Main St\n'.format(i))
+      arg_files.append(arg_file)
+    louvre = parse_run_groups_config.LegacyIssue('Louvre', 'FR')
+    louvre.runs = ['run1']
+    orphan = parse_run_groups_config.LegacyIssue('Orphan', 'FR')
+    orphan.runs = ['run2']
+    legacy_index = collects_to_scout.IndexLegacySites([orphan, louvre])
+    workflow_service = in_memory_workflow_service.InMemoryWorkflowService()
+    datastore = bulk_import.WorkflowServiceDatastore(workflow_service)
+
+    def FakeGeocode(address):
+      return float(len(address)), 0.0
+
+    results, report = collects_to_scout.PipelinedImport(
+        arg_files, FakeGeocode, collects_to_scout.SiteImporter(True),
+        datastore, legacy_index, geocode_workers=2, import_workers=3,
+        queue_size=1)
+
+    self.assertTrue(all(result.ok for result in results))
+    self.assertEqual(['Louvre', 'Orphan', 'Site 0', 'Site 1'],
+                     sorted(result.name for result in results))
+    self.assertIn('import: 3 workers, 4 in, 4 out', report)
+    # a legacy run imports every site as legacy, as the bulk path does
+    sites, _ = datastore.ListSites('', 10)
+    self.assertEqual(4, len(sites))
+    for site in sites:
+      self.assertEqual(site.metadata.CLOSED, site.metadata.state)
+
+  def testGeocodeStatus(self):
+    """Test that only ZERO_RESULTS is a cacheable miss."""
+    responses = {
+        'Paris': {'status': 'OK', 'results': [
+            {'geometry': {'location': {'lat': 48.85, 'lng': 2.35}}}]},
+        'nowhere': {'status': 'ZERO_RESULTS', 'results': []},
+        'quota': {'status': 'OVER_QUERY_LIMIT', 'results': []}}
+
+    def FakeUrlopen(url):
+      address = url.split('address=')[1].split('&')[0]
+      return StringIO.StringIO(json.dumps(responses[address]))
+
+    original = collects_to_scout.urllib.urlopen
+    collects_to_scout.urllib.urlopen = FakeUrlopen
+    try:
+      cache = geocode_cache.GeocodeCache()
+      geocode = cache.Wrap(collects_to_scout.Geocode)
+      self.assertEqual((48.85, 2.35), geocode('Paris'))
+      self.assertEqual((None, None), geocode('nowhere'))
+      self.assertRaises(collects_to_scout.GeocodeError, geocode, 'quota')
+    finally:
+      collects_to_scout.urllib.urlopen = original
+
+    self.assertEqual(2, len(cache))
+    self.assertFalse(cache.Get('quota')[0])
+
+  def testToCSVRoundTrip(self):
+    """Test that fields with commas and run lists survive a round trip."""
+    site = collects_to_scout.CurrentIssue('Louvre', '99 Rue de Rivoli, Paris')
+    site.method = 'Trolley'
+    site.lat, site.lon = 48.8606111, 2.337644
+    site.runs = ['run1', 'run2']
+    legacy = parse_run_groups_config.LegacyIssue('Ischgi', 'AT')
+    csv_file = os.path.join(tempfile.mkdtemp(), 'sites.csv')
+
+    collects_to_scout.ToCSV(csv_file, [site, legacy])
+    sites = list(collects_to_scout.ReadCSV(
+        csv_file.replace('.csv', '_toScout.csv')))
+
+    self.assertEqual([str(site), 'Ischgi, , None, None, None'],
+                     [str(s) for s in sites])
+    self.assertEqual(['run1', 'run2'], sites[0].runs)
+
+  def testRecordFileRoundTrip(self):
+    """Test that sites survive a round trip through the record file."""
+    site = collects_to_scout.CurrentIssue('Louvre', '99 Rue de Rivoli')
+    site.method = 'Trolley'
+    site.lat, site.lon = 48.8606111, 2.337644
+    site.runs = ['run1', 'run2']
+    csv_file = os.path.join(tempfile.mkdtemp(), 'sites.csv')
+
+    self.assertEqual(1, collects_to_scout.ToRecordFile(csv_file, [site], False))
+    sites = list(collects_to_scout.LoadRecordFile(
+        csv_file.replace('.csv', '_toScout.rec')))
+
+    self.assertEqual(1, len(sites))
+    self.assertEqual(str(site), str(sites[0]))
+    self.assertEqual('Trolley', sites[0].method)
+    sites[0].runs.append('run3')
+    self.assertEqual(['run1', 'run2', 'run3'], sites[0].runs)
+
+  def testRecordFileRoundTripLegacy(self):
+    """Test that legacy sites come back from the record file as legacy."""
+    site = parse_run_groups_config.LegacyIssue('Ischgi', 'AT')
+    site.lat, site.lon = 47.01, 10.29
+    site.runs = ['run1']
+    csv_file = os.path.join(tempfile.mkdtemp(), 'sites.csv')
+
+    collects_to_scout.ToRecordFile(csv_file, [site], True)
+    sites = collects_to_scout.LoadRecordFiles(
+        [csv_file.replace('.csv', '_toScout.rec')])
+
+    self.assertIsInstance(sites[0], parse_run_groups_config.LegacyIssue)
+    self.assertEqual(str(site), str(sites[0]))
+
   def _AddSites(self, num_sites):
     """Adds sites to a datastore.
 
@@ -0,0 +1,39 @@
+"""Minimal option parsing shared by the legacy command line tools.
+
+The tools take their options anywhere in sys.argv and hand the remaining
+positional arguments on, so options are popped out of the argument list
+rather than parsed up front.
+"""
+
+import sys
+
+
+def PopFlag(args, name):
+  """Removes '--name' from args and returns whether it was present."""
+  if name not in args:
+    return False
+  args.remove(name)
+  return True
+
+
+def PopOption(args, name, cast=str, default=None):
+  """Removes '--name value' from args and returns the cast value.
+
+  Args:
+    args: Argument list, modified in place.
+    name: Option name including the leading dashes.
+    cast: Function converting the value string.
+    default: Value returned when the option is absent.
+
+  Returns:
+    The cast value, or default.
+  """
+  if name not in args:
+    return default
+  index = args.index(name)
+  if index + 1 >= len(args):
+    print 'Missing value for {}'.format(name)
+    sys.exit()
+  value = cast(args[index + 1])
+  del args[index:index + 2]
+  return value
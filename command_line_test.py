@@ -0,0 +1,33 @@
+"""Tests for the shared command line option parsing."""
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import command_line
+
+
+class CommandLineTests(googletest.TestCase):
+
+  def testPopOption(self):
+    """Test that options are removed and cast, wherever they appear."""
+    args = ['a.csv', '--jobs', '4', '--legacy']
+
+    self.assertEqual(4, command_line.PopOption(args, '--jobs', int, 1))
+    self.assertEqual(1, command_line.PopOption(args, '--jobs', int, 1))
+    self.assertIsNone(command_line.PopOption(args, '--config'))
+    self.assertEqual(['a.csv', '--legacy'], args)
+
+  def testPopFlag(self):
+    """Test that flags are removed and reported."""
+    args = ['--resume', 'a.csv']
+
+    self.assertTrue(command_line.PopFlag(args, '--resume'))
+    self.assertFalse(command_line.PopFlag(args, '--resume'))
+    self.assertEqual(['a.csv'], args)
+
+  def testMissingValueExits(self):
+    """Test that an option without a value stops the tool."""
+    self.assertRaises(SystemExit, command_line.PopOption, ['--jobs'], '--jobs')
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,70 @@
+"""External merge sort for record streams larger than memory.
+
+Records are buffered up to a fixed count, each full buffer is sorted and
+spilled to a temporary file, and the sorted runs are k-way merged back into
+a single stream.  The order is identical to sorted(records, key=key).
+"""
+
+import cPickle
+import heapq
+import tempfile
+
+
+def _Spill(run, tmp_dir):
+  """Writes a sorted run to a temporary file and rewinds it."""
+  f = tempfile.TemporaryFile(dir=tmp_dir)
+  pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+  for entry in run:
+    pickler.dump(entry)
+  f.seek(0)
+  return f
+
+
+def _ReadRun(f):
+  """Yields the entries of a spilled run."""
+  unpickler = cPickle.Unpickler(f)
+  while True:
+    try:
+      yield unpickler.load()
+    except EOFError:
+      return
+
+
+def ExternalSort(records, key, max_in_memory=100000, tmp_dir=None):
+  """Yields records in sorted order using bounded memory.
+
+  Args:
+    records: Iterable of picklable records.
+    key: Function returning the sort key of a record.
+    max_in_memory: Maximum number of records buffered before a sorted run is
+      spilled to disk.
+    tmp_dir: Directory for spill files, defaults to the system temp dir.
+
+  Yields:
+    Records in the order of sorted(records, key=key); ties keep their input
+    order.
+  """
+  buffer = []
+  spills = []
+  try:
+    for index, record in enumerate(records):
+      # the index keeps the sort stable and records are never compared
+      buffer.append((key(record), index, record))
+      if len(buffer) >= max_in_memory:
+        buffer.sort()
+        spills.append(_Spill(buffer, tmp_dir))
+        buffer = []
+    buffer.sort()
+
+    if not spills:
+      for _, _, record in buffer:
+        yield record
+      return
+
+    runs = [_ReadRun(f) for f in spills]
+    runs.append(iter(buffer))
+    for _, _, record in heapq.merge(*runs):
+      yield record
+  finally:
+    for f in spills:
+      f.close()
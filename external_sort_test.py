@@ -0,0 +1,30 @@
+"""Tests for the external merge sort."""
+
+import random
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import external_sort
+
+
+class ExternalSortTests(googletest.TestCase):
+
+  def testMatchesSorted(self):
+    """Test that spilled runs merge into the same order as sorted()."""
+    rng = random.Random(7)
+    records = [(rng.choice('abcdefgh'), i) for i in range(1000)]
+
+    actual = list(external_sort.ExternalSort(records, key=lambda r: r[0],
+                                             max_in_memory=64))
+
+    self.assertEqual(sorted(records, key=lambda r: r[0]), actual)
+
+  def testInMemory(self):
+    """Test inputs smaller than the buffer."""
+    self.assertEqual([1, 2, 3], list(external_sort.ExternalSort(
+        [3, 1, 2], key=lambda r: r)))
+    self.assertEqual([], list(external_sort.ExternalSort([], key=lambda r: r)))
+
+
+if __name__ == '__main__':
+  googletest.main()
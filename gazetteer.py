@@ -0,0 +1,254 @@
+"""Offline geocoding from a local gazetteer of known addresses.
+
+A gazetteer is built once from a tab-separated file of address, latitude and
+longitude into an index file holding the normalized addresses in sorted
+order, their coordinates, and an inverted index from address tokens to
+entries.  The index is memory-mapped and searched in place with binary
+search, so opening it costs nothing and the working set is only the pages
+that lookups touch.  Import hosts without network access can geocode from
+it alone; elsewhere it answers what it can and falls back to Geocode.
+
+usage: gazetteer.py build addresses.tsv gazetteer.idx
+       gazetteer.py lookup gazetteer.idx address
+"""
+
+import mmap
+import struct
+import sys
+
+from google3.cityblock.special.legacy import name_index
+
+MAGIC = 'GAZIDX01'
+_HEADER = struct.Struct('<8sIIII')
+_UINT = struct.Struct('<I')
+_BOUNDS = struct.Struct('<II')
+_COORDINATES = struct.Struct('<dd')
+
+
+def NormalizeAddress(address):
+  """Returns the UTF-8 key an address is indexed under."""
+  return name_index.Normalize(address).encode('utf-8')
+
+
+def BuildGazetteer(tsv_path, index_path):
+  """Writes the index file for a gazetteer.
+
+  Args:
+    tsv_path: Text file with one 'address<TAB>lat<TAB>lon' line per address.
+      Later lines win when addresses normalize to the same key.
+    index_path: Output index file.
+
+  Returns:
+    Number of distinct addresses indexed.
+  """
+  entries = {}
+  with open(tsv_path, 'rb') as f:
+    for line in f:
+      fields = line.rstrip('\r\n').split('\t')
+      if len(fields) != 3 or not fields[0].strip():
+        continue
+      key = NormalizeAddress(fields[0])
+      if key:
+        entries[key] = (float(fields[1]), float(fields[2]))
+  keys = sorted(entries)
+
+  postings = {}
+  for entry_id, key in enumerate(keys):
+    for token in set(key.split(' ')):
+      postings.setdefault(token, []).append(entry_id)
+  tokens = sorted(postings)
+
+  with open(index_path, 'wb') as f:
+    f.write(_HEADER.pack(MAGIC, len(keys), len(tokens),
+                         sum(len(ids) for ids in postings.itervalues()),
+                         sum(len(key) for key in keys)))
+    _WriteOffsets(f, keys)
+    for key in keys:
+      f.write(_COORDINATES.pack(*entries[key]))
+    f.write(''.join(keys))
+    _WriteOffsets(f, tokens)
+    start = 0
+    for token in tokens:
+      f.write(_UINT.pack(start))
+      start += len(postings[token])
+    f.write(_UINT.pack(start))
+    for token in tokens:
+      f.write(struct.pack('<{}I'.format(len(postings[token])),
+                          *postings[token]))
+    f.write(''.join(tokens))
+  return len(keys)
+
+
+def _WriteOffsets(f, strings):
+  offset = 0
+  for string in strings:
+    f.write(_UINT.pack(offset))
+    offset += len(string)
+  f.write(_UINT.pack(offset))
+
+
+class Gazetteer(object):
+  """Memory-mapped gazetteer index with exact, prefix and token lookup."""
+
+  def __init__(self, index_path):
+    with open(index_path, 'rb') as f:
+      self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, self._num_entries, self._num_tokens, num_postings,
+     key_bytes) = _HEADER.unpack_from(self._data, 0)
+    if magic != MAGIC:
+      raise ValueError('{} is not a gazetteer index'.format(index_path))
+    self._key_offsets = _HEADER.size
+    self._coordinates = self._key_offsets + 4 * (self._num_entries + 1)
+    self._keys = self._coordinates + _COORDINATES.size * self._num_entries
+    self._token_offsets = self._keys + key_bytes
+    self._posting_starts = self._token_offsets + 4 * (self._num_tokens + 1)
+    self._postings = self._posting_starts + 4 * (self._num_tokens + 1)
+    self._tokens = self._postings + 4 * num_postings
+
+  def __len__(self):
+    return self._num_entries
+
+  def Close(self):
+    self._data.close()
+
+  def _Uint(self, table, index):
+    return _UINT.unpack_from(self._data, table + 4 * index)[0]
+
+  def _String(self, offsets, strings, index):
+    start, end = _BOUNDS.unpack_from(self._data, offsets + 4 * index)
+    return self._data[strings + start:strings + end]
+
+  def _SearchStrings(self, offsets, strings, count, value):
+    """Returns the index of the first of count sorted strings >= value."""
+    # the hot loop of every lookup, so attribute lookups are hoisted
+    data = self._data
+    unpack_from = _BOUNDS.unpack_from
+    low, high = 0, count
+    while low < high:
+      middle = (low + high) // 2
+      start, end = unpack_from(data, offsets + 4 * middle)
+      if data[strings + start:strings + end] < value:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def _Key(self, entry_id):
+    return self._String(self._key_offsets, self._keys, entry_id)
+
+  def _Token(self, token_id):
+    return self._String(self._token_offsets, self._tokens, token_id)
+
+  def _Entry(self, entry_id):
+    lat, lon = _COORDINATES.unpack_from(
+        self._data, self._coordinates + _COORDINATES.size * entry_id)
+    return self._Key(entry_id), lat, lon
+
+  def _FindKey(self, key):
+    entry_id = self._SearchStrings(self._key_offsets, self._keys,
+                                   self._num_entries, key)
+    if entry_id < self._num_entries and self._Key(entry_id) == key:
+      return entry_id
+    return None
+
+  def _Postings(self, token):
+    """Returns (start, end) of the sorted entry ids containing a token."""
+    token_id = self._SearchStrings(self._token_offsets, self._tokens,
+                                   self._num_tokens, token)
+    if token_id >= self._num_tokens or self._Token(token_id) != token:
+      return 0, 0
+    return (self._Uint(self._posting_starts, token_id),
+            self._Uint(self._posting_starts, token_id + 1))
+
+  def Lookup(self, address):
+    """Returns (lat, lon) of an address known exactly, or None."""
+    entry_id = self._FindKey(NormalizeAddress(address))
+    if entry_id is None:
+      return None
+    return self._Entry(entry_id)[1:]
+
+  def Prefix(self, prefix, limit=10):
+    """Returns up to limit (key, lat, lon) entries starting with prefix."""
+    prefix = NormalizeAddress(prefix)
+    entry_id = self._SearchStrings(self._key_offsets, self._keys,
+                                   self._num_entries, prefix)
+    found = []
+    while (entry_id < self._num_entries and len(found) < limit and
+           self._Key(entry_id).startswith(prefix)):
+      found.append(self._Entry(entry_id))
+      entry_id += 1
+    return found
+
+  def Tokens(self, address, limit=10):
+    """Returns up to limit (key, lat, lon) entries with every query token.
+
+    Args:
+      address: Address whose normalized words must all appear in an entry.
+      limit: Maximum number of entries to return.
+    """
+    tokens = set(NormalizeAddress(address).split(' ')) - set([''])
+    if not tokens:
+      return []
+    ranges = sorted((self._Postings(token) for token in tokens),
+                    key=lambda bounds: bounds[1] - bounds[0])
+    start, end = ranges[0]
+    found = []
+    for index in xrange(start, end):
+      entry_id = self._Uint(self._postings, index)
+      if all(self._Contains(other, entry_id) for other in ranges[1:]):
+        found.append(self._Entry(entry_id))
+        if len(found) >= limit:
+          break
+    return found
+
+  def _Contains(self, bounds, entry_id):
+    """Returns whether a posting list (start, end) holds an entry id."""
+    data = self._data
+    unpack_from = _UINT.unpack_from
+    low, high = bounds
+    while low < high:
+      middle = (low + high) // 2
+      if unpack_from(data, self._postings + 4 * middle)[0] < entry_id:
+        low = middle + 1
+      else:
+        high = middle
+    return (low < bounds[1] and
+            unpack_from(data, self._postings + 4 * low)[0] == entry_id)
+
+  def Geocode(self, address):
+    """Geocodes an address from the gazetteer alone.
+
+    An exact match of the normalized address is used first, then the only
+    entry holding all of its words.
+
+    Returns:
+      (lat, lon), or (None, None) if the address is unknown or ambiguous.
+    """
+    if not address:
+      return None, None
+    lat_lon = self.Lookup(address)
+    if lat_lon is not None:
+      return lat_lon
+    matches = self.Tokens(address, limit=2)
+    if len(matches) == 1:
+      return matches[0][1:]
+    return None, None
+
+
+def main():
+  args = sys.argv[1:]
+  if len(args) == 3 and args[0] == 'build':
+    print 'Indexed {} addresses'.format(BuildGazetteer(args[1], args[2]))
+  elif len(args) >= 3 and args[0] == 'lookup':
+    gazetteer = Gazetteer(args[1])
+    address = ' '.join(args[2:])
+    print gazetteer.Geocode(address)
+    for key, lat, lon in gazetteer.Tokens(address) or gazetteer.Prefix(
+        address):
+      print '{}\t{}\t{}'.format(key, lat, lon)
+  else:
+    sys.exit(__doc__)
+
+
+if __name__ == '__main__':
+  main()
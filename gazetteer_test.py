@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests for gazetteer."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import gazetteer
+
+ADDRESSES = """99 Rue de Rivoli, Paris\t48.8606\t2.3376
+Champ de Mars, 5 Avenue Anatole France, Paris\t48.8584\t2.2945
+1 Main St, Springfield\t39.80\t-89.64
+1 Main St, Shelbyville\t39.40\t-88.79
+Museumsinsel, Berlin\t52.5169\t13.4019
+Plaça de Catalunya, Barcelona\t41.3870\t2.1700
+malformed line
+"""
+
+
+class GazetteerTests(googletest.TestCase):
+
+  def setUp(self):
+    directory = tempfile.mkdtemp()
+    tsv_path = os.path.join(directory, 'addresses.tsv')
+    with open(tsv_path, 'wb') as f:
+      f.write(ADDRESSES)
+    index_path = os.path.join(directory, 'gazetteer.idx')
+    self.assertEqual(6, gazetteer.BuildGazetteer(tsv_path, index_path))
+    self.gazetteer = gazetteer.Gazetteer(index_path)
+
+  def tearDown(self):
+    self.gazetteer.Close()
+
+  def testLookupNormalizesAddresses(self):
+    """Test exact lookups ignoring case, accents and punctuation."""
+    self.assertEqual((48.8606, 2.3376),
+                     self.gazetteer.Lookup('99 RUE DE RIVOLI   PARIS'))
+    self.assertEqual((41.3870, 2.1700),
+                     self.gazetteer.Lookup('Placa de Catalunya; Barcelona'))
+    self.assertIsNone(self.gazetteer.Lookup('100 Rue de Rivoli, Paris'))
+
+  def testPrefix(self):
+    """Test that prefix lookups return entries in key order."""
+    self.assertEqual(['1 main st shelbyville', '1 main st springfield'],
+                     [key for key, _, _ in self.gazetteer.Prefix('1 Main')])
+    self.assertEqual(1, len(self.gazetteer.Prefix('1 main', limit=1)))
+    self.assertEqual([], self.gazetteer.Prefix('2 main'))
+
+  def testTokens(self):
+    """Test that token lookups need every word of the query."""
+    self.assertEqual(['champ de mars 5 avenue anatole france paris'],
+                     [key for key, _, _ in self.gazetteer.Tokens(
+                         'Champ de Mars Paris')])
+    self.assertEqual(2, len(self.gazetteer.Tokens('main st')))
+    self.assertEqual([], self.gazetteer.Tokens('main st Ogdenville'))
+
+  def testGeocode(self):
+    """Test exact, unique token and ambiguous or unknown addresses."""
+    self.assertEqual((52.5169, 13.4019),
+                     self.gazetteer.Geocode('Museumsinsel, Berlin'))
+    self.assertEqual((48.8584, 2.2945),
+                     self.gazetteer.Geocode('Champ de Mars, Paris'))
+    self.assertEqual((None, None), self.gazetteer.Geocode('1 Main St'))
+    self.assertEqual((None, None), self.gazetteer.Geocode('Nowhere'))
+    self.assertEqual((None, None), self.gazetteer.Geocode(''))
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,161 @@
+"""Persistent on-disk cache for geocoded site addresses.
+
+Country spreadsheets are re-imported many times, so most addresses have
+already been geocoded on a previous run.  The cache keeps the results in a
+size-bounded LRU table that is saved to disk between runs, including negative
+entries for addresses that returned no results.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+
+# addresses without results are retried after a week, in case the geocoder
+# learns them
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600
+
+
+class GeocodeCache(object):
+  """LRU cache of address -> (lat, lon) with optional expiry.
+
+  Entries are kept in least-recently-used order and the oldest entries are
+  evicted once max_entries is exceeded.  A (None, None) result is stored as a
+  negative entry so addresses without results are not looked up again until
+  negative_ttl expires.
+  """
+
+  def __init__(self, path=None, max_entries=100000, ttl=None,
+               negative_ttl=DEFAULT_NEGATIVE_TTL, track_updates=False,
+               clock=time.time):
+    """Constructor.
+
+    Args:
+      path: File the cache is loaded from and saved to, or None to keep the
+        cache in memory only.
+      max_entries: Maximum number of addresses to keep.
+      ttl: Seconds a positive entry stays valid, or None for no expiry.
+      negative_ttl: Seconds a negative entry stays valid, or None to use ttl.
+      track_updates: Whether to keep the entries stored by Put for
+        TakeUpdates.
+      clock: Function returning the current time in seconds.
+    """
+    self.path = path
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+    self.track_updates = track_updates
+    self.hits = 0
+    self.misses = 0
+    self._clock = clock
+    self._entries = collections.OrderedDict()
+    self._updates = []
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _Expired(self, entry):
+    lat, _, stored = entry
+    ttl = self.negative_ttl if lat is None else self.ttl
+    return ttl is not None and self._clock() - stored > ttl
+
+  def Get(self, address):
+    """Looks up an address.
+
+    Args:
+      address: The address to look up.
+
+    Returns:
+      A tuple (found, (lat, lon)).  found is False when the address is not
+      cached or its entry has expired.
+    """
+    with self._lock:
+      entry = self._entries.pop(address, None)
+      if entry is None or self._Expired(entry):
+        self.misses += 1
+        return False, (None, None)
+      # re-insert to mark as most recently used
+      self._entries[address] = entry
+      self.hits += 1
+      return True, (entry[0], entry[1])
+
+  def Put(self, address, lat_lon):
+    """Stores the geocoding result for an address."""
+    lat, lon = lat_lon
+    with self._lock:
+      self._entries.pop(address, None)
+      self._entries[address] = (lat, lon, self._clock())
+      if self.track_updates:
+        self._updates.append((address, (lat, lon)))
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def TakeUpdates(self):
+    """Returns the (address, (lat, lon)) pairs stored since the last call.
+
+    Lets a worker process hand its new lookups back to the parent's cache.
+    Only pairs stored while track_updates is set are returned.
+    """
+    with self._lock:
+      updates, self._updates = self._updates, []
+    return updates
+
+  def Wrap(self, geocode):
+    """Returns a geocoding function that consults the cache first.
+
+    Args:
+      geocode: Function mapping an address to (lat, lon), called on a miss.
+
+    Returns:
+      A function with the same signature as geocode.
+    """
+    def CachedGeocode(address):
+      if not address:
+        return geocode(address)
+      found, lat_lon = self.Get(address)
+      if not found:
+        lat_lon = geocode(address)
+        self.Put(address, lat_lon)
+      return lat_lon
+    return CachedGeocode
+
+  def Load(self):
+    """Loads entries saved by a previous run, dropping expired ones."""
+    if not self.path or not os.path.exists(self.path):
+      return
+    with open(self.path, 'rb') as f:
+      records = json.load(f)
+    with self._lock:
+      for address, lat, lon, stored in records:
+        # json decodes to unicode; keys must match the byte strings read
+        # from the spreadsheets
+        address = address.encode('utf-8')
+        entry = (lat, lon, stored)
+        if not self._Expired(entry):
+          self._entries[address] = entry
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def Save(self):
+    """Atomically writes the cache to disk in LRU order."""
+    if not self.path:
+      return
+    with self._lock:
+      records = [[address, lat, lon, stored]
+                 for address, (lat, lon, stored) in self._entries.iteritems()]
+    directory = os.path.dirname(os.path.abspath(self.path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.geocode_cache')
+    with os.fdopen(fd, 'wb') as f:
+      json.dump(records, f)
+    os.rename(tmp_path, self.path)
+
+  def Stats(self):
+    """Returns a one-line summary of cache effectiveness."""
+    total = self.hits + self.misses
+    rate = 100.0 * self.hits / total if total else 0.0
+    return ('Geocode cache: {} hits, {} misses ({:.1f}% hit rate), '
+            '{} entries'.format(self.hits, self.misses, rate,
+                                len(self._entries)))
@@ -0,0 +1,108 @@
+"""Tests for GeocodeCache."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import geocode_cache
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+class GeocodeCacheTests(googletest.TestCase):
+
+  def setUp(self):
+    self.lookups = []
+
+  def _Geocode(self, address):
+    self.lookups.append(address)
+    if address == 'nowhere':
+      return None, None
+    return 1.0, 2.0
+
+  def testWrapOnlyGeocodesOnce(self):
+    """Test that repeated addresses are served from the cache."""
+    cache = geocode_cache.GeocodeCache(track_updates=True)
+    geocode = cache.Wrap(self._Geocode)
+
+    self.assertEqual((1.0, 2.0), geocode('Paris'))
+    self.assertEqual((1.0, 2.0), geocode('Paris'))
+    self.assertEqual((None, None), geocode('nowhere'))
+    self.assertEqual((None, None), geocode('nowhere'))
+
+    self.assertEqual(['Paris', 'nowhere'], self.lookups)
+    self.assertEqual(2, cache.hits)
+    self.assertEqual(2, cache.misses)
+    self.assertEqual([('Paris', (1.0, 2.0)), ('nowhere', (None, None))],
+                     cache.TakeUpdates())
+    self.assertEqual([], cache.TakeUpdates())
+
+  def testUpdatesAreOnlyTrackedWhenEnabled(self):
+    """Test that a cache nobody takes updates from does not keep them."""
+    cache = geocode_cache.GeocodeCache()
+    cache.Put('Paris', (1.0, 2.0))
+
+    self.assertEqual([], cache.TakeUpdates())
+
+  def testLruEviction(self):
+    """Test that the least recently used address is evicted."""
+    cache = geocode_cache.GeocodeCache(max_entries=2)
+    cache.Put('a', (1.0, 1.0))
+    cache.Put('b', (2.0, 2.0))
+    cache.Get('a')
+    cache.Put('c', (3.0, 3.0))
+
+    self.assertTrue(cache.Get('a')[0])
+    self.assertFalse(cache.Get('b')[0])
+    self.assertTrue(cache.Get('c')[0])
+
+  def testTtl(self):
+    """Test that positive and negative entries expire separately."""
+    clock = FakeClock()
+    cache = geocode_cache.GeocodeCache(ttl=100, negative_ttl=10, clock=clock)
+    cache.Put('a', (1.0, 1.0))
+    cache.Put('nowhere', (None, None))
+
+    clock.now += 50
+    self.assertTrue(cache.Get('a')[0])
+    self.assertFalse(cache.Get('nowhere')[0])
+
+    clock.now += 51
+    self.assertFalse(cache.Get('a')[0])
+
+  def testNegativeEntriesExpireByDefault(self):
+    """Test that addresses without results are eventually looked up again."""
+    clock = FakeClock()
+    cache = geocode_cache.GeocodeCache(clock=clock)
+    cache.Put('a', (1.0, 1.0))
+    cache.Put('nowhere', (None, None))
+
+    clock.now += geocode_cache.DEFAULT_NEGATIVE_TTL + 1
+    self.assertTrue(cache.Get('a')[0])
+    self.assertFalse(cache.Get('nowhere')[0])
+
+  def testSaveAndLoad(self):
+    """Test that entries survive a round trip through disk."""
+    path = os.path.join(tempfile.mkdtemp(), 'cache.json')
+    cache = geocode_cache.GeocodeCache(path)
+    cache.Put('Paris', (1.0, 2.0))
+    cache.Put('nowhere', (None, None))
+    cache.Save()
+
+    loaded = geocode_cache.GeocodeCache(path)
+    loaded.Load()
+
+    self.assertEqual((True, (1.0, 2.0)), loaded.Get('Paris'))
+    self.assertEqual((True, (None, None)), loaded.Get('nowhere'))
+
+
+if __name__ == '__main__':
+  googletest.main()
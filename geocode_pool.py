@@ -0,0 +1,93 @@
+"""Concurrent, rate-limited geocoding of spreadsheet addresses.
+
+Geocoding one row at a time costs a full HTTP round-trip per row.  This module
+geocodes the distinct addresses of a spreadsheet on a pool of worker threads
+while a token bucket keeps the request rate under the API quota.
+"""
+
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+
+class TokenBucket(object):
+  """Thread-safe token bucket limiting calls to a steady rate."""
+
+  def __init__(self, rate, burst=1, clock=time.time, sleep=time.sleep):
+    """Constructor.
+
+    Args:
+      rate: Tokens added per second.
+      burst: Maximum number of tokens that can accumulate.
+      clock: Function returning the current time in seconds.
+      sleep: Function sleeping for a number of seconds.
+    """
+    self.rate = float(rate)
+    self.burst = burst
+    self._tokens = float(burst)
+    self._clock = clock
+    self._sleep = sleep
+    self._last = clock()
+    self._lock = threading.Lock()
+
+  def Acquire(self):
+    """Blocks until a token is available and takes it."""
+    while True:
+      with self._lock:
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      self._sleep(wait)
+
+
+def RateLimit(geocode, qps, burst=1):
+  """Wraps a geocoding function so it is called at most qps times a second.
+
+  Args:
+    geocode: Function mapping an address to (lat, lon).
+    qps: Maximum queries per second across all threads.
+    burst: Number of queries that may be sent back to back.
+
+  Returns:
+    A function with the same signature as geocode.
+  """
+  bucket = TokenBucket(qps, burst)
+
+  def RateLimitedGeocode(address):
+    if not address:
+      return geocode(address)
+    bucket.Acquire()
+    return geocode(address)
+  return RateLimitedGeocode
+
+
+def GeocodeAll(addresses, geocode, num_workers):
+  """Geocodes addresses concurrently, looking up each distinct one once.
+
+  Args:
+    addresses: Iterable of addresses, possibly with duplicates.
+    geocode: Thread-safe function mapping an address to (lat, lon).
+    num_workers: Number of concurrent lookups.
+
+  Returns:
+    Dictionary of address -> (lat, lon).
+  """
+  unique = []
+  seen = set()
+  for address in addresses:
+    if address not in seen:
+      seen.add(address)
+      unique.append(address)
+
+  pool = ThreadPool(num_workers)
+  try:
+    results = pool.map(geocode, unique, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+  return dict(zip(unique, results))
@@ -0,0 +1,56 @@
+"""Tests for concurrent geocoding."""
+
+import threading
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import geocode_pool
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def __call__(self):
+    return self.now
+
+  def Sleep(self, seconds):
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class GeocodePoolTests(googletest.TestCase):
+
+  def testTokenBucketLimitsRate(self):
+    """Test that the bucket spaces calls out to the configured rate."""
+    clock = FakeClock()
+    bucket = geocode_pool.TokenBucket(2, burst=1, clock=clock,
+                                      sleep=clock.Sleep)
+    for _ in range(5):
+      bucket.Acquire()
+
+    # first token is available immediately, the rest arrive every 0.5s
+    self.assertAlmostEqual(2.0, clock.now)
+
+  def testGeocodeAllDedupesAddresses(self):
+    """Test that each distinct address is geocoded exactly once."""
+    lookups = []
+    lock = threading.Lock()
+
+    def Geocode(address):
+      with lock:
+        lookups.append(address)
+      return len(address), 0.0
+
+    addresses = ['a', 'bb', 'a', 'ccc', 'bb', '']
+    results = geocode_pool.GeocodeAll(addresses, Geocode, 4)
+
+    self.assertEqual(sorted(['a', 'bb', 'ccc', '']), sorted(lookups))
+    self.assertEqual((2, 0.0), results['bb'])
+    self.assertEqual(4, len(results))
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,131 @@
+"""Append-only journal of completed import steps.
+
+A bulk import that dies partway through would otherwise leave no record of
+which sites already have a site_id or collection_id.  Every completed
+CreateSite, CreateCollection and WriteRunGroups step is appended to the
+journal so a rerun can skip the work that is already done.
+"""
+
+import json
+import os
+import threading
+import time
+
+SITE_ID = 'site_id'
+COLLECTION_ID = 'collection_id'
+RUN_GROUPS = 'run_groups'
+
+
+class ImportJournal(object):
+  """Journal file of completed import steps, one JSON record per line.
+
+  Records are flushed and fsync'ed in batches, either after sync_every
+  records or once sync_interval seconds have passed since the last sync,
+  which bounds the work lost in a crash without an fsync per RPC.
+  """
+
+  def __init__(self, path, resume=False, sync_every=64, sync_interval=1.0,
+               clock=time.time):
+    """Constructor.
+
+    Args:
+      path: Journal file.
+      resume: Whether to load and extend an existing journal rather than
+        starting a new one.
+      sync_every: Number of records written between fsyncs.
+      sync_interval: Maximum seconds between fsyncs while records are written.
+      clock: Function returning the current time in seconds.
+    """
+    self.path = path
+    self.sync_every = sync_every
+    self.sync_interval = sync_interval
+    self._clock = clock
+    self._completed = Load(path) if resume else {}
+    if resume:
+      _DropTornRecord(path)
+    self._file = open(path, 'ab' if resume else 'wb')
+    self._pending = 0
+    self._last_sync = clock()
+    self._lock = threading.Lock()
+
+  def Completed(self, name):
+    """Returns the steps recorded for a site as a dictionary step -> value."""
+    with self._lock:
+      return dict(self._completed.get(name, {}))
+
+  def Record(self, name, step, value):
+    """Appends a completed step for a site.
+
+    Args:
+      name: Site name.
+      step: One of SITE_ID, COLLECTION_ID or RUN_GROUPS.
+      value: JSON-serializable result of the step.
+    """
+    line = json.dumps({'site': name, 'step': step, 'value': value}) + '\n'
+    with self._lock:
+      self._completed.setdefault(name, {})[step] = value
+      self._file.write(line)
+      self._pending += 1
+      if (self._pending >= self.sync_every or
+          self._clock() - self._last_sync >= self.sync_interval):
+        self._Sync()
+
+  def _Sync(self):
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self._pending = 0
+    self._last_sync = self._clock()
+
+  def Close(self):
+    """Syncs outstanding records and closes the journal."""
+    with self._lock:
+      self._Sync()
+      self._file.close()
+
+
+def _DropTornRecord(path, block_size=4096):
+  """Truncates a journal after its last complete line.
+
+  Otherwise the first record appended on resume would continue the torn line
+  and be lost on the next resume along with it.
+  """
+  if not os.path.exists(path):
+    return
+  with open(path, 'r+b') as f:
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    while end > 0:
+      start = max(0, end - block_size)
+      f.seek(start)
+      newline = f.read(end - start).rfind('\n')
+      if newline >= 0:
+        end = start + newline + 1
+        break
+      end = start
+    f.truncate(end)
+
+
+def Load(path):
+  """Reads a journal written by ImportJournal.
+
+  A torn last line from a crash mid-write is ignored.
+
+  Args:
+    path: Journal file.
+
+  Returns:
+    Dictionary of site name -> dictionary of step -> value.
+  """
+  completed = {}
+  if not os.path.exists(path):
+    return completed
+  with open(path, 'rb') as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      # json decodes to unicode while site names are byte strings
+      name = record['site'].encode('utf-8')
+      completed.setdefault(name, {})[record['step']] = record['value']
+  return completed
@@ -0,0 +1,100 @@
+"""Tests for the import journal."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import import_journal
+
+
+class CountingDatastore(object):
+
+  def __init__(self):
+    self.calls = []
+
+  def CreateSite(self, new_site):
+    self.calls.append('CreateSite')
+    return 'site-1'
+
+  def CreateCollection(self, site_id, collection):
+    self.calls.append('CreateCollection')
+    raise IOError('connection reset')
+
+  def WriteRunGroups(self, run_group):
+    self.calls.append('WriteRunGroups')
+    return True
+
+
+class ImportJournalTests(googletest.TestCase):
+
+  def setUp(self):
+    self.path = os.path.join(tempfile.mkdtemp(), 'journal')
+
+  def testLoadIgnoresTornRecord(self):
+    """Test that records survive a reopen and a torn line is skipped."""
+    journal = import_journal.ImportJournal(self.path, sync_every=2)
+    journal.Record('Louvre', import_journal.SITE_ID, 'site-1')
+    journal.Record('Louvre', import_journal.COLLECTION_ID, 'collection-1')
+    journal.Record('Ischgi', import_journal.SITE_ID, 'site-2')
+    journal.Close()
+    with open(self.path, 'ab') as f:
+      f.write('{"site": "Ischgi", "step": "collec')
+
+    completed = import_journal.Load(self.path)
+
+    self.assertEqual({'site_id': 'site-1', 'collection_id': 'collection-1'},
+                     completed['Louvre'])
+    self.assertEqual({'site_id': 'site-2'}, completed['Ischgi'])
+
+  def testResumeAfterTornRecord(self):
+    """Test that a record appended after a torn line survives a resume."""
+    journal = import_journal.ImportJournal(self.path)
+    journal.Record('Louvre', import_journal.SITE_ID, 'site-1')
+    journal.Close()
+    with open(self.path, 'ab') as f:
+      f.write('{"site": "Louvre", "step": "collec')
+
+    journal = import_journal.ImportJournal(self.path, resume=True)
+    journal.Record('Louvre', import_journal.COLLECTION_ID, 'collection-1')
+    journal.Close()
+    journal = import_journal.ImportJournal(self.path, resume=True)
+
+    self.assertEqual({'site_id': 'site-1', 'collection_id': 'collection-1'},
+                     journal.Completed('Louvre'))
+    journal.Close()
+
+  def testResumeSkipsCompletedSteps(self):
+    """Test that a resumed import only runs the steps that did not finish."""
+    site = collects_to_scout.CurrentIssue('Louvre', '')
+    site.method = 'Car'
+    site.lat, site.lon = 48.86, 2.34
+    site.runs = ['run1']
+
+    datastore = CountingDatastore()
+    journal = import_journal.ImportJournal(self.path)
+    result = bulk_import.SiteResult(site.issue_name)
+    self.assertRaises(IOError, collects_to_scout.ImportSite, site, False,
+                      datastore, result, journal)
+    journal.Close()
+
+    datastore = CountingDatastore()
+    datastore.CreateCollection = lambda site_id, collection: 'collection-1'
+    journal = import_journal.ImportJournal(self.path, resume=True)
+    result = bulk_import.SiteResult(site.issue_name)
+    collects_to_scout.ImportSite(site, False, datastore, result, journal)
+    journal.Close()
+
+    self.assertEqual(['WriteRunGroups'], datastore.calls)
+    self.assertEqual('site-1', result.site_id)
+    self.assertEqual('collection-1', result.collection_id)
+    self.assertEqual(
+        {'site_id': 'site-1', 'collection_id': 'collection-1',
+         'run_groups': True},
+        import_journal.Load(self.path)['Louvre'])
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,75 @@
+"""Bulk midpoint computation for legacy site coordinates.
+
+Instead of converting and averaging four strings per site while parsing, the
+raw coordinate pairs are collected and all midpoints computed in one NumPy
+pass.  Besides the plain average used by parse_run_groups_config.Mid, the
+true great-circle midpoint is available, which matters for wide sites and
+sites near the antimeridian.
+"""
+
+import numpy as np
+
+from google3.cityblock.special.legacy import parse_run_groups_config
+
+
+def Midpoints(corners, great_circle=False):
+  """Computes midpoints of many coordinate pairs.
+
+  Args:
+    corners: Array-like of shape (n, 4) holding lat1, lon1, lat2, lon2 in
+      degrees, as numbers or numeric strings.
+    great_circle: Whether to compute the great-circle midpoint rather than
+      the plain average of the coordinates.
+
+  Returns:
+    Array of shape (n, 2) holding lat, lon in degrees.
+  """
+  corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4)
+  lat1, lon1, lat2, lon2 = corners.T
+  if not great_circle:
+    return np.column_stack(((lat1 + lat2) / 2, (lon1 + lon2) / 2))
+
+  phi1, lambda1, phi2, lambda2 = np.radians(corners).T
+  bx = np.cos(phi2) * np.cos(lambda2 - lambda1)
+  by = np.cos(phi2) * np.sin(lambda2 - lambda1)
+  phi = np.arctan2(np.sin(phi1) + np.sin(phi2),
+                   np.hypot(np.cos(phi1) + bx, by))
+  lam = lambda1 + np.arctan2(by, np.cos(phi1) + bx)
+  lon = (np.degrees(lam) + 180.0) % 360.0 - 180.0
+  return np.column_stack((np.degrees(phi), lon))
+
+
+def ApplyMidpoints(coordinates, great_circle=False):
+  """Computes and stores the midpoints collected while parsing.
+
+  Args:
+    coordinates: List of (issue, lat1, lon1, lat2, lon2) tuples as collected
+      by RunGroupsConfigParser.
+    great_circle: Whether to use great-circle midpoints.
+  """
+  if not coordinates:
+    return
+  midpoints = Midpoints([entry[1:] for entry in coordinates], great_circle)
+  # later coordinate lines of a section overwrite earlier ones, as in Mid
+  for (issue, _, _, _, _), (lat, lon) in zip(coordinates,
+                                             midpoints.tolist()):
+    issue.lat = lat
+    issue.lon = lon
+
+
+def ParseRunGroupsConfigBulk(lines, great_circle=False):
+  """Parses a config like ParseRunGroupsConfig with bulk midpoints.
+
+  Args:
+    lines: Iterable of lines, such as an open file.
+    great_circle: Whether to use great-circle midpoints.
+
+  Returns:
+    list of LegacyIssue objects.
+  """
+  coordinates = []
+  parser = parse_run_groups_config.RunGroupsConfigParser(
+      coordinates=coordinates)
+  issues = list(parse_run_groups_config.IterRunGroupsConfig(lines, parser))
+  ApplyMidpoints(coordinates, great_circle)
+  return issues
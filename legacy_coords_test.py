@@ -0,0 +1,74 @@
+"""Tests for bulk legacy coordinate computation."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import legacy_coords
+from google3.cityblock.special.legacy import parse_run_groups_config
+
+
+class LegacyCoordsTests(googletest.TestCase):
+
+  def testBulkMatchesMid(self):
+    """Test that plain-average mode gives exactly the results of Mid."""
+    lines = ['# AQ']
+    for i in range(50):
+      lines.extend([
+          '# AT-Site{}X "Site"'.format(i),
+          '# ({0}.9419651,10.2812022) -- ({0}.0107649,-1{0}.3410778)'.format(
+              i),
+          '  run: "run{}"'.format(i)])
+
+    expected = parse_run_groups_config.ParseRunGroupsConfig(lines)
+    actual = legacy_coords.ParseRunGroupsConfigBulk(lines)
+
+    self.assertEqual([(c.lat, c.lon) for c in expected],
+                     [(c.lat, c.lon) for c in actual])
+    self.assertEqual([str(c) for c in expected], [str(c) for c in actual])
+
+  def testLoadRunGroupsConfigBulkMatchesMid(self):
+    """Test that bulk midpoints give the results of Mid when loading."""
+    sections = ['# AQ\n']
+    for i in range(30):
+      sections.append('# AT-Site{0}X "Site"\n'
+                      '# ({0}.9419651,10.2812022) -- '
+                      '(4{0}.0107649,-1.3410778)\n'
+                      '  run: "run{0}"\n'.format(i))
+    path = os.path.join(tempfile.mkdtemp(), 'run_groups.config')
+    with open(path, 'wb') as f:
+      f.write(''.join(sections))
+
+    expected = parse_run_groups_config.LoadRunGroupsConfig(path)
+    serial = parse_run_groups_config.LoadRunGroupsConfig(
+        path, bulk_midpoints=True)
+    parallel = parse_run_groups_config.LoadRunGroupsConfig(
+        path, num_workers=2, bulk_midpoints=True)
+
+    self.assertEqual(30, len(expected))
+    for actual in (serial, parallel):
+      self.assertEqual([(c.lat, c.lon) for c in expected],
+                       [(c.lat, c.lon) for c in actual])
+      self.assertEqual([str(c) for c in expected], [str(c) for c in actual])
+
+  def testGreatCircleAcrossAntimeridian(self):
+    """Test that the great-circle midpoint wraps around the antimeridian."""
+    lat, lon = legacy_coords.Midpoints([[-17.0, 179.0, -17.0, -179.0]],
+                                       great_circle=True)[0]
+
+    self.assertAlmostEqual(-17.0, lat, places=2)
+    self.assertAlmostEqual(180.0, abs(lon), places=2)
+
+  def testGreatCircleCloseToAverageForSmallSites(self):
+    """Test that both modes agree for a site a few kilometres wide."""
+    corners = [[46.9419651, 10.2812022, 47.0107649, 10.3410778]]
+    average = legacy_coords.Midpoints(corners)[0]
+    great_circle = legacy_coords.Midpoints(corners, great_circle=True)[0]
+
+    self.assertAlmostEqual(average[0], great_circle[0], places=3)
+    self.assertAlmostEqual(average[1], great_circle[1], places=3)
+
+
+if __name__ == '__main__':
+  googletest.main()
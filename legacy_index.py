@@ -0,0 +1,200 @@
+"""Reverse indexes over parsed legacy sites.
+
+Finding which site owns a run, or every site of a country, used to mean
+parsing run_groups.config and scanning every LegacyIssue.  LegacyIndex builds
+hash indexes from run id, country code and normalized name to sites once and
+saves them next to the config, keyed on the config's fingerprint, so later
+lookups load the index and answer from a dictionary.
+
+usage: legacy_index.py [OPTIONS] build
+       legacy_index.py [OPTIONS] run RUN_ID
+       legacy_index.py [OPTIONS] country CC
+       legacy_index.py [OPTIONS] name NAME
+options: [--config PATH] [--index PATH] [--snapshot PATH]
+"""
+
+import marshal
+import os
+import sys
+import tempfile
+
+from google3.cityblock.special.legacy import command_line
+from google3.cityblock.special.legacy import name_index
+from google3.cityblock.special.legacy import parse_run_groups_config
+
+INDEX_MAGIC = 'LGIDX001'
+INDEX_SUFFIX = '.index'
+
+
+def IndexPath(config_path):
+  """Returns the index file kept next to a config."""
+  return config_path + INDEX_SUFFIX
+
+
+class LegacyIndex(object):
+  """Sites by run id, by country code and by normalized name.
+
+  Sites are stored as (country_code, issue_name, lat, lon, runs) records and
+  turned into LegacyIssue objects only when a lookup returns them.
+  """
+
+  def __init__(self, records, by_run=None, by_country=None, by_name=None):
+    self._records = records
+    if by_run is None:
+      by_run, by_country, by_name = {}, {}, {}
+      for position, (country_code, issue_name, _, _, runs) in enumerate(
+          records):
+        for run in runs:
+          # a run listed under several sites belongs to the first
+          by_run.setdefault(run, position)
+        by_country.setdefault(country_code, []).append(position)
+        by_name.setdefault(name_index.Normalize(issue_name), []).append(
+            position)
+    self._by_run = by_run
+    self._by_country = by_country
+    self._by_name = by_name
+
+  @classmethod
+  def FromIssues(cls, issues):
+    """Builds the index of a list of LegacyIssue objects."""
+    return cls([(issue.country_code, issue.issue_name, issue.lat, issue.lon,
+                 list(issue.runs)) for issue in issues])
+
+  def __len__(self):
+    return len(self._records)
+
+  def _Issue(self, position):
+    country_code, issue_name, lat, lon, runs = self._records[position]
+    issue = parse_run_groups_config.LegacyIssue(issue_name, country_code)
+    issue.lat = lat
+    issue.lon = lon
+    issue.runs = runs
+    return issue
+
+  def Run(self, run_id):
+    """Returns the LegacyIssue owning a run, or None."""
+    position = self._by_run.get(run_id)
+    return None if position is None else self._Issue(position)
+
+  def Country(self, country_code):
+    """Returns the LegacyIssue objects of a country code, in config order."""
+    return [self._Issue(position)
+            for position in self._by_country.get(country_code.upper(), ())]
+
+  def Name(self, name):
+    """Returns the LegacyIssue objects whose normalized name matches."""
+    return [self._Issue(position)
+            for position in self._by_name.get(name_index.Normalize(name), ())]
+
+  def Stats(self):
+    return '{} sites, {} runs, {} countries, {} names'.format(
+        len(self._records), len(self._by_run), len(self._by_country),
+        len(self._by_name))
+
+
+def Save(index_path, fingerprint, index):
+  """Writes an index with the fingerprint of the config it was built from."""
+  directory = os.path.dirname(os.path.abspath(index_path))
+  fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.legacy_index')
+  with os.fdopen(fd, 'wb') as f:
+    f.write(INDEX_MAGIC)
+    # pylint: disable=protected-access
+    marshal.dump((tuple(fingerprint), index._records, index._by_run,
+                  index._by_country, index._by_name), f, 2)
+  os.rename(tmp_path, index_path)
+
+
+def Load(index_path, config_path):
+  """Loads an index written by Save.
+
+  Args:
+    index_path: File to read.
+    config_path: Path of the config the index must have been built from.
+
+  Returns:
+    LegacyIndex, or None if the index is missing, corrupt or was built from
+    a different version of the config.
+  """
+  try:
+    with open(index_path, 'rb') as f:
+      if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+        return None
+      saved_fingerprint, records, by_run, by_country, by_name = marshal.load(
+          f)
+  except (IOError, EOFError, ValueError, TypeError):
+    return None
+  if not parse_run_groups_config.FingerprintMatches(config_path,
+                                                    saved_fingerprint):
+    return None
+  return LegacyIndex(records, by_run, by_country, by_name)
+
+
+def LoadOrBuild(config_path, index_path=None, rebuild=False,
+                snapshot_path=None):
+  """Returns the index of a config, building and saving it when stale.
+
+  Args:
+    config_path: Path of the run groups config.
+    index_path: Index file, defaults to IndexPath(config_path).
+    rebuild: Whether to build the index even if the saved one is current.
+    snapshot_path: parse_run_groups_config snapshot to build the index from
+      while it is current, or None to parse the config.
+
+  Returns:
+    A tuple (index, built) where built tells whether the index was built.
+  """
+  index_path = index_path or IndexPath(config_path)
+  if not rebuild:
+    index = Load(index_path, config_path)
+    if index is not None:
+      return index, False
+
+  # taken before loading, so a config written meanwhile is indexed again
+  fingerprint = parse_run_groups_config.Fingerprint(config_path)
+  index = LegacyIndex.FromIssues(parse_run_groups_config.LoadRunGroupsConfig(
+      config_path, snapshot_path))
+  try:
+    Save(index_path, fingerprint, index)
+  except (IOError, OSError) as e:
+    sys.stderr.write('Could not write index {}: {}\n'.format(index_path, e))
+  return index, True
+
+
+def main():
+  args = sys.argv[1:]
+  config_path = (command_line.PopOption(args, '--config') or
+                 parse_run_groups_config.RUN_GROUPS_CONFIG)
+  index_path = command_line.PopOption(args, '--index')
+  snapshot_path = command_line.PopOption(args, '--snapshot')
+  if (snapshot_path is None and
+      config_path == parse_run_groups_config.RUN_GROUPS_CONFIG):
+    # the snapshot collects_to_scout and parse_run_groups_config keep
+    snapshot_path = parse_run_groups_config.SNAPSHOT_PATH
+  if args[:1] == ['build']:
+    index, _ = LoadOrBuild(config_path, index_path, rebuild=True,
+                           snapshot_path=snapshot_path)
+    print index.Stats()
+    return
+  if len(args) < 2 or args[0] not in ('run', 'country', 'name'):
+    sys.exit(__doc__)
+
+  index, built = LoadOrBuild(config_path, index_path,
+                             snapshot_path=snapshot_path)
+  if built:
+    sys.stderr.write('Index missing or out of date, built it from {}\n'
+                     .format(config_path))
+  query = ' '.join(args[1:])
+  if args[0] == 'run':
+    issue = index.Run(query)
+    issues = [issue] if issue else []
+  elif args[0] == 'country':
+    issues = index.Country(query)
+  else:
+    issues = index.Name(query)
+  if not issues:
+    sys.exit('No site for {} {}'.format(args[0], query))
+  print '\n'.join(str(issue) for issue in issues)
+
+
+if __name__ == '__main__':
+  main()
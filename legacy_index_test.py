@@ -0,0 +1,87 @@
+"""Tests for legacy_index."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import legacy_index
+from google3.cityblock.special.legacy import parse_run_groups_config
+
+CONFIG = ('# AQ\n'
+          '# AT-Ischgl "Ischgl"\n'
+          '# (46.9419651,10.2812022) -- (47.0107649,10.3410778)\n'
+          '  run: "run1"\n  run: "run2"\n'
+          '# AT-SchlossSchoenbrunn "Schloss Schoenbrunn"\n'
+          '  run: "run3"\n'
+          '# FR-LouvreMuseum "Louvre"\n'
+          '  run: "run4"\n  run: "run2"\n')
+
+
+class LegacyIndexTests(googletest.TestCase):
+
+  def setUp(self):
+    self.config_path = os.path.join(tempfile.mkdtemp(), 'run_groups.config')
+    with open(self.config_path, 'wb') as f:
+      f.write(CONFIG)
+
+  def testLookups(self):
+    """Test lookups by run id, country code and name."""
+    index, built = legacy_index.LoadOrBuild(self.config_path)
+    self.assertTrue(built)
+
+    self.assertEqual('Ischgl', index.Run('run2').issue_name)
+    self.assertEqual(['run4', 'run2'], index.Run('run4').runs)
+    self.assertIsNone(index.Run('run5'))
+    self.assertEqual(['Ischgl', 'Schloss Schoenbrunn'],
+                     [issue.issue_name for issue in index.Country('at')])
+    self.assertEqual([], index.Country('DE'))
+    self.assertEqual(['FR'], [issue.country_code
+                              for issue in index.Name('louvre museum')])
+    self.assertEqual('3 sites, 4 runs, 2 countries, 3 names', index.Stats())
+
+  def testIndexFollowsConfig(self):
+    """Test that the saved index is reused until the config changes."""
+    index, _ = legacy_index.LoadOrBuild(self.config_path)
+    self.assertTrue(os.path.exists(legacy_index.IndexPath(self.config_path)))
+    loaded, built = legacy_index.LoadOrBuild(self.config_path)
+    self.assertFalse(built)
+    self.assertEqual(str(index.Run('run3')), str(loaded.Run('run3')))
+    self.assertEqual(index.Stats(), loaded.Stats())
+
+    with open(self.config_path, 'ab') as f:
+      f.write('# DE-Reichstag "Reichstag"\n  run: "run5"\n')
+    index, built = legacy_index.LoadOrBuild(self.config_path)
+    self.assertTrue(built)
+    self.assertEqual('DE', index.Run('run5').country_code)
+
+  def testBuildReusesSnapshot(self):
+    """Test that the index is built from a current parse snapshot."""
+    snapshot_path = os.path.join(os.path.dirname(self.config_path),
+                                 'run_groups.snapshot')
+    parse_run_groups_config.LoadRunGroupsConfig(self.config_path,
+                                                snapshot_path)
+    # pylint: disable=protected-access
+    original = parse_run_groups_config._ParseLines
+    parse_run_groups_config._ParseLines = None
+    try:
+      index, built = legacy_index.LoadOrBuild(self.config_path,
+                                              snapshot_path=snapshot_path)
+    finally:
+      parse_run_groups_config._ParseLines = original
+
+    self.assertTrue(built)
+    self.assertEqual('3 sites, 4 runs, 2 countries, 3 names', index.Stats())
+
+  def testTouchedConfigKeepsIndex(self):
+    """Test that only a change of contents makes the index stale."""
+    legacy_index.LoadOrBuild(self.config_path)
+    stat = os.stat(self.config_path)
+    os.utime(self.config_path, (stat.st_atime, stat.st_mtime + 10))
+
+    _, built = legacy_index.LoadOrBuild(self.config_path)
+    self.assertFalse(built)
+
+
+if __name__ == '__main__':
+  googletest.main()
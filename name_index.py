@@ -0,0 +1,182 @@
+"""Fuzzy site-name matching through a trigram inverted index.
+
+Spreadsheet and legacy names for the same site often differ by a word or by
+punctuation ("Louvre Museum" and "Louvre Museum Paris").  Names are
+normalized and split into character trigrams; an inverted index from trigram
+to names retrieves candidates that share enough trigrams with a query, which
+are then scored with the Dice coefficient.  Only the rarest trigrams of each
+name are indexed and looked up, so matching stays close to linear in the
+number of names.
+"""
+
+import collections
+import math
+import re
+import unicodedata
+
+DEFAULT_THRESHOLD = 0.8
+
+_NON_ALPHANUMERIC = re.compile(r'[\W_]+', re.UNICODE)
+_NON_ASCII = re.compile(u'[^\x00-\x7f]')
+
+
+def Normalize(name):
+  """Returns name lowercased, without accents, punctuation or extra spaces.
+
+  Args:
+    name: Byte string in UTF-8, or unicode.
+
+  Returns:
+    Unicode string.
+  """
+  if isinstance(name, str):
+    name = name.decode('utf-8', 'replace')
+  if _NON_ASCII.search(name):
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name)
+                   if not unicodedata.combining(char))
+  return _NON_ALPHANUMERIC.sub(u' ', name.lower()).strip()
+
+
+def Trigrams(normalized_name):
+  """Returns the set of character trigrams of a normalized name."""
+  padded = u'  {} '.format(normalized_name)
+  return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def Similarity(grams_a, grams_b):
+  """Returns the Dice coefficient of two trigram sets."""
+  if not grams_a or not grams_b:
+    return 0.0
+  return 2.0 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def _MinOverlap(num_grams, threshold):
+  """Returns the fewest trigrams a name must share to reach threshold.
+
+  A Dice score of at least threshold against a name with num_grams trigrams
+  needs an overlap of at least threshold * num_grams / (2 - threshold),
+  whatever the length of the other name.
+  """
+  return max(1, int(math.ceil(threshold * num_grams / (2.0 - threshold)
+                              - 1e-9)))
+
+
+class NameIndex(object):
+  """Inverted index from trigrams to the items whose names contain them.
+
+  Trigrams are ordered by how many indexed names contain them.  Two names
+  scoring at least the threshold must share a trigram among the rarest
+  n - MinOverlap(n) + 1 of each, so only those prefixes are indexed and
+  looked up, and common trigrams are never scanned.
+  """
+
+  def __init__(self, threshold=DEFAULT_THRESHOLD):
+    """Constructor.
+
+    Args:
+      threshold: Lowest Dice similarity that Search can be asked for.
+    """
+    self.threshold = threshold
+    self._items = []
+    self._grams = []
+    self._frequency = None
+    self._postings = None
+
+  def __len__(self):
+    return len(self._items)
+
+  def Add(self, item, name):
+    """Indexes an item under a name."""
+    self._items.append(item)
+    self._grams.append(Trigrams(Normalize(name)))
+    self._postings = None
+
+  def _Prefix(self, grams):
+    ordered = sorted(grams, key=lambda gram: (self._frequency.get(gram, 0),
+                                              gram))
+    return ordered[:len(grams) - _MinOverlap(len(grams), self.threshold) + 1]
+
+  def _Build(self):
+    self._frequency = collections.Counter(
+        gram for grams in self._grams for gram in grams)
+    self._postings = collections.defaultdict(list)
+    for item_id, grams in enumerate(self._grams):
+      for gram in self._Prefix(grams):
+        self._postings[gram].append(item_id)
+
+  def Search(self, name, threshold=None):
+    """Returns the indexed items whose names are similar to name.
+
+    Args:
+      name: Name to look up.
+      threshold: Minimum Dice similarity, no lower than the index threshold;
+        defaults to the index threshold.
+
+    Returns:
+      List of (score, item) tuples, best first.
+    """
+    if threshold is None:
+      threshold = self.threshold
+    if threshold < self.threshold:
+      raise ValueError('Index built for similarity {}, not {}'.format(
+          self.threshold, threshold))
+    if self._postings is None:
+      self._Build()
+    grams = Trigrams(Normalize(name))
+    if not grams:
+      return []
+
+    candidates = set()
+    for gram in self._Prefix(grams):
+      candidates.update(self._postings.get(gram, ()))
+
+    # scores cannot reach threshold if the lengths differ too much
+    min_length = threshold * len(grams) / (2.0 - threshold)
+    max_length = (2.0 - threshold) * len(grams) / threshold
+    found = []
+    for item_id in candidates:
+      other = self._grams[item_id]
+      length = len(other)
+      if not min_length - 1e-9 <= length <= max_length + 1e-9:
+        continue
+      score = 2.0 * len(grams & other) / (len(grams) + length)
+      if score >= threshold:
+        found.append((score, item_id))
+    found.sort(key=lambda score_id: (-score_id[0], score_id[1]))
+    return [(score, self._items[item_id]) for score, item_id in found]
+
+
+def FindSimilar(current_sites, legacy_sites, threshold=DEFAULT_THRESHOLD):
+  """Pairs spreadsheet sites with legacy sites of similar names.
+
+  Each site is paired at most once, most similar pairs first.
+
+  Args:
+    current_sites: List of site objects from spreadsheets.
+    legacy_sites: List of legacy site objects.
+    threshold: Minimum Dice similarity of the trigrams of paired names.
+
+  Returns:
+    List of (current site, legacy site, score) tuples.
+  """
+  index = NameIndex(threshold)
+  for position, site in enumerate(legacy_sites):
+    index.Add(position, site.issue_name)
+
+  candidates = []
+  for position, site in enumerate(current_sites):
+    for score, legacy_position in index.Search(site.issue_name):
+      candidates.append((-score, position, legacy_position))
+  candidates.sort()
+
+  pairs = []
+  paired_current = set()
+  paired_legacy = set()
+  for negative_score, position, legacy_position in candidates:
+    if position in paired_current or legacy_position in paired_legacy:
+      continue
+    paired_current.add(position)
+    paired_legacy.add(legacy_position)
+    pairs.append((current_sites[position], legacy_sites[legacy_position],
+                  -negative_score))
+  return pairs
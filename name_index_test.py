@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Tests for name_index."""
+
+import random
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import name_index
+
+
+class Site(object):
+
+  def __init__(self, issue_name):
+    self.issue_name = issue_name
+
+
+class NameIndexTests(googletest.TestCase):
+
+  def testNormalize(self):
+    """Test that case, accents and punctuation are ignored."""
+    self.assertEqual(u'musee d orsay',
+                     name_index.Normalize('Musée  d\'Orsay!'))
+    self.assertEqual(u'', name_index.Normalize(' - '))
+
+  def testSearchMatchesBruteForce(self):
+    """Test that the index finds exactly the names a full scan does."""
+    rng = random.Random(5)
+    words = ['Louvre', 'Museum', 'Paris', 'Park', 'Tower', 'Bay', 'Zoo']
+    names = [' '.join(rng.choice(words) for _ in range(rng.randint(1, 4)))
+             for _ in range(300)]
+    index = name_index.NameIndex(0.7)
+    for position, name in enumerate(names):
+      index.Add(position, name)
+
+    for query in names[:40]:
+      query_grams = name_index.Trigrams(name_index.Normalize(query))
+      expected = sorted(
+          position for position, name in enumerate(names)
+          if name_index.Similarity(
+              query_grams, name_index.Trigrams(name_index.Normalize(name)))
+          >= 0.7)
+      found = index.Search(query)
+      self.assertEqual(expected, sorted(item for _, item in found))
+      scores = [score for score, _ in found]
+      self.assertEqual(sorted(scores, reverse=True), scores)
+
+    self.assertRaises(ValueError, index.Search, names[0], 0.5)
+
+  def testFindSimilarPairsBestFirst(self):
+    """Test that each site is paired at most once, most similar first."""
+    museum = Site('Louvre Museum')
+    park = Site('Central Park')
+    legacy_museum = Site('Louvre Museum Paris')
+    legacy_other = Site('Louvre Museums Paris France')
+
+    pairs = name_index.FindSimilar([museum, park],
+                                   [legacy_other, legacy_museum])
+
+    self.assertEqual([(museum, legacy_museum)],
+                     [(current, legacy) for current, legacy, _ in pairs])
+    self.assertGreaterEqual(pairs[0][2], name_index.DEFAULT_THRESHOLD)
+
+
+if __name__ == '__main__':
+  googletest.main()
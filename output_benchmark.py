@@ -0,0 +1,69 @@
+"""Round-trip benchmark of the CSV and binary record outputs.
+
+Writes the same synthetic sites with ToCSV and ToRecordFile, reads them back
+with ReadCSV and LoadRecordFile, and reports time and file size for each.
+
+usage: output_benchmark.py [num_sites] [runs_per_site]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from google3.cityblock.special.legacy import collects_to_scout
+
+
+def BuildSites(num_sites, runs_per_site):
+  sites = []
+  for i in range(num_sites):
+    site = collects_to_scout.CurrentIssue(
+        'Site {}'.format(i), '{} Main Street, Springfield'.format(i))
+    site.method = 'Car'
+    site.lat = 40.0 + i * 1e-5
+    site.lon = -75.0 - i * 1e-5
+    site.runs = ['2011{:06d}_{:06d}_L19069'.format(i, j)
+                 for j in range(runs_per_site)]
+    sites.append(site)
+  return sites
+
+
+def Time(function, *args):
+  start = time.time()
+  result = function(*args)
+  return time.time() - start, result
+
+
+def main():
+  num_sites = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  runs_per_site = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+  sites = BuildSites(num_sites, runs_per_site)
+  directory = tempfile.mkdtemp()
+  arg_file = os.path.join(directory, 'sites.csv')
+
+  try:
+    csv_write, _ = Time(collects_to_scout.ToCSV, arg_file, sites)
+    csv_file = arg_file.replace('.csv', '_toScout.csv')
+    csv_read, _ = Time(lambda: list(collects_to_scout.ReadCSV(csv_file)))
+
+    rec_write, _ = Time(collects_to_scout.ToRecordFile, arg_file, sites,
+                        False)
+    rec_file = arg_file.replace('.csv', '_toScout.rec')
+    rec_read, _ = Time(lambda: list(collects_to_scout.LoadRecordFile(
+        rec_file)))
+
+    print '{} sites, {} runs per site'.format(num_sites, runs_per_site)
+    print '{:8} {:>10} {:>10} {:>10}'.format('format', 'write s', 'read s',
+                                             'MiB')
+    for name, write, read, path in (('csv', csv_write, csv_read, csv_file),
+                                    ('records', rec_write, rec_read,
+                                     rec_file)):
+      print '{:8} {:10.3f} {:10.3f} {:10.1f}'.format(
+          name, write, read, os.path.getsize(path) / 2.0 ** 20)
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main()
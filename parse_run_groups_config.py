@@ -4,10 +4,30 @@ Mine data from special-reports legacy website to extract site information
 along with run groups.
 """
 
+import hashlib
+import json
+import marshal
+import mmap
+import multiprocessing
+import os
 import re
+import sys
+import tempfile
+
+from google3.cityblock.special.legacy import command_line
+from google3.cityblock.special.legacy import run_table
+from google3.cityblock.special.legacy import stage_metrics
+
+RUN_GROUPS_CONFIG = (
+    '/home/cb-ops-sys/www/special/legacy/reports/run_groups.config')
+SNAPSHOT_PATH = os.path.expanduser('~/.run_groups_config.snapshot')
+SNAPSHOT_MAGIC = 'RGCSNAP1'
+INCREMENTAL_STATE_PATH = os.path.expanduser('~/.run_groups_config.state')
 
 
 class LegacyIssue(object):
+  __slots__ = ('issue_name', 'lat', 'lon', '_country_code', '_runs')
+
   def __init__(self, issue_name, country_code):
     self.country_code = country_code
     self.issue_name = issue_name
@@ -15,6 +35,30 @@ class LegacyIssue(object):
     self.lon = None
     self.runs = []
 
+  @property
+  def country_code(self):
+    return self._country_code
+
+  @country_code.setter
+  def country_code(self, country_code):
+    self._country_code = intern(country_code)
+
+  @property
+  def runs(self):
+    return self._runs
+
+  @runs.setter
+  def runs(self, runs):
+    self._runs = run_table.RunList(runs)
+
+  def __getstate__(self):
+    return (self.issue_name, self.country_code, self.lat, self.lon,
+            list(self.runs))
+
+  def __setstate__(self, state):
+    (self.issue_name, self.country_code, self.lat, self.lon,
+     self.runs) = state
+
   def __str__(self):
     return '{}-{} {},{} {}'.format(
         self.country_code, self.issue_name,
@@ -41,78 +85,550 @@ def Mid(lat1, lon1, lat2, lon2):
   return lat, lon
 
 
-def ParseRunGroupsConfig(lines):
-  """This is a list of objects containing site information.
+COLLECTION_NAME_PATTERN = re.compile(r'^\s*# ([A-Z][A-Z])-([^ ]*)'
+                                     r' "([^"]*)"\s*$')
+LAT_LNG_PATTERN = re.compile(r'^\s*# \(([-0-9.]+),([-0-9.]+)\)'
+                             r' -- \(([-0-9.]+),([-0-9.]+)\)\s*$')
+RUN_PATTERN = re.compile(r'^\s*run: "([^"]*)"\s*$')
+START_MARKER = '# AQ'
+STOP_MARKER = 'XX-OrphanRuns'
 
-  This will return a list of objects where each object contains the
-  country code, site name, coordinates, and runs.
 
-  Args:
-    lines: list of lines of data to be parsed.
+class RunGroupsConfigParser(object):
+  """Line-at-a-time parser for run_groups.config.
 
-  Returns:
-    list of LegacyIssue objects.
+  Lines are fed in file order and each LegacyIssue is handed back once the
+  next section starts (or the input ends), so callers never need to hold the
+  whole file in memory.
   """
-  while not lines[0].startswith('# AQ'):
-    lines.pop(0)
-
-  country_code = None
-  issue_name = None
-  issue = None
-  skip_files = False
-  collection_name_pattern = re.compile(r'^\s*# ([A-Z][A-Z])-([^ ]*)'
-                                       r' "([^"]*)"\s*$')
-  lat_lng_pattern = re.compile(r'^\s*# \(([-0-9.]+),([-0-9.]+)\)'
-                               r' -- \(([-0-9.]+),([-0-9.]+)\)\s*$')
-  run_pattern = re.compile(r'^\s*run: "([^"]*)"\s*$')
-  issues = []
 
-  for line in lines:
-    match = collection_name_pattern.match(line)
+  def __init__(self, started=False, coordinates=None):
+    """Constructor.
+
+    Args:
+      started: Whether the '# AQ' start marker has already been passed.
+      coordinates: List to collect (issue, lat1, lon1, lat2, lon2) raw
+        coordinate strings in, leaving the midpoints to be computed in bulk,
+        or None to compute each midpoint with Mid while parsing.
+    """
+    self.started = started
+    self.stopped = False
+    self.issue = None
+    self.skip_files = False
+    self.coordinates = coordinates
+
+  def Feed(self, line):
+    """Parses one line.
+
+    Args:
+      line: Line of the config file.
+
+    Returns:
+      The LegacyIssue finished by this line, or None.
+    """
+    if self.stopped:
+      return None
+    if not self.started:
+      self.started = line.startswith(START_MARKER)
+      if not self.started:
+        return None
+
+    finished = None
+    match = COLLECTION_NAME_PATTERN.match(line)
     if match:
-      skip_files = False
+      finished = self.issue
+      self.skip_files = False
       country_code = match.group(1)
       issue_name = match.group(2)
-      
+
       # separate site name into words for readability
       buffer = []
       for s in re.split(r'([A-Z][A-Z]*[a-z0-9-]*)', issue_name):
-        if s: 
+        if s:
           buffer.append(s)
       issue_name = ' '.join(buffer)
-      
+
       if ('test' not in issue_name.lower() and '_' not in issue_name
           and '~' not in issue_name):
-        issue = LegacyIssue(issue_name, country_code)
-        issues.append(issue)
+        self.issue = LegacyIssue(issue_name, country_code)
       else:
-        skip_files = True
-        issue = None
+        self.skip_files = True
+        self.issue = None
 
-    if not skip_files:
-      match = lat_lng_pattern.match(line)
+    if not self.skip_files and self.issue:
+      match = LAT_LNG_PATTERN.match(line)
       if match:
         lat1, lon1, lat2, lon2 = match.groups()
-        # finds midpoint
-        issue.lat, issue.lon = Mid(lat1, lon1, lat2, lon2)
+        if self.coordinates is not None:
+          self.coordinates.append((self.issue, lat1, lon1, lat2, lon2))
+        else:
+          # finds midpoint
+          self.issue.lat, self.issue.lon = Mid(lat1, lon1, lat2, lon2)
 
-      match = run_pattern.match(line)
-      if match and issue:
+      match = RUN_PATTERN.match(line)
+      if match:
         run = match.group(1)
-        issue.runs.append(run)
+        self.issue.runs.append(run)
+
+    if STOP_MARKER in line:
+      self.stopped = True
+    return finished
+
+  def Close(self):
+    """Returns the last LegacyIssue still being parsed, or None."""
+    issue = self.issue
+    self.issue = None
+    return issue
+
+
+def IterRunGroupsConfig(lines, parser=None):
+  """Yields the sites of a run_groups.config one section at a time.
 
-    if 'XX-OrphanRuns' in line:
+  Args:
+    lines: Iterable of lines, such as an open file.
+    parser: RunGroupsConfigParser to use, defaults to a new one.
+
+  Yields:
+    LegacyIssue objects in file order.
+  """
+  parser = parser or RunGroupsConfigParser()
+  for line in lines:
+    issue = parser.Feed(line)
+    if issue:
+      yield issue
+    if parser.stopped:
       break
+  issue = parser.Close()
+  if issue:
+    yield issue
+
+
+def ParseRunGroupsConfig(lines):
+  """This is a list of objects containing site information.
+
+  This will return a list of objects where each object contains the
+  country code, site name, coordinates, and runs.
+
+  Args:
+    lines: list of lines of data to be parsed.
+
+  Returns:
+    list of LegacyIssue objects.
+  """
+  return list(IterRunGroupsConfig(lines))
+
+
+def _FindSectionStart(data, offset, end):
+  """Returns the offset of the first section header at or after offset."""
+  if offset > 0 and data[offset - 1] != '\n':
+    newline = data.find('\n', offset, end)
+    offset = end if newline < 0 else newline + 1
+  while offset < end:
+    newline = data.find('\n', offset, end)
+    line_end = end if newline < 0 else newline + 1
+    if COLLECTION_NAME_PATTERN.match(data[offset:line_end]):
+      return offset
+    offset = line_end
+  return end
+
+
+def SplitRunGroupsConfig(path, num_chunks):
+  """Splits a run_groups.config into byte ranges at section boundaries.
+
+  Only the part from the '# AQ' start marker through the line holding the
+  'XX-OrphanRuns' stop marker is covered, and every range after the first
+  begins on a section header, so the ranges can be parsed independently.
+
+  Args:
+    path: Path of the config file.
+    num_chunks: Desired number of ranges.
+
+  Returns:
+    List of (begin, end) byte offsets in file order.
+  """
+  with open(path, 'rb') as f:
+    if not os.fstat(f.fileno()).st_size:
+      return []
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    if data[:len(START_MARKER)] == START_MARKER:
+      start = 0
+    else:
+      start = data.find('\n' + START_MARKER)
+      if start < 0:
+        return []
+      start += 1
+    end = len(data)
+    stop = data.find(STOP_MARKER, start)
+    if stop >= 0:
+      newline = data.find('\n', stop)
+      end = end if newline < 0 else newline + 1
+
+    boundaries = [start]
+    for i in range(1, num_chunks):
+      target = start + (end - start) * i // num_chunks
+      boundary = _FindSectionStart(data, max(target, boundaries[-1] + 1), end)
+      if boundary >= end:
+        break
+      if boundary > boundaries[-1]:
+        boundaries.append(boundary)
+    boundaries.append(end)
+  finally:
+    data.close()
+  return zip(boundaries[:-1], boundaries[1:])
+
+
+def _ParseLines(lines, started=False, bulk_midpoints=False):
+  """Parses lines into LegacyIssues, optionally with bulk midpoints.
+
+  Args:
+    lines: Iterable of lines.
+    started: Whether the lines begin after the '# AQ' start marker.
+    bulk_midpoints: Whether to collect the coordinates and compute all
+      midpoints in one NumPy pass with legacy_coords instead of calling Mid
+      per line. The results are identical.
+
+  Returns:
+    list of LegacyIssue objects.
+  """
+  coordinates = [] if bulk_midpoints else None
+  parser = RunGroupsConfigParser(started=started, coordinates=coordinates)
+  issues = list(IterRunGroupsConfig(lines, parser))
+  if bulk_midpoints:
+    # imported here as NumPy is only needed for bulk midpoints, and
+    # legacy_coords imports this module
+    # pylint: disable=g-import-not-at-top
+    from google3.cityblock.special.legacy import legacy_coords
+    legacy_coords.ApplyMidpoints(coordinates)
+  return issues
+
+
+def _ParseChunk(chunk):
+  """Parses one byte range produced by SplitRunGroupsConfig.
+
+  Returns:
+    A tuple (issues, stats) of the parsed sites and the profile of the
+    parse, or None when the chunk is not profiled.
+  """
+  path, begin, end, bulk_midpoints, profile = chunk
+  with open(path, 'rb') as f:
+    f.seek(begin)
+    data = f.read(end - begin)
+  args = (data.split('\n'), True, bulk_midpoints)
+  if profile:
+    return stage_metrics.ProfileCall(_ParseLines, *args)
+  return _ParseLines(*args), None
+
+
+def ParseRunGroupsConfigParallel(path, num_workers=None, num_chunks=None,
+                                 bulk_midpoints=False, worker_stats=None):
+  """Parses a run_groups.config on several cores.
+
+  The file is split at section boundaries, the pieces are parsed in a process
+  pool and the results are joined in file order, giving the same list as
+  ParseRunGroupsConfig.
+
+  Args:
+    path: Path of the config file.
+    num_workers: Number of worker processes, defaults to the number of CPUs.
+    num_chunks: Number of pieces to split the file into, defaults to four per
+      worker so uneven sections balance out.
+    bulk_midpoints: Whether each piece computes its midpoints in bulk.
+    worker_stats: List yielded by stage_metrics.Profile to add the workers'
+      profiles to, or None to not profile them.
+
+  Returns:
+    list of LegacyIssue objects.
+  """
+  num_workers = num_workers or multiprocessing.cpu_count()
+  num_chunks = num_chunks or 4 * num_workers
+  chunks = [(path, begin, end, bulk_midpoints, worker_stats is not None)
+            for begin, end in SplitRunGroupsConfig(path, num_chunks)]
+  if len(chunks) <= 1 or num_workers <= 1:
+    # parsed in this process, so the caller's profiler already sees them
+    chunks = [chunk[:-1] + (False,) for chunk in chunks]
+    results = [_ParseChunk(chunk) for chunk in chunks]
+  else:
+    pool = multiprocessing.Pool(min(num_workers, len(chunks)))
+    try:
+      results = pool.map(_ParseChunk, chunks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+  for _, stats in results:
+    if stats is not None:
+      worker_stats.append(stats)
+  return [issue for issues, _ in results for issue in issues]
+
+
+def Fingerprint(path):
+  """Returns (size, mtime, sha1 hex digest) identifying a file's contents."""
+  stat = os.stat(path)
+  digest = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), ''):
+      digest.update(block)
+  return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+
+def FingerprintMatches(path, fingerprint):
+  """Returns whether a file still has a fingerprint taken earlier.
+
+  The size and mtime are compared first, and the contents are only hashed
+  when the size is unchanged but the mtime is not, e.g. after a touch or a
+  copy, so checking an unchanged config does not read it.
+
+  Args:
+    path: Path of the file.
+    fingerprint: Fingerprint() of the file taken earlier.
+  """
+  size, mtime, digest = fingerprint
+  stat = os.stat(path)
+  if stat.st_size != size:
+    return False
+  if stat.st_mtime == mtime:
+    return True
+  return Fingerprint(path)[2] == digest
+
+
+def SaveSnapshot(snapshot_path, fingerprint, issues):
+  """Writes parsed sites to a compact binary snapshot.
+
+  Args:
+    snapshot_path: File to write.
+    fingerprint: Fingerprint() of the config the sites were parsed from.
+    issues: List of LegacyIssue objects.
+  """
+  records = [(issue.country_code, issue.issue_name, issue.lat, issue.lon,
+              list(issue.runs)) for issue in issues]
+  directory = os.path.dirname(os.path.abspath(snapshot_path))
+  fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot')
+  with os.fdopen(fd, 'wb') as f:
+    f.write(SNAPSHOT_MAGIC)
+    marshal.dump((tuple(fingerprint), records), f, 2)
+  os.rename(tmp_path, snapshot_path)
+
+
+def LoadSnapshot(snapshot_path, path):
+  """Loads a snapshot written by SaveSnapshot.
+
+  Args:
+    snapshot_path: File to read.
+    path: Path of the config the snapshot must have been taken from.
+
+  Returns:
+    list of LegacyIssue objects, or None if the snapshot is missing, corrupt
+    or was taken from a different version of the config.
+  """
+  try:
+    with open(snapshot_path, 'rb') as f:
+      if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        return None
+      saved_fingerprint, records = marshal.load(f)
+  except (IOError, EOFError, ValueError, TypeError):
+    return None
+  if not FingerprintMatches(path, saved_fingerprint):
+    return None
+
+  issues = []
+  for country_code, issue_name, lat, lon, runs in records:
+    issue = LegacyIssue(issue_name, country_code)
+    issue.lat = lat
+    issue.lon = lon
+    issue.runs = runs
+    issues.append(issue)
   return issues
 
 
+def LoadRunGroupsConfig(path, snapshot_path=None, num_workers=1,
+                        bulk_midpoints=False, worker_stats=None):
+  """Returns the parsed sites of a config, reusing a snapshot when valid.
+
+  The snapshot is keyed on the config's size, mtime and content hash; when
+  the contents changed the config is parsed again and the snapshot rebuilt.
+
+  Args:
+    path: Path of the config file.
+    snapshot_path: Snapshot file, or None to always parse.
+    num_workers: Number of processes to parse with when parsing is needed.
+    bulk_midpoints: Whether to compute the midpoints in bulk with NumPy.
+    worker_stats: List yielded by stage_metrics.Profile to add the parsing
+      processes' profiles to, or None.
+
+  Returns:
+    list of LegacyIssue objects.
+  """
+  if snapshot_path:
+    issues = LoadSnapshot(snapshot_path, path)
+    if issues is not None:
+      return issues
+    # taken before parsing, so a config written meanwhile is parsed again
+    fingerprint = Fingerprint(path)
+
+  if num_workers > 1:
+    issues = ParseRunGroupsConfigParallel(path, num_workers,
+                                          bulk_midpoints=bulk_midpoints,
+                                          worker_stats=worker_stats)
+  else:
+    with open(path, 'rU') as f:
+      issues = _ParseLines(f, bulk_midpoints=bulk_midpoints)
+
+  if snapshot_path:
+    try:
+      SaveSnapshot(snapshot_path, fingerprint, issues)
+    except (IOError, OSError) as e:
+      sys.stderr.write('Could not write snapshot {}: {}\n'.format(
+          snapshot_path, e))
+  return issues
+
+
+def _IssueRecord(issue):
+  if issue is None:
+    return None
+  return [issue.country_code, issue.issue_name, issue.lat, issue.lon,
+          list(issue.runs)]
+
+
+def _IssueFromRecord(record):
+  if record is None:
+    return None
+  country_code, issue_name, lat, lon, runs = record
+  # json decodes to unicode while the parser works on byte strings
+  issue = LegacyIssue(issue_name.encode('utf-8'), country_code.encode('utf-8'))
+  issue.lat = lat
+  issue.lon = lon
+  issue.runs = [run.encode('utf-8') for run in runs]
+  return issue
+
+
+def _PrefixDigest(f, offset):
+  """Returns the sha1 hex digest of the bytes before offset."""
+  # hashing runs at disk speed, far faster than parsing the same bytes
+  f.seek(0)
+  digest = hashlib.sha1()
+  remaining = offset
+  while remaining:
+    block = f.read(min(remaining, 1 << 20))
+    if not block:
+      break
+    digest.update(block)
+    remaining -= len(block)
+  return digest.hexdigest()
+
+
+def _LoadIncrementalState(state_path, f):
+  """Returns the saved state if the file was only appended to since."""
+  try:
+    with open(state_path, 'rb') as state_file:
+      state = json.load(state_file)
+  except (IOError, ValueError):
+    return None
+  offset = state['offset']
+  if os.fstat(f.fileno()).st_size < offset:
+    return None
+  if _PrefixDigest(f, offset) != state.get('digest'):
+    return None
+  return state
+
+
+def ParseRunGroupsConfigIncremental(path, state_path):
+  """Parses only what was appended to a config since the last call.
+
+  The byte offset reached and the parser state (current LegacyIssue and
+  skip_files) are saved to state_path.  The next call checks that the bytes
+  before that offset are unchanged and resumes from there; if the file was
+  rewritten rather than appended to, the whole file is parsed again.
+
+  Args:
+    path: Path of the config file.
+    state_path: File holding the state of the previous call.
+
+  Returns:
+    A tuple (issues, full_parse) where issues are the LegacyIssue objects
+    that are new or gained runs or coordinates since the last call, and
+    full_parse tells whether the file had to be parsed from the start.
+  """
+  with open(path, 'rb') as f:
+    state = _LoadIncrementalState(state_path, f)
+    parser = RunGroupsConfigParser()
+    offset = 0
+    resumed = None
+    if state:
+      offset = state['offset']
+      parser.started = state['started']
+      parser.stopped = state['stopped']
+      parser.skip_files = state['skip_files']
+      parser.issue = resumed = _IssueFromRecord(state['issue'])
+    resumed_record = _IssueRecord(resumed)
+
+    issues = []
+
+    def Emit(issue):
+      if issue and (issue is not resumed or
+                    _IssueRecord(issue) != resumed_record):
+        issues.append(issue)
+
+    f.seek(offset)
+    while not parser.stopped:
+      line = f.readline()
+      # leave a partially written last line for the next call
+      if not line.endswith('\n'):
+        break
+      offset += len(line)
+      Emit(parser.Feed(line))
+    Emit(parser.issue)
+
+    new_state = {
+        'offset': offset,
+        'digest': _PrefixDigest(f, offset),
+        'started': parser.started,
+        'stopped': parser.stopped,
+        'skip_files': parser.skip_files,
+        'issue': _IssueRecord(parser.issue),
+    }
+
+  directory = os.path.dirname(os.path.abspath(state_path))
+  fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.incremental')
+  with os.fdopen(fd, 'wb') as state_file:
+    json.dump(new_state, state_file)
+  os.rename(tmp_path, state_path)
+  return issues, state is None
+
+
 def main():
-  with open('/home/cb-ops-sys/www/special/legacy/reports/run_groups.config',
-            'rU') as f:
-    lines = f.readlines()
-  results = ParseRunGroupsConfig(lines)
+  args = sys.argv[1:]
+  metrics_path = command_line.PopOption(args, '--metrics')
+  profile_path = command_line.PopOption(args, '--profile')
+  bulk_midpoints = command_line.PopFlag(args, '--bulk-midpoints')
+  num_workers = command_line.PopOption(args, '--jobs', int, 1)
+  incremental = command_line.PopFlag(args, '--incremental')
+  if args:
+    print ('usage: [--jobs N] [--bulk-midpoints] [--incremental] '
+           '[--metrics PATH|-] [--profile PATH]')
+    sys.exit()
+  metrics = stage_metrics.Metrics()
+
+  with stage_metrics.Profile(profile_path) as worker_stats:
+    if incremental:
+      with metrics.Stage('parse_incremental'):
+        results, full_parse = ParseRunGroupsConfigIncremental(
+            RUN_GROUPS_CONFIG, INCREMENTAL_STATE_PATH)
+      metrics.Count('full_parse', int(full_parse))
+      if full_parse:
+        print 'Config was rewritten, parsed from the start'
+    else:
+      with metrics.Stage('load'):
+        results = LoadRunGroupsConfig(RUN_GROUPS_CONFIG, SNAPSHOT_PATH,
+                                      num_workers, bulk_midpoints,
+                                      worker_stats)
+    metrics.Count('sites', len(results))
+    metrics.Count('runs', sum(len(r.runs) for r in results))
+    metrics.Count('distinct_runs', len(run_table.RUNS))
+    with metrics.Stage('print'):
+      print '\n'.join([str(r) for r in results])
 
-  print '\n'.join([str(r) for r in results])
+  if metrics_path:
+    metrics.Save(metrics_path)
 
 
 if __name__ == '__main__':
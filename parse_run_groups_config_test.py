@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 """Tests for parsing run group config."""
 
+import os
+import tempfile
+
 from google3.testing.pybase import googletest
 from google3.cityblock.special.legacy import parse_run_groups_config
 
@@ -101,6 +104,171 @@ class ParseTests(googletest.TestCase):
                       '20110401_212830_L19069', '20110401_231023_L19069',
                       '20110401_235438_L19069'], collections[1].runs)
 
+  def testIterRunGroupsConfig(self):
+    """Test that streaming yields the same sites as the list API."""
+    lines = """preamble
+# AQ
+# AQ-HalfMoonIslandAQ "Half Moon Island, Antarctica"
+# (-62.5965443,-59.9072398) -- (-62.5935121,-59.8935582)
+run_group <
+  run: "20100125_015702_panos_antartica_bam"
+>
+# AT-TestSite "Skipped"
+  run: "20110330_000000_L19069"
+# AT-Ischgi "NA"
+# (46.9419651,10.2812022) -- (47.0107649,10.3410778)
+  run: "20110330_213813_L19069"
+  run: "20110331_071816_L19069"
+XX-OrphanRuns
+# ZZ-ExcludeMe "Exclude Me"
+  run: "99999999_999999_L99999"
+""".split('\n')
+
+    streamed = parse_run_groups_config.IterRunGroupsConfig(iter(lines))
+    first = next(streamed)
+    self.assertEqual('AQ', first.country_code)
+    self.assertEqual(['20100125_015702_panos_antartica_bam'], first.runs)
+
+    expected = parse_run_groups_config.ParseRunGroupsConfig(lines)
+    actual = [first] + list(streamed)
+    self.assertEqual([str(c) for c in expected], [str(c) for c in actual])
+    self.assertEqual(['AQ', 'AT'], [c.country_code for c in actual])
+    self.assertEqual(['20110330_213813_L19069', '20110331_071816_L19069'],
+                     actual[1].runs)
+
+  def testParseRunGroupsConfigParallel(self):
+    """Test that chunked parsing matches the serial parser."""
+    sections = []
+    for i in range(40):
+      sections.append('# AT-Site{0}X "Site {0}"\n'
+                      '# (46.9,10.2) -- (47.{0},10.3)\n'
+                      'run_group <\n'
+                      '  run: "2011_{0}_a"\n'
+                      '  run: "2011_{0}_b"\n'
+                      '>\n'.format(i))
+    config = ('# AA-Preamble "Ignore this"\n  run: "ignored"\n# AQ\n' +
+              ''.join(sections) +
+              '# XX-OrphanRuns "Orphans"\n  run: "orphan"\n' +
+              '# ZZ-ExcludeMe "Exclude Me"\n  run: "excluded"\n')
+    path = os.path.join(tempfile.mkdtemp(), 'run_groups.config')
+    with open(path, 'wb') as f:
+      f.write(config)
+
+    with open(path, 'rU') as f:
+      expected = parse_run_groups_config.ParseRunGroupsConfig(f)
+    worker_stats = []
+    actual = parse_run_groups_config.ParseRunGroupsConfigParallel(
+        path, num_workers=2, num_chunks=7, worker_stats=worker_stats)
+
+    self.assertEqual(41, len(actual))
+    self.assertEqual(7, len(worker_stats))
+    self.assertEqual([str(c) for c in expected], [str(c) for c in actual])
+
+  def testLoadRunGroupsConfigSnapshot(self):
+    """Test that a snapshot is reused until the config changes."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'run_groups.config')
+    snapshot_path = os.path.join(directory, 'run_groups.snapshot')
+    with open(path, 'wb') as f:
+      f.write('# AQ\n# AT-Ischgi "NA"\n'
+              '# (46.9419651,10.2812022) -- (47.0107649,10.3410778)\n'
+              '  run: "20110330_213813_L19069"\n')
+
+    parsed = parse_run_groups_config.LoadRunGroupsConfig(path, snapshot_path)
+    self.assertTrue(os.path.exists(snapshot_path))
+    loaded = parse_run_groups_config.LoadSnapshot(snapshot_path, path)
+    self.assertEqual([str(c) for c in parsed], [str(c) for c in loaded])
+
+    # a touched config is hashed and still matches
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    self.assertIsNotNone(
+        parse_run_groups_config.LoadSnapshot(snapshot_path, path))
+
+    with open(path, 'ab') as f:
+      f.write('  run: "20110331_071816_L19069"\n')
+    self.assertIsNone(
+        parse_run_groups_config.LoadSnapshot(snapshot_path, path))
+
+    reparsed = parse_run_groups_config.LoadRunGroupsConfig(path,
+                                                           snapshot_path)
+    self.assertEqual(['20110330_213813_L19069', '20110331_071816_L19069'],
+                     reparsed[0].runs)
+
+  def testFingerprintMatchesHashesOnlyOnNewMtime(self):
+    """Test that the contents are read only when size and mtime disagree."""
+    path = os.path.join(tempfile.mkdtemp(), 'run_groups.config')
+    with open(path, 'wb') as f:
+      f.write('# AQ\n')
+    fingerprint = parse_run_groups_config.Fingerprint(path)
+    original = parse_run_groups_config.Fingerprint
+    hashed = []
+    parse_run_groups_config.Fingerprint = lambda p: hashed.append(p) or (
+        original(p))
+    try:
+      self.assertTrue(
+          parse_run_groups_config.FingerprintMatches(path, fingerprint))
+      self.assertEqual([], hashed)
+
+      with open(path, 'wb') as f:
+        f.write('# AT\n')
+      os.utime(path, (fingerprint[1] + 10, fingerprint[1] + 10))
+      self.assertFalse(
+          parse_run_groups_config.FingerprintMatches(path, fingerprint))
+      self.assertEqual([path], hashed)
+    finally:
+      parse_run_groups_config.Fingerprint = original
+
+  def testParseRunGroupsConfigIncremental(self):
+    """Test that only appended sites and runs are reported."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'run_groups.config')
+    state_path = os.path.join(directory, 'run_groups.state')
+    with open(path, 'wb') as f:
+      f.write('preamble\n# AQ\n'
+              '# AQ-PointX "Point"\n  run: "run1"\n'
+              '# AT-IschgiX "Ischgi"\n  run: "run2"\n')
+
+    issues, full_parse = (
+        parse_run_groups_config.ParseRunGroupsConfigIncremental(
+            path, state_path))
+    self.assertTrue(full_parse)
+    self.assertEqual(['AQ', 'AT'], [i.country_code for i in issues])
+
+    issues, full_parse = (
+        parse_run_groups_config.ParseRunGroupsConfigIncremental(
+            path, state_path))
+    self.assertFalse(full_parse)
+    self.assertEqual([], issues)
+
+    with open(path, 'ab') as f:
+      f.write('  run: "run3"\n# BE-BrusselsX "Brussels"\n  run: "run4"\n'
+              '# CH-Partial')
+    issues, full_parse = (
+        parse_run_groups_config.ParseRunGroupsConfigIncremental(
+            path, state_path))
+    self.assertFalse(full_parse)
+    self.assertEqual(['AT', 'BE'], [i.country_code for i in issues])
+    self.assertEqual(['run2', 'run3'], issues[0].runs)
+
+    # an edit in the middle of the parsed part, keeping its length
+    with open(path, 'r+b') as f:
+      f.seek(len('preamble\n# AQ\n# AQ-PointX "Point"\n  run: "run'))
+      f.write('9')
+    issues, full_parse = (
+        parse_run_groups_config.ParseRunGroupsConfigIncremental(
+            path, state_path))
+    self.assertTrue(full_parse)
+    self.assertEqual(['run9'], issues[0].runs)
+
+    with open(path, 'wb') as f:
+      f.write('# AQ\n# FR-LouvreX "Louvre"\n  run: "run5"\n')
+    issues, full_parse = (
+        parse_run_groups_config.ParseRunGroupsConfigIncremental(
+            path, state_path))
+    self.assertTrue(full_parse)
+    self.assertEqual(['FR'], [i.country_code for i in issues])
+
   def testNonAscii(self):
     """Test for non-ascii unicode characters."""
     lines = """# AQ
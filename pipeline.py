@@ -0,0 +1,184 @@
+"""Thread pipeline with bounded queues between stages.
+
+Each stage runs on its own threads and hands items to the next stage through
+a Queue of limited size.  A stage that falls behind fills its input queue and
+blocks the stage before it, so only a bounded number of items is in flight
+and the first items reach the end of the pipeline long before the last ones
+have been read.
+"""
+
+import Queue
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 100
+_POLL_SECONDS = 0.1
+
+
+class _Done(object):
+  """Marks the end of a stage's input."""
+
+
+_DONE = _Done()
+
+
+class _Aborted(Exception):
+  """Raised in stage threads once another stage has failed."""
+
+
+class StageStats(object):
+  """Items passed through a stage and time it spent blocked downstream."""
+
+  def __init__(self, name, workers):
+    self.name = name
+    self.workers = workers
+    self.items_in = 0
+    self.items_out = 0
+    self.blocked_seconds = 0.0
+    self._lock = threading.Lock()
+
+  def Add(self, items_in=0, items_out=0, blocked_seconds=0.0):
+    with self._lock:
+      self.items_in += items_in
+      self.items_out += items_out
+      self.blocked_seconds += blocked_seconds
+
+  def __str__(self):
+    return ('{}: {} workers, {} in, {} out, {:.2f}s blocked on a full '
+            'queue'.format(self.name, self.workers, self.items_in,
+                           self.items_out, self.blocked_seconds))
+
+
+class Pipeline(object):
+  """Chain of stages connected by bounded queues.
+
+  A stage is a function taking an iterator over its input items and returning
+  an iterable of output items, so it can map, filter, or keep state and emit
+  more items once its input is exhausted.  A stage with several workers runs
+  the function once per worker thread over a shared input.
+  """
+
+  def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, clock=time.time):
+    self.queue_size = queue_size
+    self.stats = []
+    self.first_output_seconds = None
+    self._clock = clock
+    self._stages = []
+    self._failed = threading.Event()
+    self._error = None
+    self._lock = threading.Lock()
+
+  def AddStage(self, name, function, workers=1):
+    """Appends a stage; the first stage is called with an empty iterator."""
+    self._stages.append((function, workers))
+    self.stats.append(StageStats(name, workers))
+    return self
+
+  def _Put(self, queue, item, stats):
+    start = None
+    while True:
+      if self._failed.is_set():
+        raise _Aborted()
+      try:
+        queue.put(item, timeout=_POLL_SECONDS)
+        break
+      except Queue.Full:
+        start = start or self._clock()
+    if start is not None:
+      stats.Add(blocked_seconds=self._clock() - start)
+
+  def _Get(self, queue):
+    while True:
+      if self._failed.is_set():
+        raise _Aborted()
+      try:
+        return queue.get(timeout=_POLL_SECONDS)
+      except Queue.Empty:
+        pass
+
+  def _Items(self, queue, stats):
+    """Yields a worker's share of a stage's input until the end marker."""
+    if queue is None:
+      return
+    while True:
+      item = self._Get(queue)
+      if item is _DONE:
+        return
+      stats.Add(items_in=1)
+      yield item
+
+  def _RunWorker(self, function, stats, in_queue, out_queue, remaining,
+                 downstream_workers):
+    try:
+      for item in function(self._Items(in_queue, stats)):
+        self._Put(out_queue, item, stats)
+        stats.Add(items_out=1)
+      with self._lock:
+        remaining[0] -= 1
+        last = not remaining[0]
+      if last:
+        # the last worker to finish tells every downstream worker
+        for _ in range(downstream_workers):
+          self._Put(out_queue, _DONE, stats)
+    except _Aborted:
+      pass
+    except Exception as e:  # pylint: disable=broad-except
+      with self._lock:
+        if self._error is None:
+          self._error = e
+      self._failed.set()
+
+  def Run(self):
+    """Starts all stages and yields the items the last stage produces.
+
+    Raises:
+      The first exception raised by any stage, after stopping the others.
+    """
+    queues = [Queue.Queue(self.queue_size) for _ in self._stages]
+    threads = []
+    in_queue = None
+    for index, (function, workers) in enumerate(self._stages):
+      downstream_workers = (self._stages[index + 1][1]
+                            if index + 1 < len(self._stages) else 1)
+      remaining = [workers]
+      for _ in range(workers):
+        thread = threading.Thread(
+            target=self._RunWorker,
+            args=(function, self.stats[index], in_queue, queues[index],
+                  remaining, downstream_workers))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+      in_queue = queues[index]
+
+    start = self._clock()
+    finished = False
+    try:
+      while True:
+        try:
+          item = self._Get(in_queue)
+        except _Aborted:
+          break
+        if item is _DONE:
+          finished = True
+          break
+        if self.first_output_seconds is None:
+          self.first_output_seconds = self._clock() - start
+        yield item
+    finally:
+      if not finished:
+        # a stage failed or the caller stopped early; release blocked stages
+        self._failed.set()
+      for thread in threads:
+        thread.join()
+    if self._error is not None:
+      raise self._error
+
+  def Report(self):
+    """Returns a listing of per-stage statistics."""
+    if self.first_output_seconds is None:
+      lines = ['No output']
+    else:
+      lines = ['First output after {:.2f}s'.format(self.first_output_seconds)]
+    lines.extend(str(stats) for stats in self.stats)
+    return '\n'.join(lines)
@@ -0,0 +1,119 @@
+"""Tests for pipeline."""
+
+import threading
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import pipeline
+
+
+def Numbers(count):
+  def Read(_):
+    return iter(range(count))
+  return Read
+
+
+def Double(items):
+  for item in items:
+    yield 2 * item
+
+
+class PipelineTests(googletest.TestCase):
+
+  def testSingleWorkersKeepOrder(self):
+    """Test that every item comes out, in order, with one worker a stage."""
+    line = pipeline.Pipeline(queue_size=3)
+    line.AddStage('read', Numbers(50)).AddStage('double', Double)
+
+    self.assertEqual([2 * i for i in range(50)], list(line.Run()))
+    self.assertEqual([(0, 50), (50, 50)],
+                     [(stats.items_in, stats.items_out)
+                      for stats in line.stats])
+    self.assertIsNotNone(line.first_output_seconds)
+
+  def testWorkersShareInput(self):
+    """Test that parallel workers together see each item exactly once."""
+    threads = set()
+    lock = threading.Lock()
+
+    def Record(items):
+      for item in items:
+        with lock:
+          threads.add(threading.current_thread().name)
+        yield item
+
+    line = pipeline.Pipeline(queue_size=2)
+    line.AddStage('read', Numbers(200))
+    line.AddStage('record', Record, workers=4)
+    line.AddStage('double', Double, workers=3)
+
+    self.assertEqual([2 * i for i in range(200)], sorted(line.Run()))
+    self.assertEqual(4, line.stats[1].workers)
+
+  def testStagesMayEmitAtEnd(self):
+    """Test that a stage can hold items back until its input ends."""
+    def Reverse(items):
+      return reversed(list(items))
+
+    line = pipeline.Pipeline()
+    line.AddStage('read', Numbers(5)).AddStage('reverse', Reverse)
+    self.assertEqual([4, 3, 2, 1, 0], list(line.Run()))
+
+  def testSlowStageBlocksUpstream(self):
+    """Test that a stage no one reads from stops at the queue size."""
+    produced = []
+    release = threading.Event()
+
+    def Read(_):
+      for i in range(100):
+        produced.append(i)
+        yield i
+
+    def Stall(items):
+      release.wait()
+      for item in items:
+        yield item
+
+    line = pipeline.Pipeline(queue_size=5)
+    line.AddStage('read', Read).AddStage('stall', Stall)
+    outputs = line.Run()
+    consumer = threading.Thread(target=lambda: outputs.next())
+    consumer.start()
+    while len(produced) < 6:
+      release.wait(0.01)
+    release.wait(0.3)
+    # five items in the queue and one waiting to be put
+    self.assertEqual(6, len(produced))
+    release.set()
+    consumer.join()
+    self.assertEqual(range(1, 100), list(outputs))
+    self.assertGreater(line.stats[0].blocked_seconds, 0.0)
+
+  def testErrorsPropagate(self):
+    """Test that a failing stage stops the others and re-raises."""
+    def Fail(items):
+      for item in items:
+        if item == 10:
+          raise ValueError('bad item')
+        yield item
+
+    line = pipeline.Pipeline(queue_size=2)
+    line.AddStage('read', Numbers(1000)).AddStage('fail', Fail, workers=2)
+    line.AddStage('double', Double)
+
+    self.assertRaises(ValueError, list, line.Run())
+    self.assertLess(line.stats[0].items_out, 1000)
+
+  def testCloseStopsStages(self):
+    """Test that abandoning the output stops the stage threads."""
+    line = pipeline.Pipeline(queue_size=2)
+    line.AddStage('read', Numbers(1000)).AddStage('double', Double)
+    outputs = line.Run()
+    self.assertEqual([0, 2], [outputs.next(), outputs.next()])
+    outputs.close()
+    self.assertLess(line.stats[0].items_out, 1000)
+    self.assertIn('read: 1 workers', line.Report())
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,94 @@
+"""Memory benchmark for compact site records.
+
+Builds the same synthetic legacy sites with the original dict-backed record
+layout and with the slotted LegacyIssue/RunList layout, and reports the
+memory held by each.
+
+usage: records_benchmark.py [num_sites] [runs_per_site]
+"""
+
+import array
+import sys
+
+from google3.cityblock.special.legacy import parse_run_groups_config
+from google3.cityblock.special.legacy import run_table
+
+COUNTRY_CODES = ['AT', 'AU', 'BE', 'CH', 'DE', 'FR', 'GB', 'IT', 'JP', 'US']
+
+
+class DictIssue(object):
+  """Record layout before slots: an instance dict and a list of strings."""
+
+  def __init__(self, issue_name, country_code):
+    self.country_code = country_code
+    self.issue_name = issue_name
+    self.lat = None
+    self.lon = None
+    self.runs = []
+
+
+def DeepSize(root):
+  """Returns the bytes held by root and everything reachable from it."""
+  seen = set()
+  stack = [root]
+  total = 0
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen:
+      continue
+    seen.add(id(obj))
+    total += sys.getsizeof(obj)
+    if isinstance(obj, dict):
+      stack.extend(obj.iterkeys())
+      stack.extend(obj.itervalues())
+    elif isinstance(obj, (list, tuple, set)):
+      stack.extend(obj)
+    elif isinstance(obj, (str, unicode, float, int, long, array.array)):
+      continue
+    else:
+      if hasattr(obj, '__dict__'):
+        stack.append(obj.__dict__)
+      for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+          if hasattr(obj, slot):
+            stack.append(getattr(obj, slot))
+  return total
+
+
+def BuildSites(issue_class, num_sites, runs_per_site):
+  """Returns synthetic sites whose runs overlap with neighbouring sites."""
+  sites = []
+  for i in range(num_sites):
+    # country codes are parsed out of each line, so build distinct strings
+    country_code = ''.join(list(COUNTRY_CODES[i % len(COUNTRY_CODES)]))
+    site = issue_class('Site {}'.format(i), country_code)
+    site.lat = 40.0 + i * 1e-5
+    site.lon = 10.0 - i * 1e-5
+    for j in range(runs_per_site):
+      # half of a site's runs are shared with the previous site
+      site.runs.append('2011{:06d}_{:06d}_L19069'.format(i // 2, j))
+    sites.append(site)
+  return sites
+
+
+def main():
+  num_sites = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  runs_per_site = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+  dict_sites = BuildSites(DictIssue, num_sites, runs_per_site)
+  dict_bytes = DeepSize(dict_sites)
+  del dict_sites
+
+  compact_sites = BuildSites(parse_run_groups_config.LegacyIssue, num_sites,
+                             runs_per_site)
+  compact_bytes = DeepSize(compact_sites) + DeepSize(run_table.RUNS)
+
+  print '{} sites, {} runs per site'.format(num_sites, runs_per_site)
+  print 'dict-backed records: {:8.1f} MiB'.format(dict_bytes / 2.0 ** 20)
+  print 'compact records:     {:8.1f} MiB'.format(compact_bytes / 2.0 ** 20)
+  print 'saving:              {:8.1f}%'.format(
+      100.0 * (dict_bytes - compact_bytes) / dict_bytes)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,199 @@
+"""Deduplicated, size-bounded and batched run-group writes.
+
+WriteRunGroups used to send every run of a site in one RunGroupProto, with
+duplicates, in an RPC of its own.  Legacy sites with thousands of runs made
+for huge requests while sites with a handful of runs each paid a full round
+trip.  RunGroupWriter dedupes run ids, splits groups larger than max_runs and,
+on datastores with a WriteRunGroupsBatch request such as
+bulk_import.WorkflowServiceDatastore, packs the groups of many sites into
+one request, then reports how many bytes were sent and how many RPCs that
+saved.  The Scout client only writes one group per RPC, so the importer
+leaves max_groups at 1.  Requests that fail with transient errors are
+retried like the other import RPCs.
+"""
+
+import random
+import threading
+import time
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.workflow.proto import scout_pb2
+
+DEFAULT_MAX_RUNS = 1000
+DEFAULT_MAX_GROUPS = 1
+
+
+def DedupeRuns(run_ids):
+  """Returns run ids without repeats, in order of first appearance."""
+  seen = set()
+  unique = []
+  for run_id in run_ids:
+    if run_id not in seen:
+      seen.add(run_id)
+      unique.append(run_id)
+  return unique
+
+
+def SplitRuns(run_ids, max_runs):
+  """Returns run ids in consecutive chunks of at most max_runs."""
+  return [run_ids[i:i + max_runs] for i in range(0, len(run_ids), max_runs)]
+
+
+class _Site(object):
+  """Groups of one site still to be written and the callback to run after."""
+
+  def __init__(self, num_groups, callback):
+    self.remaining = num_groups
+    self.callback = callback
+    self.status = None
+    self.error = None
+
+
+class RunGroupWriter(object):
+  """Writes the run groups of many sites in as few RPCs as allowed.
+
+  Groups are held until max_groups of them are pending or another would take
+  the request past max_runs runs, and then sent together.  Flush must be
+  called once every site has been added.  Add and Flush may be called from
+  several threads.
+  """
+
+  def __init__(self, datastore, max_runs=DEFAULT_MAX_RUNS,
+               max_groups=DEFAULT_MAX_GROUPS, max_attempts=3, backoff=0.5,
+               is_transient=bulk_import.IsTransient, sleep=time.sleep):
+    """Constructor.
+
+    Args:
+      datastore: Scout datastore object; needs WriteRunGroupsBatch when
+        max_groups is more than one.
+      max_runs: Maximum number of runs in a group and in a request.
+      max_groups: Maximum number of groups sent in one request; with 1 every
+        group is sent with WriteRunGroups.
+      max_attempts: Maximum number of attempts per request.
+      backoff: Delay in seconds before the first retry of a request.
+      is_transient: Function deciding whether a request error is retried.
+      sleep: Function sleeping for a number of seconds.
+    """
+    if max_runs < 1 or max_groups < 1:
+      raise ValueError('max_runs and max_groups must be positive')
+    self.max_runs = max_runs
+    self.max_groups = max_groups
+    self.sites = 0
+    self.runs = 0
+    self.duplicate_runs = 0
+    self.groups = 0
+    self.rpcs = 0
+    self.failed_rpcs = 0
+    self.retries = 0
+    self.bytes_sent = 0
+    self._datastore = datastore
+    self._max_attempts = max_attempts
+    self._backoff = backoff
+    self._is_transient = is_transient
+    self._sleep = sleep
+    self._pending = []
+    self._pending_runs = 0
+    self._lock = threading.Lock()
+
+  def Add(self, run_ids, callback=None):
+    """Queues the runs of one site.
+
+    Args:
+      run_ids: Run ids of the site, possibly repeated.
+      callback: Function (status, error) called once every group of the site
+        is written, with the response of the last RPC and None, or with None
+        and the exception of a failed RPC.  Sites without runs are done at
+        once.
+    """
+    unique = DedupeRuns(run_ids)
+    chunks = SplitRuns(unique, self.max_runs)
+    site = _Site(len(chunks), callback)
+    batches = []
+    with self._lock:
+      self.sites += 1
+      self.runs += len(unique)
+      self.duplicate_runs += len(run_ids) - len(unique)
+      self.groups += len(chunks)
+      for chunk in chunks:
+        if (len(self._pending) >= self.max_groups or
+            self._pending_runs + len(chunk) > self.max_runs):
+          batches.append(self._TakePending())
+        run_group = scout_pb2.RunGroupProto()
+        run_group.run_id.extend(chunk)
+        self._pending.append((run_group, site))
+        self._pending_runs += len(chunk)
+    if not chunks and callback:
+      callback(None, None)
+    for batch in batches:
+      self._Send(batch)
+
+  def Flush(self):
+    """Sends every pending group."""
+    with self._lock:
+      batch = self._TakePending()
+    if batch:
+      self._Send(batch)
+
+  def _TakePending(self):
+    batch = self._pending
+    self._pending = []
+    self._pending_runs = 0
+    return batch
+
+  def _Write(self, run_groups):
+    if self.max_groups > 1:
+      return self._datastore.WriteRunGroupsBatch(run_groups)
+    return self._datastore.WriteRunGroups(run_groups[0])
+
+  def _Send(self, batch):
+    run_groups = [run_group for run_group, _ in batch]
+    status = error = None
+    delay = self._backoff
+    for attempt in range(1, self._max_attempts + 1):
+      try:
+        status = self._Write(run_groups)
+        error = None
+        break
+      except Exception as e:  # pylint: disable=broad-except
+        error = e
+        if attempt == self._max_attempts or not self._is_transient(e):
+          break
+      with self._lock:
+        self.retries += 1
+      # jitter keeps retrying threads from hitting the backend in lockstep
+      self._sleep(delay * random.uniform(0.5, 1.5))
+      delay *= 2
+    num_bytes = sum(run_group.ByteSize() for run_group in run_groups)
+
+    done = []
+    with self._lock:
+      self.rpcs += 1
+      if error is None:
+        self.bytes_sent += num_bytes
+      else:
+        self.failed_rpcs += 1
+      for _, site in batch:
+        site.remaining -= 1
+        if error is None:
+          site.status = status
+        else:
+          site.error = site.error or error
+        if not site.remaining:
+          done.append(site)
+    for site in done:
+      if site.callback:
+        site.callback(None if site.error else site.status, site.error)
+
+  @property
+  def rpcs_saved(self):
+    """RPCs saved over one unsplit WriteRunGroups per site."""
+    return self.sites - self.rpcs
+
+  def Report(self):
+    """Returns a summary of the runs, groups and RPCs written."""
+    return ('Wrote {} runs of {} sites ({} duplicates dropped) in {} groups '
+            'and {} RPCs ({} failed), {} retries, {} bytes, '
+            '{} RPCs saved'.format(
+                self.runs, self.sites, self.duplicate_runs, self.groups,
+                self.rpcs, self.failed_rpcs, self.retries, self.bytes_sent,
+                self.rpcs_saved))
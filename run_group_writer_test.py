@@ -0,0 +1,136 @@
+"""Tests for run_group_writer."""
+
+import threading
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import run_group_writer
+from google3.cityblock.special.workflow.tools import in_memory_workflow_service
+
+
+class RecordingDatastore(object):
+  """Datastore recording the run ids of every run-group RPC."""
+
+  def __init__(self, failures=0):
+    self.requests = []
+    self.attempts = 0
+    self.failures = failures
+    self._lock = threading.Lock()
+
+  def WriteRunGroups(self, run_group):
+    return self.WriteRunGroupsBatch([run_group])
+
+  def WriteRunGroupsBatch(self, run_groups):
+    with self._lock:
+      self.attempts += 1
+      if self.attempts <= self.failures:
+        raise IOError('deadline exceeded')
+      self.requests.append([list(group.run_id) for group in run_groups])
+    return True
+
+
+class RunGroupWriterTests(googletest.TestCase):
+
+  def testDedupeAndSplit(self):
+    """Test that repeats are dropped in order and chunks are bounded."""
+    self.assertEqual(['b', 'a', 'c'],
+                     run_group_writer.DedupeRuns(['b', 'a', 'b', 'c', 'a']))
+    self.assertEqual([[1, 2], [3, 4], [5]],
+                     run_group_writer.SplitRuns([1, 2, 3, 4, 5], 2))
+    self.assertEqual([], run_group_writer.SplitRuns([], 2))
+
+  def testUnbatchedSplitsLargeGroups(self):
+    """Test one RPC per group, with oversized groups split."""
+    datastore = RecordingDatastore()
+    writer = run_group_writer.RunGroupWriter(datastore, max_runs=2)
+    statuses = []
+    writer.Add(['r1', 'r2', 'r1', 'r3'],
+               lambda status, error: statuses.append((status, error)))
+    self.assertEqual([[['r1', 'r2']]], datastore.requests)
+    self.assertEqual([], statuses)
+    writer.Flush()
+
+    self.assertEqual([[['r1', 'r2']], [['r3']]], datastore.requests)
+    self.assertEqual([(True, None)], statuses)
+    self.assertEqual((1, 2, -1), (writer.duplicate_runs, writer.rpcs,
+                                  writer.rpcs_saved))
+
+  def testBatchesPackSmallGroups(self):
+    """Test that groups of many sites share requests up to the limits."""
+    datastore = RecordingDatastore()
+    writer = run_group_writer.RunGroupWriter(datastore, max_runs=4,
+                                             max_groups=3)
+    done = []
+    for i in range(7):
+      writer.Add(['run{}'.format(i)], lambda status, error, i=i: done.append(i))
+    writer.Add([], lambda status, error: done.append('empty'))
+    writer.Flush()
+
+    self.assertEqual([3, 3, 1],
+                     [len(request) for request in datastore.requests])
+    self.assertEqual([0, 1, 2, 3, 4, 5, 'empty', 6], done)
+    self.assertEqual(8 - 3, writer.rpcs_saved)
+    self.assertGreater(writer.bytes_sent, 0)
+    self.assertIn('3 RPCs (0 failed)', writer.Report())
+
+  def testFailuresReachEverySite(self):
+    """Test that a failed request reports its error to each of its sites."""
+    writer = run_group_writer.RunGroupWriter(
+        RecordingDatastore(failures=3), max_groups=10,
+        sleep=lambda seconds: None)
+    errors = []
+    writer.Add(['a'], lambda status, error: errors.append(error))
+    writer.Add(['b'], lambda status, error: errors.append(error))
+    writer.Flush()
+
+    self.assertEqual(2, len(errors))
+    self.assertTrue(all(isinstance(error, IOError) for error in errors))
+    self.assertEqual((1, 0), (writer.failed_rpcs, writer.bytes_sent))
+    self.assertEqual(2, writer.retries)
+
+  def testTransientFailuresAreRetried(self):
+    """Test that a request failing with a transient error is sent again."""
+    datastore = RecordingDatastore(failures=1)
+    delays = []
+    writer = run_group_writer.RunGroupWriter(datastore, sleep=delays.append)
+    statuses = []
+    writer.Add(['a'], lambda status, error: statuses.append((status, error)))
+    writer.Flush()
+
+    self.assertEqual([(True, None)], statuses)
+    self.assertEqual([[['a']]], datastore.requests)
+    self.assertEqual((1, 0, 1), (writer.rpcs, writer.failed_rpcs,
+                                 writer.retries))
+    self.assertEqual(1, len(delays))
+
+  def testPermanentFailuresAreNotRetried(self):
+    """Test that a request rejected as invalid is not sent again."""
+    datastore = RecordingDatastore()
+    datastore.WriteRunGroups = lambda run_group: {}['missing']
+    writer = run_group_writer.RunGroupWriter(datastore,
+                                             sleep=lambda seconds: None)
+    errors = []
+    writer.Add(['a'], lambda status, error: errors.append(error))
+    writer.Flush()
+
+    self.assertIsInstance(errors[0], KeyError)
+    self.assertEqual(0, writer.retries)
+
+  def testWorkflowServiceBatch(self):
+    """Test batched writes against an InMemoryWorkflowService."""
+    workflow_service = in_memory_workflow_service.InMemoryWorkflowService()
+    writer = run_group_writer.RunGroupWriter(
+        bulk_import.WorkflowServiceDatastore(workflow_service), max_groups=5)
+    for i in range(5):
+      writer.Add(['run{}'.format(i)])
+    writer.Flush()
+
+    self.assertEqual(1, writer.rpcs)
+    self.assertEqual([['run{}'.format(i)] for i in range(5)],
+                     [list(group.run_id)
+                      for group in workflow_service.run_groups])
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,105 @@
+"""Compact storage for run ids.
+
+Legacy sites carry long lists of run-id strings.  Each distinct run id is
+stored once in a process-wide RunTable and sites hold RunList objects, which
+keep 4-byte integer ids in an array instead of a list of string pointers.
+"""
+
+import array
+import threading
+
+
+class RunTable(object):
+  """Deduplicated table of run-id strings addressed by integer ids."""
+
+  __slots__ = ('_ids', '_runs', '_lock')
+
+  def __init__(self):
+    self._ids = {}
+    self._runs = []
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._runs)
+
+  def Id(self, run):
+    """Returns the id of a run, adding it to the table if needed."""
+    run_id = self._ids.get(run)
+    if run_id is None:
+      with self._lock:
+        run_id = self._ids.get(run)
+        if run_id is None:
+          run_id = len(self._runs)
+          self._runs.append(run)
+          self._ids[run] = run_id
+    return run_id
+
+  def Find(self, run):
+    """Returns the id of a run, or None if it is not in the table."""
+    return self._ids.get(run)
+
+  def Run(self, run_id):
+    """Returns the run with the given id."""
+    return self._runs[run_id]
+
+
+RUNS = RunTable()
+
+
+class RunList(object):
+  """List-like sequence of run ids backed by the shared RunTable.
+
+  Supports the list operations the importers use (iteration, indexing,
+  append, extend, membership and comparison with plain lists) and prints like
+  a list so existing output does not change.
+  """
+
+  __slots__ = ('_ids',)
+
+  def __init__(self, runs=()):
+    self._ids = array.array('i')
+    self.extend(runs)
+
+  def append(self, run):
+    self._ids.append(RUNS.Id(run))
+
+  def extend(self, runs):
+    if isinstance(runs, RunList):
+      self._ids.extend(runs._ids)  # pylint: disable=protected-access
+    else:
+      self._ids.extend(RUNS.Id(run) for run in runs)
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __iter__(self):
+    return (RUNS.Run(run_id) for run_id in self._ids)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [RUNS.Run(run_id) for run_id in self._ids[index]]
+    return RUNS.Run(self._ids[index])
+
+  def __contains__(self, run):
+    run_id = RUNS.Find(run)
+    return run_id is not None and run_id in self._ids
+
+  def __eq__(self, other):
+    if isinstance(other, RunList):
+      return self._ids == other._ids  # pylint: disable=protected-access
+    if isinstance(other, (list, tuple)):
+      return list(self) == list(other)
+    return NotImplemented
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  __hash__ = None
+
+  def __repr__(self):
+    return repr(list(self))
+
+  def __reduce__(self):
+    # ids are only meaningful within one process, so pickle the strings
+    return RunList, (list(self),)
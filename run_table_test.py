@@ -0,0 +1,48 @@
+"""Tests for compact run id storage."""
+
+import cPickle
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import parse_run_groups_config
+from google3.cityblock.special.legacy import run_table
+
+
+class RunTableTests(googletest.TestCase):
+
+  def testRunListBehavesLikeList(self):
+    """Test the list operations used on site runs."""
+    runs = run_table.RunList(['run1', 'run2'])
+    runs.append('run3')
+    runs.extend(run_table.RunList(['run4']))
+
+    self.assertEqual(['run1', 'run2', 'run3', 'run4'], runs)
+    self.assertEqual(4, len(runs))
+    self.assertEqual('run2', runs[1])
+    self.assertEqual(['run3', 'run4'], runs[2:])
+    self.assertIn('run3', runs)
+    self.assertNotIn('run5', runs)
+    self.assertEqual("['run1', 'run2', 'run3', 'run4']", repr(runs))
+
+  def testRunIdsAreShared(self):
+    """Test that equal run ids map to one table entry."""
+    size = len(run_table.RUNS)
+    run_table.RunList(['shared_run', 'shared_run'])
+    run_table.RunList(['shared_run'])
+    self.assertEqual(size + 1, len(run_table.RUNS))
+
+  def testLegacyIssueKeepsApi(self):
+    """Test that slotted records keep their attributes, output and pickling."""
+    issue = parse_run_groups_config.LegacyIssue('Ischgi', 'AT')
+    issue.lat, issue.lon = 46.9, 10.3
+    issue.runs.append('20110330_213813_L19069')
+
+    self.assertEqual("AT-Ischgi 46.9,10.3 ['20110330_213813_L19069']",
+                     str(issue))
+    for protocol in (0, 2):
+      copy = cPickle.loads(cPickle.dumps(issue, protocol))
+      self.assertEqual(str(issue), str(copy))
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,185 @@
+"""Pool of Scout datastore stubs shared across RPCs.
+
+Creating a stub sets up a new channel, which a bulk import should not pay for
+every record.  A DatastorePool hands out a bounded number of stubs, reuses
+them between calls and replaces stubs whose RPCs fail with transport errors,
+whose health check does not pass or that have been open too long.
+"""
+
+import socket
+import threading
+import time
+
+from google3.cityblock.special.workflow.client import scout_client
+
+DEFAULT_POOL_SIZE = 8
+# channels are re-established after this long, before load balancers or
+# proxies silently drop them
+DEFAULT_MAX_AGE = 600
+DEFAULT_HEALTH_CHECK_INTERVAL = 60
+
+
+def IsChannelError(error):
+  """Returns whether an RPC error means the stub's connection is broken.
+
+  Errors the server answers with, such as a rejected request, leave the
+  channel usable.
+  """
+  return isinstance(error, (socket.error, EnvironmentError))
+
+
+class DatastorePool(object):
+  """Bounded pool of Scout datastore stubs."""
+
+  def __init__(self, size=DEFAULT_POOL_SIZE,
+               factory=scout_client.NewStubbyScoutDatastore,
+               health_check=None,
+               health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL,
+               max_age=None, is_broken=IsChannelError, clock=time.time):
+    """Constructor.
+
+    Args:
+      size: Maximum number of stubs in use at once.
+      factory: Function creating a new stub.
+      health_check: Function taking a stub and returning False if it should
+        be replaced, or None to only replace stubs whose RPCs fail.
+      health_check_interval: Seconds an idle stub may go unchecked.
+      max_age: Seconds after which an idle stub is replaced, or None to keep
+        stubs as long as they are healthy.
+      is_broken: Function deciding whether an RPC error means the stub's
+        channel is broken; other errors leave the stub in the pool.
+      clock: Function returning the current time in seconds.
+    """
+    self.size = size
+    self.created = 0
+    self.reused = 0
+    self.recreated = 0
+    self._factory = factory
+    self._health_check = health_check
+    self._health_check_interval = health_check_interval
+    self._max_age = max_age
+    self._is_broken = is_broken
+    self._clock = clock
+    self._created_at = {}
+    self._idle = []
+    self._discarded = 0
+    self._lock = threading.Lock()
+    self._available = threading.BoundedSemaphore(size)
+
+  def _Create(self):
+    stub = self._factory()
+    with self._lock:
+      self._created_at[id(stub)] = self._clock()
+      if self._discarded:
+        self._discarded -= 1
+        self.recreated += 1
+      else:
+        self.created += 1
+    return stub
+
+  def _Healthy(self, stub, checked):
+    now = self._clock()
+    if (self._max_age is not None and
+        now - self._created_at.get(id(stub), now) >= self._max_age):
+      return False
+    if (self._health_check is None or
+        now - checked < self._health_check_interval):
+      return True
+    try:
+      return self._health_check(stub)
+    except Exception:  # pylint: disable=broad-except
+      return False
+
+  def _TakeIdle(self):
+    """Returns a healthy idle stub, or None if there is none."""
+    while True:
+      with self._lock:
+        if not self._idle:
+          return None
+        stub, checked = self._idle.pop()
+      if self._Healthy(stub, checked):
+        with self._lock:
+          self.reused += 1
+        return stub
+      with self._lock:
+        self._Discard(stub)
+
+  def _Discard(self, stub):
+    self._discarded += 1
+    self._created_at.pop(id(stub), None)
+
+  def Acquire(self):
+    """Takes a stub out of the pool, blocking while all are in use."""
+    self._available.acquire()
+    try:
+      stub = self._TakeIdle()
+      if stub is None:
+        stub = self._Create()
+    except Exception:
+      self._available.release()
+      raise
+    return stub
+
+  def Release(self, stub, failed=False):
+    """Returns a stub to the pool.
+
+    Args:
+      stub: Stub obtained from Acquire.
+      failed: Whether the stub's channel failed, in which case it is dropped
+        and a new one is created when next needed.
+    """
+    with self._lock:
+      if failed:
+        self._Discard(stub)
+      else:
+        self._idle.append((stub, self._clock()))
+    self._available.release()
+
+  def Call(self, method, *args):
+    """Invokes an RPC method on a pooled stub."""
+    stub = self.Acquire()
+    try:
+      result = getattr(stub, method)(*args)
+    except Exception as e:  # pylint: disable=broad-except
+      # errors in the request itself say nothing about the channel
+      self.Release(stub, failed=self._is_broken(e))
+      raise
+    self.Release(stub)
+    return result
+
+  def Stats(self):
+    """Returns a one-line summary of connection reuse."""
+    return 'Datastore pool: {} created, {} reused, {} recreated'.format(
+        self.created, self.reused, self.recreated)
+
+
+class PooledDatastore(object):
+  """Stands in for a datastore stub, running each RPC on a pooled stub."""
+
+  def __init__(self, pool):
+    self.pool = pool
+
+  def __getattr__(self, method):
+    def PooledCall(*args):
+      return self.pool.Call(method, *args)
+    return PooledCall
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def SharedPool(size=DEFAULT_POOL_SIZE):
+  """Returns the pool shared by the whole process, creating it on first use.
+
+  Args:
+    size: Pool size, only used by the first call.
+
+  Returns:
+    A DatastorePool replacing stubs after DEFAULT_MAX_AGE seconds.
+  """
+  global _shared_pool
+  with _shared_pool_lock:
+    if _shared_pool is None:
+      _shared_pool = DatastorePool(size, max_age=DEFAULT_MAX_AGE)
+    return _shared_pool
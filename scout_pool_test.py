@@ -0,0 +1,107 @@
+"""Tests for the Scout datastore stub pool."""
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import scout_pool
+
+
+class FakeStub(object):
+
+  def __init__(self, fail=False):
+    self.fail = fail
+    self.healthy = True
+
+  def CreateSite(self, site):
+    if self.fail:
+      raise IOError('channel closed')
+    if not site:
+      raise ValueError('empty site')
+    if site == 'taken':
+      raise RuntimeError('site already exists')
+    return 'site-' + site
+
+
+class ScoutPoolTests(googletest.TestCase):
+
+  def setUp(self):
+    self.stubs = []
+
+  def _Factory(self, fail=False):
+    stub = FakeStub(fail)
+    self.stubs.append(stub)
+    return stub
+
+  def testStubsAreReused(self):
+    """Test that sequential calls share one stub."""
+    pool = scout_pool.DatastorePool(2, factory=self._Factory)
+    datastore = scout_pool.PooledDatastore(pool)
+
+    self.assertEqual('site-a', datastore.CreateSite('a'))
+    self.assertEqual('site-b', datastore.CreateSite('b'))
+
+    self.assertEqual(1, len(self.stubs))
+    self.assertEqual(1, pool.created)
+    self.assertEqual(1, pool.reused)
+
+  def testFailedStubIsReplaced(self):
+    """Test that a stub whose RPC fails is not handed out again."""
+    pool = scout_pool.DatastorePool(2, factory=lambda: self._Factory(True))
+    datastore = scout_pool.PooledDatastore(pool)
+
+    self.assertRaises(IOError, datastore.CreateSite, 'a')
+    self.assertRaises(IOError, datastore.CreateSite, 'b')
+
+    self.assertEqual(2, len(self.stubs))
+    self.assertEqual(1, pool.created)
+    self.assertEqual(1, pool.recreated)
+    self.assertEqual(0, pool.reused)
+
+  def testRequestErrorKeepsStub(self):
+    """Test that errors the server answers with do not drop the stub."""
+    pool = scout_pool.DatastorePool(2, factory=self._Factory)
+    datastore = scout_pool.PooledDatastore(pool)
+
+    self.assertRaises(ValueError, datastore.CreateSite, '')
+    self.assertRaises(RuntimeError, datastore.CreateSite, 'taken')
+    self.assertEqual('site-a', datastore.CreateSite('a'))
+
+    self.assertEqual(1, len(self.stubs))
+    self.assertEqual(0, pool.recreated)
+    self.assertEqual(2, pool.reused)
+
+  def testOldStubIsReplaced(self):
+    """Test that idle stubs older than max_age are replaced."""
+    now = [0.0]
+    pool = scout_pool.DatastorePool(
+        1, factory=self._Factory, max_age=100, clock=lambda: now[0])
+
+    stub = pool.Acquire()
+    pool.Release(stub)
+    now[0] = 50.0
+    self.assertIs(stub, pool.Acquire())
+    pool.Release(stub)
+
+    now[0] = 100.0
+    self.assertIsNot(stub, pool.Acquire())
+    self.assertEqual(1, pool.recreated)
+
+  def testUnhealthyStubIsReplaced(self):
+    """Test that idle stubs failing the health check are replaced."""
+    now = [0.0]
+    pool = scout_pool.DatastorePool(
+        1, factory=self._Factory, health_check=lambda stub: stub.healthy,
+        health_check_interval=10, clock=lambda: now[0])
+
+    stub = pool.Acquire()
+    pool.Release(stub)
+    stub.healthy = False
+    self.assertIs(stub, pool.Acquire())
+    pool.Release(stub)
+
+    now[0] = 20.0
+    self.assertIsNot(stub, pool.Acquire())
+    self.assertEqual(1, pool.recreated)
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,205 @@
+"""Bulk prefetch of the sites and collections already in Scout.
+
+Without it the importer calls CreateSite for every parsed site, and asking
+Scout about each site first would double the number of RPCs.  Prefetch lists
+every existing site and collection with a few paged reads at startup and
+indexes them by normalized name and rounded coordinates, so whether a site
+has to be created, updated or skipped is decided locally.  Listings do not
+include run groups, so the runs of an existing site are compared against the
+site_manifest of the previous import instead.
+"""
+
+import collections
+import threading
+
+from google3.cityblock.special.legacy import import_journal
+from google3.cityblock.special.legacy import name_index
+from google3.cityblock.special.legacy import site_manifest
+
+DEFAULT_PAGE_SIZE = 500
+# coordinates are compared in cells of 0.001 degrees, about 110 m
+DEFAULT_PRECISION = 3
+
+CREATE = 'create'
+UPDATE = 'update'
+SKIP = 'skip'
+
+
+class Decision(collections.namedtuple('Decision',
+                                      'action site_id collection_id')):
+  """What to do with a site, and the ids Scout already has for it."""
+
+  def Completed(self):
+    """Returns the import steps already done, like ImportJournal.Completed."""
+    done = {}
+    if self.site_id is not None:
+      done[import_journal.SITE_ID] = self.site_id
+    if self.collection_id is not None:
+      done[import_journal.COLLECTION_ID] = self.collection_id
+    if self.action == SKIP:
+      done[import_journal.RUN_GROUPS] = True
+    return done
+
+
+class ExistingSite(object):
+  """A site already in Scout."""
+
+  def __init__(self, site_id, name, lat, lon):
+    self.site_id = site_id
+    self.name = name
+    self.lat = lat
+    self.lon = lon
+    self.collection_ids = []
+
+
+def ListAll(list_page, page_size=DEFAULT_PAGE_SIZE):
+  """Yields every item of a paged listing.
+
+  Args:
+    list_page: Function (page_token, page_size) returning a list of items and
+      the token of the next page, empty after the last page.
+    page_size: Number of items asked for per page.
+  """
+  page_token = ''
+  while True:
+    items, page_token = list_page(page_token, page_size)
+    for item in items:
+      yield item
+    if not page_token:
+      return
+
+
+def _SiteName(site_proto):
+  names = site_proto.metadata.name.localized_string
+  return names[0].translation if names else ''
+
+
+class ScoutIndex(object):
+  """Existing Scout sites by normalized name and rounded coordinates."""
+
+  def __init__(self, precision=DEFAULT_PRECISION, manifest=None):
+    """Constructor.
+
+    Args:
+      precision: Decimal places coordinates are rounded to when matching.
+      manifest: site_manifest of the previous import, as returned by
+        site_manifest.Load, telling which sites' runs were already written.
+    """
+    self.precision = precision
+    self.manifest = manifest or {}
+    self.rpcs = 0
+    self.decisions = collections.Counter()
+    self._by_name = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return sum(len(sites) for sites in self._by_name.itervalues())
+
+  def _Cell(self, lat, lon):
+    if lat is None or lon is None:
+      return None
+    scale = 10 ** self.precision
+    return int(round(lat * scale)), int(round(lon * scale))
+
+  def AddSite(self, site_proto):
+    """Indexes a scout_pb2.SiteProto; returns its ExistingSite."""
+    metadata = site_proto.metadata
+    lat = metadata.lat if metadata.HasField('lat') else None
+    lon = metadata.lng if metadata.HasField('lng') else None
+    existing = ExistingSite(site_proto.site_id, _SiteName(site_proto), lat,
+                            lon)
+    self._by_name.setdefault(name_index.Normalize(existing.name), []).append(
+        existing)
+    return existing
+
+  def Find(self, name, lat, lon):
+    """Returns the existing site matching a name and coordinates, or None.
+
+    Sites match when their normalized names are equal and their rounded
+    coordinates are no more than one cell apart.  Without coordinates on
+    either side, a name matches only if it is unique.
+    """
+    candidates = self._by_name.get(name_index.Normalize(name), ())
+    cell = self._Cell(lat, lon)
+    unlocated = []
+    for existing in candidates:
+      existing_cell = self._Cell(existing.lat, existing.lon)
+      if cell is None or existing_cell is None:
+        unlocated.append(existing)
+      elif (abs(cell[0] - existing_cell[0]) <= 1 and
+            abs(cell[1] - existing_cell[1]) <= 1):
+        return existing
+    if len(candidates) == 1 and unlocated:
+      return unlocated[0]
+    return None
+
+  def Decide(self, site):
+    """Decides how to import a site object.
+
+    Returns:
+      Decision to CREATE a site not in Scout, UPDATE a site by adding a
+      collection or writing its runs to the existing one, or SKIP a site
+      that has a collection and no new runs to write.  Runs count as written
+      when the manifest holds the site with the same hash and site_id.
+    """
+    existing = self.Find(site.issue_name, site.lat, site.lon)
+    if existing is None:
+      decision = Decision(CREATE, None, None)
+    elif not existing.collection_ids:
+      decision = Decision(UPDATE, existing.site_id, None)
+    elif site.runs and not self._Written(site, existing):
+      decision = Decision(UPDATE, existing.site_id,
+                          existing.collection_ids[0])
+    else:
+      decision = Decision(SKIP, existing.site_id, existing.collection_ids[0])
+    with self._lock:
+      self.decisions[decision.action] += 1
+    return decision
+
+  def _Written(self, site, existing):
+    """Returns whether the manifest shows the site's runs are in Scout."""
+    entry = self.manifest.get(site.issue_name)
+    return (entry is not None and
+            entry.get(import_journal.SITE_ID) == existing.site_id and
+            entry[site_manifest.HASH] == site_manifest.SiteHash(site))
+
+  def Report(self):
+    """Returns a summary of the prefetch and of the decisions made."""
+    return ('Prefetched {} sites in {} RPCs: {} to create, {} to update, '
+            '{} skipped'.format(len(self), self.rpcs,
+                                self.decisions[CREATE],
+                                self.decisions[UPDATE],
+                                self.decisions[SKIP]))
+
+
+def Prefetch(datastore, page_size=DEFAULT_PAGE_SIZE,
+             precision=DEFAULT_PRECISION, manifest=None):
+  """Lists the sites and collections in Scout into a ScoutIndex.
+
+  Args:
+    datastore: Scout datastore object with paged ListSites and
+      ListCollections, such as bulk_import.WorkflowServiceDatastore.
+    page_size: Number of sites or collections read per RPC.
+    precision: Decimal places coordinates are rounded to when matching.
+    manifest: site_manifest of the previous import, or None.
+
+  Returns:
+    A ScoutIndex.
+  """
+  index = ScoutIndex(precision, manifest)
+
+  def Counted(method):
+    def ListPage(page_token, size):
+      index.rpcs += 1
+      return method(page_token, size)
+    return ListPage
+
+  by_id = {}
+  for site_proto in ListAll(Counted(datastore.ListSites), page_size):
+    existing = index.AddSite(site_proto)
+    by_id[existing.site_id] = existing
+  for collection in ListAll(Counted(datastore.ListCollections), page_size):
+    existing = by_id.get(collection.site_id)
+    if existing is not None:
+      existing.collection_ids.append(collection.collection_id)
+  return index
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Tests for scout_prefetch."""
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import import_journal
+from google3.cityblock.special.legacy import scout_prefetch
+from google3.cityblock.special.legacy import site_manifest
+from google3.cityblock.special.workflow.tools import in_memory_workflow_service
+
+
+def _Site(name, lat, lon, runs=None):
+  site = collects_to_scout.CurrentIssue(name, '')
+  site.method = 'Car'
+  site.lat = lat
+  site.lon = lon
+  site.runs = ['run-' + name] if runs is None else runs
+  return site
+
+
+class ScoutPrefetchTests(googletest.TestCase):
+
+  def setUp(self):
+    self.workflow_service = (
+        in_memory_workflow_service.InMemoryWorkflowService())
+    self.datastore = bulk_import.WorkflowServiceDatastore(
+        self.workflow_service)
+    # an imported site, a site without a collection and an unlocated site
+    self.louvre = _Site('Louvre', 48.8606, 2.3376)
+    self.louvre_result = bulk_import.SiteResult('Louvre')
+    collects_to_scout.ImportSite(self.louvre, False, self.datastore,
+                                 self.louvre_result)
+    self.orsay_id, _, _ = collects_to_scout.CreateSite(
+        _Site("Musee d'Orsay", 48.86, 2.3266), False, self.datastore)
+    collects_to_scout.CreateSite(_Site('Pompidou', None, None), False,
+                                 self.datastore)
+
+  def testListAllFollowsPages(self):
+    """Test that every page of a listing is read."""
+    pages = {'': ([1, 2], 'b'), 'b': ([3], 'c'), 'c': ([], '')}
+    calls = []
+
+    def ListPage(page_token, page_size):
+      calls.append((page_token, page_size))
+      return pages[page_token]
+
+    self.assertEqual([1, 2, 3], list(scout_prefetch.ListAll(ListPage, 2)))
+    self.assertEqual([('', 2), ('b', 2), ('c', 2)], calls)
+
+  def testPrefetchPagesThroughService(self):
+    """Test that sites and collections are listed with paged reads."""
+    index = scout_prefetch.Prefetch(self.datastore, page_size=2)
+
+    self.assertEqual(3, len(index))
+    # two pages of sites and one of collections
+    self.assertEqual(3, index.rpcs)
+    self.assertEqual(3, self.workflow_service.get_calls)
+
+  def testDecide(self):
+    """Test create, update and skip decisions by name and coordinates."""
+    index = scout_prefetch.Prefetch(self.datastore)
+
+    self.assertEqual(
+        (scout_prefetch.SKIP, self.louvre_result.site_id,
+         self.louvre_result.collection_id),
+        index.Decide(_Site('LOUVRE', 48.8612, 2.3371, runs=[])))
+    # runs may have been added since the last import
+    decision = index.Decide(_Site('Louvre', 48.8606, 2.3376))
+    self.assertEqual(
+        (scout_prefetch.UPDATE, self.louvre_result.site_id,
+         self.louvre_result.collection_id), decision)
+    self.assertNotIn(import_journal.RUN_GROUPS, decision.Completed())
+    self.assertEqual((scout_prefetch.UPDATE, self.orsay_id, None),
+                     index.Decide(_Site('Musée d\'Orsay', 48.86, 2.3266)))
+    self.assertEqual(scout_prefetch.CREATE,
+                     index.Decide(_Site('Louvre', 43.6, 1.44)).action)
+    self.assertEqual(scout_prefetch.UPDATE,
+                     index.Decide(_Site('Pompidou', 48.86, 2.35)).action)
+    self.assertEqual(scout_prefetch.CREATE,
+                     index.Decide(_Site('Orangerie', 48.86, 2.32)).action)
+    self.assertIn('2 to create, 3 to update, 1 skipped', index.Report())
+
+  def testDecideSkipsRunsInManifest(self):
+    """Test that runs the previous import wrote are not written again."""
+    manifest = site_manifest.Update(
+        {}, site_manifest.Diff([self.louvre], {}), [self.louvre_result])
+    index = scout_prefetch.Prefetch(self.datastore, manifest=manifest)
+
+    decision = index.Decide(_Site('Louvre', 48.8606, 2.3376))
+    self.assertEqual(scout_prefetch.SKIP, decision.action)
+    self.assertTrue(decision.Completed()[import_journal.RUN_GROUPS])
+    # a new run changes the hash, so the runs are written again
+    self.assertEqual(scout_prefetch.UPDATE, index.Decide(
+        _Site('Louvre', 48.8606, 2.3376, ['run-Louvre', 'run-new'])).action)
+    # the manifest entry must belong to the Scout site that was matched
+    manifest['Louvre'][import_journal.SITE_ID] = self.orsay_id
+    index = scout_prefetch.Prefetch(self.datastore, manifest=manifest)
+    self.assertEqual(scout_prefetch.UPDATE, index.Decide(
+        _Site('Louvre', 48.8606, 2.3376)).action)
+
+  def testImportUsesIndex(self):
+    """Test that imports reuse existing ids instead of creating sites."""
+    index = scout_prefetch.Prefetch(self.datastore)
+    sites = [_Site('Louvre', 48.8606, 2.3376, ['run-Louvre', 'run-new']),
+             _Site("Musee d'Orsay", 48.86, 2.3266),
+             _Site('Orangerie', 48.86, 2.32)]
+
+    results = bulk_import.BulkImport(
+        sites,
+        lambda site, datastore, result: collects_to_scout.ImportSite(
+            site, False, datastore, result, scout_index=index),
+        self.datastore)
+
+    self.assertTrue(all(result.ok for result in results))
+    self.assertEqual([self.louvre_result.site_id, self.orsay_id],
+                     [result.site_id for result in results[:2]])
+    self.assertEqual(4, len(self.workflow_service.sites))
+    self.assertEqual(3, len(self.workflow_service.collections))
+    self.assertIn(['run-Louvre', 'run-new'],
+                  [list(group.run_id)
+                   for group in self.workflow_service.run_groups])
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,172 @@
+"""Content-hash manifest of imported sites.
+
+The same country spreadsheets are imported every week.  The manifest keeps a
+stable hash of every site sent to Scout, along with the site_id and
+collection_id it got, so the next run only needs to send the sites that were
+added or changed, can write changed sites to their existing collection and
+can report the ones that disappeared.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from google3.cityblock.special.legacy import import_journal
+
+HASH = 'hash'
+
+
+def SiteHash(site):
+  """Returns a stable hash of the imported fields of a site.
+
+  Args:
+    site: CurrentIssue or LegacyIssue object.
+
+  Returns:
+    Hex digest over name, method, address, coordinates and sorted runs.
+  """
+  fields = [site.issue_name, getattr(site, 'method', None) or None,
+            getattr(site, 'address', None), site.lat, site.lon,
+            sorted(site.runs)]
+  return hashlib.sha1(json.dumps(fields)).hexdigest()
+
+
+class ManifestDiff(object):
+  """Sites that differ between a run and the manifest of the previous one."""
+
+  def __init__(self):
+    self.added = []
+    self.changed = []
+    self.removed = []
+    self.unchanged = []
+    # changed sites whose Scout ids the manifest does not hold
+    self.unlinked = []
+    # site name -> Scout ids of a changed site
+    self.known_ids = {}
+
+  def Pending(self):
+    """Returns the sites that need to be sent to Scout."""
+    return self.added + self.changed
+
+  def Known(self, name):
+    """Returns the import steps already done for a changed site.
+
+    Args:
+      name: Site name.
+
+    Returns:
+      Dictionary of import_journal step -> value holding the site_id and
+      collection_id the site got when it was first imported, empty for
+      added sites.
+    """
+    return dict(self.known_ids.get(name, {}))
+
+  def Report(self):
+    """Returns a listing of added, changed and removed sites."""
+    lines = ['{} added, {} changed, {} removed, {} unchanged'.format(
+        len(self.added), len(self.changed), len(self.removed),
+        len(self.unchanged))]
+    if self.unlinked:
+      lines[0] += ', {} changed without Scout ids'.format(len(self.unlinked))
+    lines.extend('+ {}'.format(site.issue_name) for site in self.added)
+    lines.extend('~ {}'.format(site.issue_name) for site in self.changed)
+    lines.extend('! {}'.format(site.issue_name) for site in self.unlinked)
+    lines.extend('- {}'.format(name) for name in self.removed)
+    return '\n'.join(lines)
+
+
+def Diff(sites, manifest):
+  """Compares sites against a manifest.
+
+  Args:
+    sites: List of site objects from this run.
+    manifest: Manifest of the previous run, as returned by Load.
+
+  Returns:
+    ManifestDiff; removed holds names, the other lists hold site objects.
+    Changed sites go to unlinked rather than changed when the manifest does
+    not know their Scout ids, since creating them again would duplicate them.
+  """
+  diff = ManifestDiff()
+  names = set()
+  for site in sites:
+    names.add(site.issue_name)
+    entry = manifest.get(site.issue_name)
+    if entry is None:
+      diff.added.append(site)
+    elif entry[HASH] == SiteHash(site):
+      diff.unchanged.append(site)
+    elif (entry.get(import_journal.SITE_ID) and
+          entry.get(import_journal.COLLECTION_ID)):
+      diff.changed.append(site)
+      diff.known_ids[site.issue_name] = {
+          import_journal.SITE_ID: entry[import_journal.SITE_ID],
+          import_journal.COLLECTION_ID: entry[import_journal.COLLECTION_ID]}
+    else:
+      diff.unlinked.append(site)
+  diff.removed = sorted(name for name in manifest if name not in names)
+  return diff
+
+
+def Update(manifest, diff, results):
+  """Returns the manifest to save after an import.
+
+  Args:
+    manifest: Manifest of the previous run.
+    diff: ManifestDiff of this run.
+    results: bulk_import.SiteResult objects of the pending sites.
+
+  Returns:
+    New manifest.  Sites that failed to import keep their old entry, so they
+    are retried on the next run.
+  """
+  updated = dict(manifest)
+  for name in diff.removed:
+    del updated[name]
+  imported = dict((result.name, result) for result in results if result.ok)
+  for site in diff.Pending():
+    result = imported.get(site.issue_name)
+    if result is not None:
+      updated[site.issue_name] = {
+          HASH: SiteHash(site),
+          import_journal.SITE_ID: result.site_id,
+          import_journal.COLLECTION_ID: result.collection_id}
+  return updated
+
+
+def _Bytes(value):
+  # json decodes to unicode while site names and ids are byte strings; ids
+  # may also be numbers
+  return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def _Entry(value):
+  # manifests written before ids were kept map names to bare hashes
+  if not isinstance(value, dict):
+    value = {HASH: value}
+  return dict((_Bytes(key), _Bytes(item)) for key, item in value.iteritems())
+
+
+def Load(path):
+  """Returns the manifest saved at path, or an empty one.
+
+  Returns:
+    Dictionary of site name -> dictionary with the site's HASH and, for sites
+    imported since ids were recorded, its import_journal.SITE_ID and
+    import_journal.COLLECTION_ID.
+  """
+  if not os.path.exists(path):
+    return {}
+  with open(path, 'rb') as f:
+    return dict((_Bytes(name), _Entry(value))
+                for name, value in json.load(f).iteritems())
+
+
+def Save(path, manifest):
+  """Atomically writes a manifest."""
+  directory = os.path.dirname(os.path.abspath(path))
+  fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.manifest')
+  with os.fdopen(fd, 'wb') as f:
+    json.dump(manifest, f, sort_keys=True, indent=0)
+  os.rename(tmp_path, path)
@@ -0,0 +1,151 @@
+"""Tests for the site manifest."""
+
+import json
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import bulk_import
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import site_manifest
+from google3.cityblock.special.workflow.tools import in_memory_workflow_service
+
+
+class SiteManifestTests(googletest.TestCase):
+
+  def _Site(self, name, runs):
+    site = collects_to_scout.CurrentIssue(name, '1 Main St')
+    site.method = 'Car'
+    site.lat, site.lon = 1.5, 2.5
+    site.runs = runs
+    return site
+
+  def _Result(self, name, ok=True):
+    result = bulk_import.SiteResult(name)
+    result.site_id = 'site-' + name
+    result.collection_id = 'collection-' + name
+    if not ok:
+      result.error = 'IOError: deadline exceeded'
+    return result
+
+  def testSiteHashIgnoresRunOrder(self):
+    """Test that the hash only depends on the set of runs."""
+    self.assertEqual(
+        site_manifest.SiteHash(self._Site('Zoo', ['run1', 'run2'])),
+        site_manifest.SiteHash(self._Site('Zoo', ['run2', 'run1'])))
+    self.assertNotEqual(
+        site_manifest.SiteHash(self._Site('Zoo', ['run1'])),
+        site_manifest.SiteHash(self._Site('Zoo', ['run1', 'run2'])))
+
+  def testDiffAndUpdate(self):
+    """Test that only added and changed sites are pending."""
+    path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+    first_run = [self._Site('Zoo', ['run1']), self._Site('Park', []),
+                 self._Site('Beach', [])]
+    diff = site_manifest.Diff(first_run, site_manifest.Load(path))
+    self.assertEqual(3, len(diff.added))
+    site_manifest.Save(path, site_manifest.Update(
+        {}, diff, [self._Result(name) for name in ('Zoo', 'Park', 'Beach')]))
+
+    second_run = [self._Site('Zoo', ['run1', 'run2']), self._Site('Park', []),
+                  self._Site('Museum', [])]
+    manifest = site_manifest.Load(path)
+    diff = site_manifest.Diff(second_run, manifest)
+
+    self.assertEqual(['Museum'], [site.issue_name for site in diff.added])
+    self.assertEqual(['Zoo'], [site.issue_name for site in diff.changed])
+    self.assertEqual(['Beach'], diff.removed)
+    self.assertEqual(['Park'], [site.issue_name for site in diff.unchanged])
+    self.assertEqual({'site_id': 'site-Zoo', 'collection_id': 'collection-Zoo'},
+                     diff.Known('Zoo'))
+    self.assertEqual({}, diff.Known('Museum'))
+
+    # Zoo failed to import, so it stays pending for the next run
+    updated = site_manifest.Update(
+        manifest, diff, [self._Result('Museum'), self._Result('Zoo', False)])
+    self.assertEqual(sorted(['Zoo', 'Park', 'Museum']), sorted(updated))
+    self.assertEqual(manifest['Zoo'], updated['Zoo'])
+    self.assertEqual('site-Museum', updated['Museum']['site_id'])
+
+  def testChangedSiteWithoutIdsIsNotPending(self):
+    """Test that a manifest of bare hashes does not recreate changed sites."""
+    path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+    with open(path, 'wb') as f:
+      json.dump({'Zoo': site_manifest.SiteHash(self._Site('Zoo', ['run1']))},
+                f)
+
+    diff = site_manifest.Diff([self._Site('Zoo', ['run1', 'run2'])],
+                              site_manifest.Load(path))
+
+    self.assertEqual([], diff.Pending())
+    self.assertEqual(['Zoo'], [site.issue_name for site in diff.unlinked])
+    self.assertIn('! Zoo', diff.Report())
+
+  def testNumericIdsLoad(self):
+    """Test that ids Scout returns as numbers survive a save and load."""
+    path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+    site_manifest.Save(path, {'Zoo': {'hash': 'abc', 'site_id': 12,
+                                      'collection_id': 34}})
+
+    self.assertEqual({'hash': 'abc', 'site_id': 12, 'collection_id': 34},
+                     site_manifest.Load(path)['Zoo'])
+
+  def testSeveralSpreadsheets(self):
+    """Test that sites of earlier spreadsheets are not reported removed."""
+    directory = tempfile.mkdtemp()
+    arg_files = []
+    for i in range(2):
+      arg_file = os.path.join(directory, 'country{}.csv'.format(i))
+      with open(arg_file, 'wb') as f:
+        f.write('Location Name,Equipment,Address\n'
+                'Site {0},Car,{0} Main St\n'.format(i))
+      arg_files.append(arg_file)
+    datastore = bulk_import.WorkflowServiceDatastore(
+        in_memory_workflow_service.InMemoryWorkflowService())
+
+    def Run(manifest):
+      current_sites = []
+      for arg_file in arg_files:
+        file_sites, _, _ = collects_to_scout.ProcessFile(
+            arg_file, lambda address: (1.5, 2.5))
+        current_sites.extend(file_sites)
+      diff = site_manifest.Diff(collects_to_scout.MergeFiles(current_sites),
+                                manifest)
+      results = bulk_import.BulkImport(
+          diff.Pending(), collects_to_scout.SiteImporter(False, diff=diff),
+          datastore)
+      return diff, site_manifest.Update(manifest, diff, results)
+
+    diff, manifest = Run({})
+    self.assertEqual(2, len(diff.added))
+    diff, manifest = Run(manifest)
+
+    self.assertEqual([], diff.removed)
+    self.assertEqual(['Site 0', 'Site 1'],
+                     [site.issue_name for site in diff.unchanged])
+    self.assertEqual(['Site 0', 'Site 1'], sorted(manifest))
+
+  def testChangedSiteReusesIds(self):
+    """Test that importing a changed site does not create it again."""
+    workflow_service = in_memory_workflow_service.InMemoryWorkflowService()
+    datastore = bulk_import.WorkflowServiceDatastore(workflow_service)
+    site = self._Site('Zoo', ['run1'])
+    result = bulk_import.SiteResult('Zoo')
+    collects_to_scout.ImportSite(site, False, datastore, result)
+    diff = site_manifest.Diff([site], {})
+    manifest = site_manifest.Update({}, diff, [result])
+
+    site = self._Site('Zoo', ['run1', 'run2'])
+    diff = site_manifest.Diff([site], manifest)
+    result = bulk_import.SiteResult('Zoo')
+    collects_to_scout.ImportSite(site, False, datastore, result,
+                                 known=diff.Known('Zoo'))
+
+    self.assertEqual(manifest['Zoo']['site_id'], result.site_id)
+    self.assertEqual(manifest['Zoo']['collection_id'], result.collection_id)
+    self.assertEqual(1, len(datastore.ListSites('', 100)[0]))
+
+
+if __name__ == '__main__':
+  googletest.main()
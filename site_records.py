@@ -0,0 +1,97 @@
+"""Length-delimited binary files of serialized Scout site records.
+
+Each record is a serialized scout_pb2.SiteProto, a serialized
+scout_pb2.RunGroupProto holding the site's runs and a JSON object of the site
+fields the protos do not carry, such as its address and method, each
+prefixed with its length as a base-128 varint.  The import step can load
+these directly instead of parsing CSV text again.
+"""
+
+import json
+
+from google3.cityblock.special.workflow.proto import scout_pb2
+
+BUFFER_SIZE = 1 << 16
+
+
+def _EncodeVarint(value):
+  """Returns value encoded as a base-128 varint."""
+  out = []
+  while True:
+    bits = value & 0x7f
+    value >>= 7
+    if value:
+      out.append(chr(bits | 0x80))
+    else:
+      out.append(chr(bits))
+      return ''.join(out)
+
+
+def _ReadVarint(f):
+  """Reads a varint from f, returning None at end of file."""
+  result = 0
+  shift = 0
+  while True:
+    byte = f.read(1)
+    if not byte:
+      if shift:
+        raise EOFError('truncated record length')
+      return None
+    result |= (ord(byte) & 0x7f) << shift
+    if not ord(byte) & 0x80:
+      return result
+    shift += 7
+
+
+def _ReadData(f):
+  size = _ReadVarint(f)
+  if size is None:
+    return None
+  data = f.read(size)
+  if len(data) != size:
+    raise EOFError('truncated record')
+  return data
+
+
+def _ReadMessage(f, message):
+  data = _ReadData(f)
+  if data is None:
+    return None
+  message.ParseFromString(data)
+  return message
+
+
+def WriteRecords(path, records):
+  """Writes site records to a record file.
+
+  Args:
+    path: Output file.
+    records: Iterable of (SiteProto, RunGroupProto, fields) tuples where
+      fields is a JSON-serializable dictionary.
+
+  Returns:
+    Number of records written.
+  """
+  count = 0
+  with open(path, 'wb', BUFFER_SIZE) as f:
+    for site_proto, run_group, fields in records:
+      for data in (site_proto.SerializeToString(),
+                   run_group.SerializeToString(), json.dumps(fields)):
+        f.write(_EncodeVarint(len(data)))
+        f.write(data)
+      count += 1
+  return count
+
+
+def ReadRecords(path):
+  """Yields the (SiteProto, RunGroupProto, fields) tuples of a record file."""
+  with open(path, 'rb', BUFFER_SIZE) as f:
+    while True:
+      site_proto = _ReadMessage(f, scout_pb2.SiteProto())
+      if site_proto is None:
+        return
+      run_group = _ReadMessage(f, scout_pb2.RunGroupProto())
+      fields = _ReadData(f)
+      if run_group is None or fields is None:
+        raise EOFError('incomplete record')
+      yield site_proto, run_group, json.loads(fields)
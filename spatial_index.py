@@ -0,0 +1,155 @@
+"""Uniform grid index over site coordinates.
+
+Merger only joins sites with identical names, but legacy names are derived
+from CamelCase config entries and often differ slightly from the spreadsheet
+name of the same place.  Sites are bucketed into grid cells about as wide as
+the search radius, so finding every site near another only looks at the
+neighbouring cells instead of comparing all pairs.
+"""
+
+import collections
+import math
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+DEFAULT_MAX_DISTANCE_M = 100.0
+
+
+def Distance(lat1, lon1, lat2, lon2):
+  """Returns the great-circle distance in meters between two points."""
+  phi1 = math.radians(lat1)
+  phi2 = math.radians(lat2)
+  sin_dphi = math.sin((phi2 - phi1) / 2)
+  sin_dlambda = math.sin(math.radians(lon2 - lon1) / 2)
+  a = sin_dphi ** 2 + math.cos(phi1) * math.cos(phi2) * sin_dlambda ** 2
+  return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex(object):
+  """Items bucketed by latitude/longitude cell for radius queries."""
+
+  def __init__(self, cell_size_m=DEFAULT_MAX_DISTANCE_M):
+    """Constructor.
+
+    Args:
+      cell_size_m: Height of a cell in meters; queries are cheapest for radii
+        up to this size.
+    """
+    self.cell_degrees = cell_size_m / METERS_PER_DEGREE
+    self._lon_cells = int(math.ceil(360.0 / self.cell_degrees))
+    self._cells = collections.defaultdict(list)
+
+  def __len__(self):
+    return sum(len(cell) for cell in self._cells.itervalues())
+
+  def _Cell(self, lat, lon):
+    return (int(math.floor((lat + 90.0) / self.cell_degrees)),
+            int(math.floor((lon + 180.0) / self.cell_degrees))
+            % self._lon_cells)
+
+  def Add(self, item, lat, lon):
+    """Indexes an item at a location."""
+    self._cells[self._Cell(lat, lon)].append((lat, lon, item))
+
+  def Near(self, lat, lon, radius_m):
+    """Returns the items within radius_m of a location.
+
+    Args:
+      lat: Latitude in degrees.
+      lon: Longitude in degrees.
+      radius_m: Search radius in meters.
+
+    Returns:
+      List of (distance in meters, item) tuples, nearest first.
+    """
+    radius_degrees = radius_m / METERS_PER_DEGREE
+    row, column = self._Cell(lat, lon)
+    lat_span = int(math.ceil(radius_degrees / self.cell_degrees))
+    rows = range(row - lat_span, row + lat_span + 1)
+    # cells get narrower towards the poles, so more of them are in range
+    max_lat = min(90.0, abs(lat) + radius_degrees)
+    cos_lat = math.cos(math.radians(max_lat))
+    lon_span = (int(math.ceil(radius_degrees / cos_lat / self.cell_degrees))
+                if cos_lat > 0 else self._lon_cells)
+    if lon_span * 2 + 1 >= self._lon_cells:
+      # the whole band of rows is in range, so only visit occupied cells
+      cells = [cell for (cell_row, _), cell in self._cells.iteritems()
+               if rows[0] <= cell_row <= rows[-1]]
+    else:
+      cells = [self._cells.get((cell_row, (column + offset) % self._lon_cells),
+                               ())
+               for cell_row in rows
+               for offset in range(-lon_span, lon_span + 1)]
+
+    found = []
+    for cell in cells:
+      for item_lat, item_lon, item in cell:
+        distance = Distance(lat, lon, item_lat, item_lon)
+        if distance <= radius_m:
+          found.append((distance, item))
+    found.sort(key=lambda distance_item: distance_item[0])
+    return found
+
+
+class ColocatedPair(object):
+  """A spreadsheet site and a legacy site that are likely the same place."""
+
+  def __init__(self, current, legacy, distance):
+    self.current = current
+    self.legacy = legacy
+    self.distance = distance
+
+  def __str__(self):
+    return '{} <- {} ({:.0f} m)'.format(self.current.issue_name,
+                                        self.legacy.issue_name, self.distance)
+
+
+def FindColocated(current_sites, legacy_sites,
+                  max_distance_m=DEFAULT_MAX_DISTANCE_M):
+  """Pairs spreadsheet sites with legacy sites at the same location.
+
+  Each site is paired at most once, closest pairs first.  Sites without
+  coordinates are never paired.
+
+  Args:
+    current_sites: List of site objects from spreadsheets.
+    legacy_sites: List of legacy site objects.
+    max_distance_m: Largest distance in meters between paired sites.
+
+  Returns:
+    List of ColocatedPair objects sorted by spreadsheet site name.
+  """
+  index = GridIndex(max_distance_m)
+  for position, site in enumerate(legacy_sites):
+    if site.lat is not None:
+      index.Add(position, site.lat, site.lon)
+
+  candidates = []
+  for position, site in enumerate(current_sites):
+    if site.lat is None:
+      continue
+    for distance, legacy_position in index.Near(site.lat, site.lon,
+                                                max_distance_m):
+      candidates.append((distance, position, legacy_position))
+  candidates.sort()
+
+  pairs = []
+  paired_current = set()
+  paired_legacy = set()
+  for distance, position, legacy_position in candidates:
+    if position in paired_current or legacy_position in paired_legacy:
+      continue
+    paired_current.add(position)
+    paired_legacy.add(legacy_position)
+    pairs.append(ColocatedPair(current_sites[position],
+                               legacy_sites[legacy_position], distance))
+  pairs.sort(key=lambda pair: pair.current.issue_name)
+  return pairs
+
+
+def Report(pairs, applied):
+  """Returns a listing of co-located pairs and whether they were merged."""
+  lines = ['{} co-located legacy sites {}'.format(
+      len(pairs), 'merged' if applied else 'proposed for merging')]
+  lines.extend(str(pair) for pair in pairs)
+  return '\n'.join(lines)
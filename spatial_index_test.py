@@ -0,0 +1,75 @@
+"""Tests for spatial_index."""
+
+import random
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import spatial_index
+
+
+class Site(object):
+
+  def __init__(self, issue_name, lat, lon):
+    self.issue_name = issue_name
+    self.lat = lat
+    self.lon = lon
+
+
+class SpatialIndexTests(googletest.TestCase):
+
+  def testDistance(self):
+    """Test the distance of one degree of latitude and of a short hop."""
+    self.assertAlmostEqual(111195, spatial_index.Distance(0, 0, 1, 0), -1)
+    self.assertAlmostEqual(
+        0, spatial_index.Distance(48.8606, 2.3376, 48.8606, 2.3376))
+    self.assertLess(spatial_index.Distance(0, 179.9995, 0, -179.9995), 120)
+
+  def testNearMatchesBruteForce(self):
+    """Test that grid queries return exactly the points a full scan does."""
+    rng = random.Random(3)
+    points = [(rng.uniform(40, 40.01), rng.uniform(-0.005, 0.005))
+              for _ in range(500)]
+    index = spatial_index.GridIndex(50)
+    for position, (lat, lon) in enumerate(points):
+      index.Add(position, lat, lon)
+
+    for lat, lon in points[:50]:
+      expected = sorted(
+          position for position, (other_lat, other_lon) in enumerate(points)
+          if spatial_index.Distance(lat, lon, other_lat, other_lon) <= 120)
+      found = index.Near(lat, lon, 120)
+      self.assertEqual(expected, sorted(item for _, item in found))
+      distances = [distance for distance, _ in found]
+      self.assertEqual(sorted(distances), distances)
+
+  def testNearAcrossAntimeridianAndPole(self):
+    """Test neighbour lookup where cells wrap around or become narrow."""
+    index = spatial_index.GridIndex(100)
+    index.Add('east', 10.0, 179.9999)
+    index.Add('pole', 89.9999, 0.0)
+
+    self.assertEqual(['east'],
+                     [item for _, item in index.Near(10.0, -179.9999, 100)])
+    self.assertEqual(['pole'],
+                     [item for _, item in index.Near(89.9999, 180.0, 100)])
+
+  def testFindColocatedPairsClosestFirst(self):
+    """Test that each site is paired at most once, nearest first."""
+    louvre = Site('Louvre', 48.86080, 2.33760)
+    museum = Site('Musee Du Louvre', 48.86085, 2.33770)
+    annex = Site('Louvre Annex', 48.86100, 2.33800)
+    far = Site('Eiffel Tower', 48.85840, 2.29450)
+    unknown = Site('Nowhere', None, None)
+
+    pairs = spatial_index.FindColocated([louvre, far, unknown],
+                                        [annex, museum], 100)
+
+    self.assertEqual([(louvre, museum)],
+                     [(pair.current, pair.legacy) for pair in pairs])
+    self.assertLess(pairs[0].distance, 10)
+    self.assertIn('Louvre <- Musee Du Louvre',
+                  spatial_index.Report(pairs, False))
+
+
+if __name__ == '__main__':
+  googletest.main()
@@ -0,0 +1,254 @@
+"""Per-stage timing, counters and latency histograms for the importers.
+
+A Metrics object collects the wall time of each stage of a run, counters
+such as record counts and cache hits, and latency histograms of geocoding
+requests and Scout RPCs.  Report returns all of it as a JSON-serializable
+dictionary, so slow runs can be compared without reading the logs.
+"""
+
+import contextlib
+import cProfile
+import json
+import pstats
+import threading
+import time
+
+# upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000)
+
+
+class Histogram(object):
+  """Latency histogram with fixed buckets."""
+
+  def __init__(self):
+    self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    self.total_ms = 0.0
+    self.max_ms = 0.0
+
+  def Add(self, ms):
+    index = 0
+    while index < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[index]:
+      index += 1
+    self.counts[index] += 1
+    self.total_ms += ms
+    self.max_ms = max(self.max_ms, ms)
+
+  def Merge(self, other):
+    self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+    self.total_ms += other.total_ms
+    self.max_ms = max(self.max_ms, other.max_ms)
+
+  def Percentile(self, fraction):
+    """Returns the upper bound of the bucket holding a percentile."""
+    rank = fraction * sum(self.counts)
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if count and seen >= rank:
+        if index < len(LATENCY_BUCKETS_MS):
+          return LATENCY_BUCKETS_MS[index]
+        return round(self.max_ms, 3)
+    return None
+
+  def Report(self):
+    count = sum(self.counts)
+    buckets = {}
+    for index, bucket_count in enumerate(self.counts):
+      if index < len(LATENCY_BUCKETS_MS):
+        buckets['<={}'.format(LATENCY_BUCKETS_MS[index])] = bucket_count
+      else:
+        buckets['>{}'.format(LATENCY_BUCKETS_MS[-1])] = bucket_count
+    return {
+        'count': count,
+        'mean_ms': round(self.total_ms / count, 3) if count else None,
+        'max_ms': round(self.max_ms, 3),
+        'p50_ms': self.Percentile(0.5),
+        'p90_ms': self.Percentile(0.9),
+        'p99_ms': self.Percentile(0.99),
+        'buckets_ms': buckets,
+    }
+
+
+class Metrics(object):
+  """Thread-safe collection of stage timings, counters and histograms."""
+
+  def __init__(self, clock=time.time):
+    self._clock = clock
+    self._start = clock()
+    self._stages = []
+    self._stage_times = {}
+    self._counters = {}
+    self._histograms = {}
+    self._lock = threading.Lock()
+
+  def __getstate__(self):
+    # sent back from worker processes, which have their own clock and lock
+    return (self._stages, self._stage_times, self._counters,
+            self._histograms)
+
+  def __setstate__(self, state):
+    self.__init__()
+    (self._stages, self._stage_times, self._counters,
+     self._histograms) = state
+
+  def AddStage(self, name, seconds, calls=1):
+    """Adds wall time spent in a stage."""
+    with self._lock:
+      if name not in self._stage_times:
+        self._stages.append(name)
+        self._stage_times[name] = [0.0, 0]
+      self._stage_times[name][0] += seconds
+      self._stage_times[name][1] += calls
+
+  @contextlib.contextmanager
+  def Stage(self, name):
+    """Context manager timing one pass through a stage."""
+    start = self._clock()
+    try:
+      yield
+    finally:
+      self.AddStage(name, self._clock() - start)
+
+  def Count(self, name, amount=1):
+    """Adds to a counter."""
+    with self._lock:
+      self._counters[name] = self._counters.get(name, 0) + amount
+
+  def Set(self, name, value):
+    """Sets a counter to a value, such as a ratio that does not add up."""
+    with self._lock:
+      self._counters[name] = value
+
+  def Observe(self, name, seconds):
+    """Adds one latency to a histogram."""
+    with self._lock:
+      histogram = self._histograms.get(name)
+      if histogram is None:
+        histogram = self._histograms[name] = Histogram()
+      histogram.Add(seconds * 1000.0)
+
+  def Timed(self, name, function):
+    """Returns function wrapped to record its latency in a histogram."""
+    def TimedCall(*args):
+      start = self._clock()
+      try:
+        return function(*args)
+      finally:
+        self.Observe(name, self._clock() - start)
+    return TimedCall
+
+  def Take(self):
+    """Returns a copy of the collected metrics and clears them."""
+    with self._lock:
+      taken = Metrics(self._clock)
+      taken.__setstate__(self.__getstate__())
+      self._stages = []
+      self._stage_times = {}
+      self._counters = {}
+      self._histograms = {}
+    return taken
+
+  def Merge(self, other):
+    """Adds the metrics collected by another Metrics object."""
+    # pylint: disable=protected-access
+    for name in other._stages:
+      seconds, calls = other._stage_times[name]
+      self.AddStage(name, seconds, calls)
+    for name, amount in other._counters.iteritems():
+      self.Count(name, amount)
+    with self._lock:
+      for name, histogram in other._histograms.iteritems():
+        self._histograms.setdefault(name, Histogram()).Merge(histogram)
+    # pylint: enable=protected-access
+
+  def Report(self):
+    """Returns all metrics as a JSON-serializable dictionary."""
+    with self._lock:
+      return {
+          'total_seconds': round(self._clock() - self._start, 4),
+          'stages': [{'name': name,
+                      'seconds': round(self._stage_times[name][0], 4),
+                      'calls': self._stage_times[name][1]}
+                     for name in self._stages],
+          'counters': dict(self._counters),
+          'histograms': dict((name, histogram.Report()) for name, histogram
+                             in self._histograms.iteritems()),
+      }
+
+  def Save(self, path):
+    """Writes the report as JSON to path, or to stdout if path is '-'."""
+    output = json.dumps(self.Report(), indent=2, sort_keys=True)
+    if path == '-':
+      print output
+    else:
+      with open(path, 'w') as f:
+        f.write(output + '\n')
+
+
+class TimedDatastore(object):
+  """Stands in for a datastore, recording the latency of every RPC."""
+
+  def __init__(self, datastore, metrics):
+    self._datastore = datastore
+    self._metrics = metrics
+
+  def __getattr__(self, method):
+    return self._metrics.Timed('rpc.' + method,
+                               getattr(self._datastore, method))
+
+
+def CacheCounters(metrics, cache, prefix='geocode_cache'):
+  """Records the hits, misses and hit rate of a GeocodeCache."""
+  metrics.Count(prefix + '.hits', cache.hits)
+  metrics.Count(prefix + '.misses', cache.misses)
+  total = cache.hits + cache.misses
+  metrics.Set(prefix + '.hit_rate',
+              round(float(cache.hits) / total, 4) if total else None)
+
+
+class _WorkerStats(object):
+  """Stats dictionary of a worker in the form pstats.Stats.add accepts."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+def ProfileCall(function, *args):
+  """Runs function(*args) under cProfile, e.g. in a worker process.
+
+  Returns:
+    A tuple (result, stats) of the function's result and its profile, which
+    can be pickled back to the parent and added to the list Profile yields.
+  """
+  profiler = cProfile.Profile()
+  result = profiler.runcall(function, *args)
+  profiler.create_stats()
+  return result, profiler.stats
+
+
+@contextlib.contextmanager
+def Profile(path):
+  """Context manager writing a cProfile dump of its body to path.
+
+  Does nothing and yields None when path is None.  Otherwise it yields a
+  list: worker processes profile their work with ProfileCall, and the stats
+  appended to the list are merged into the dump, so it covers the whole run.
+  """
+  if path is None:
+    yield None
+    return
+  worker_stats = []
+  profiler = cProfile.Profile()
+  profiler.enable()
+  try:
+    yield worker_stats
+  finally:
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+    for stats_dict in worker_stats:
+      stats.add(_WorkerStats(stats_dict))
+    stats.dump_stats(path)
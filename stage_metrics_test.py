@@ -0,0 +1,145 @@
+"""Tests for stage_metrics."""
+
+import json
+import multiprocessing
+import os
+import pickle
+import pstats
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import stage_metrics
+
+
+class FakeClock(object):
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+class FakeDatastore(object):
+
+  def __init__(self, clock):
+    self.clock = clock
+
+  def CreateSite(self, new_site):
+    self.clock.now += 0.015
+    return 'site1'
+
+
+class StageMetricsTests(googletest.TestCase):
+
+  def testStagesAndCounters(self):
+    """Test that stage times add up per stage in first-seen order."""
+    clock = FakeClock()
+    metrics = stage_metrics.Metrics(clock)
+    for seconds in (2.0, 3.0):
+      with metrics.Stage('parse'):
+        clock.now += seconds
+    with metrics.Stage('merge'):
+      clock.now += 1.0
+    metrics.Count('sites', 10)
+    metrics.Count('sites', 5)
+
+    report = metrics.Report()
+    self.assertEqual([{'name': 'parse', 'seconds': 5.0, 'calls': 2},
+                      {'name': 'merge', 'seconds': 1.0, 'calls': 1}],
+                     report['stages'])
+    self.assertEqual({'sites': 15}, report['counters'])
+    self.assertEqual(6.0, report['total_seconds'])
+
+  def testHistogram(self):
+    """Test bucketing and percentiles of latencies."""
+    metrics = stage_metrics.Metrics()
+    for ms in [0.5] * 50 + [15] * 45 + [20000] * 5:
+      metrics.Observe('rpc', ms / 1000.0)
+
+    histogram = metrics.Report()['histograms']['rpc']
+    self.assertEqual(100, histogram['count'])
+    self.assertEqual(50, histogram['buckets_ms']['<=1'])
+    self.assertEqual(45, histogram['buckets_ms']['<=20'])
+    self.assertEqual(5, histogram['buckets_ms']['>10000'])
+    self.assertEqual(1, histogram['p50_ms'])
+    self.assertEqual(20, histogram['p90_ms'])
+    self.assertEqual(20000, histogram['p99_ms'])
+
+  def testTimedDatastore(self):
+    """Test that RPCs are forwarded and their latency recorded."""
+    clock = FakeClock()
+    metrics = stage_metrics.Metrics(clock)
+    datastore = stage_metrics.TimedDatastore(FakeDatastore(clock), metrics)
+
+    self.assertEqual('site1', datastore.CreateSite(None))
+    histogram = metrics.Report()['histograms']['rpc.CreateSite']
+    self.assertEqual(1, histogram['buckets_ms']['<=20'])
+
+  def testTakeAndMerge(self):
+    """Test that metrics from worker processes add to the parent's."""
+    parent = stage_metrics.Metrics()
+    parent.Count('sites', 1)
+    worker = stage_metrics.Metrics()
+    worker.AddStage('parse', 2.0)
+    worker.Count('sites', 3)
+    worker.Observe('geocode', 0.1)
+
+    taken = pickle.loads(pickle.dumps(worker.Take()))
+    parent.Merge(taken)
+    parent.Merge(taken)
+
+    report = parent.Report()
+    self.assertEqual({'sites': 7}, report['counters'])
+    self.assertEqual([{'name': 'parse', 'seconds': 4.0, 'calls': 2}],
+                     report['stages'])
+    self.assertEqual(2, report['histograms']['geocode']['count'])
+    self.assertEqual({}, worker.Report()['counters'])
+
+  def testSaveAndProfile(self):
+    """Test that the report is valid JSON and the profile is written."""
+    directory = tempfile.mkdtemp()
+    metrics = stage_metrics.Metrics()
+    with stage_metrics.Profile(os.path.join(directory, 'run.prof')):
+      metrics.Count('sites')
+    metrics.Save(os.path.join(directory, 'metrics.json'))
+
+    with open(os.path.join(directory, 'metrics.json')) as f:
+      self.assertEqual({'sites': 1}, json.load(f)['counters'])
+    self.assertTrue(os.path.getsize(os.path.join(directory, 'run.prof')))
+
+  def testProfileMergesWorkers(self):
+    """Test that stats from ProfileCall in a worker end up in the dump."""
+    path = os.path.join(tempfile.mkdtemp(), 'run.prof')
+
+    def WorkerOnly():
+      return 7
+
+    with stage_metrics.Profile(path) as worker_stats:
+      pool = multiprocessing.Pool(1)
+      try:
+        result, stats = pool.apply(stage_metrics.ProfileCall, (_Square, 3))
+      finally:
+        pool.close()
+        pool.join()
+      worker_stats.append(stats)
+      WorkerOnly()
+
+    self.assertEqual(9, result)
+    functions = [name for _, _, name in pstats.Stats(path).stats]
+    self.assertIn('_Square', functions)
+    self.assertIn('WorkerOnly', functions)
+
+  def testProfileDisabled(self):
+    """Test that no profile is collected without a path."""
+    with stage_metrics.Profile(None) as worker_stats:
+      self.assertIsNone(worker_stats)
+
+
+def _Square(value):
+  return value * value
+
+
+if __name__ == '__main__':
+  googletest.main()
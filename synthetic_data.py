@@ -0,0 +1,115 @@
+"""Seeded generators of synthetic legacy configs and country spreadsheets.
+
+Used by the benchmarks to exercise the parsers, merger, writers and import
+at realistic sizes without production data or network access.  The same
+seed always produces the same files.
+"""
+
+import csv
+import hashlib
+import random
+
+COUNTRY_CODES = ['AT', 'AU', 'BE', 'BR', 'CA', 'CH', 'DE', 'ES', 'FR', 'GB',
+                 'IT', 'JP', 'MX', 'NL', 'US']
+WORDS = ['Alpine', 'Bay', 'Castle', 'Cathedral', 'Garden', 'Harbor', 'Island',
+         'Lake', 'Market', 'Museum', 'Palace', 'Park', 'Plaza', 'Tower',
+         'Valley', 'Zoo']
+METHODS = ['Car', 'Trike', 'Trolley', 'Snowmobile', 'Trekker']
+STREETS = ['Main St', 'High St', 'Rue de Rivoli', 'Via Roma', 'Calle Mayor',
+           'Bahnhofstrasse']
+
+
+def SiteNames(num_sites, seed=0):
+  """Returns num_sites distinct CamelCase site names.
+
+  Once split into words by ParseRunGroupsConfig, the legacy name of a site
+  equals the spreadsheet name produced by SpreadsheetName.
+  """
+  rng = random.Random(seed)
+  names = []
+  for i in range(num_sites):
+    names.append('{}{}{}'.format(rng.choice(WORDS), rng.choice(WORDS), i))
+  return names
+
+
+def SpreadsheetName(camel_case_name):
+  """Returns the name ParseRunGroupsConfig derives from a CamelCase name."""
+  words = []
+  for char in camel_case_name:
+    if char.isupper() and words:
+      words.append(' ')
+    words.append(char)
+  return ''.join(words)
+
+
+def GenerateRunGroupsConfig(path, num_sites, seed=0, max_runs=20):
+  """Writes a run_groups.config with num_sites importable sections.
+
+  The file has a preamble before the '# AQ' start marker and a few sections
+  that the parser skips.  It ends with the 'XX-OrphanRuns' stop marker,
+  which the parser returns as one more site.
+
+  Args:
+    path: Output file.
+    num_sites: Number of sites the parser should return.
+    seed: Random seed.
+    max_runs: Maximum number of runs per site.
+  """
+  rng = random.Random(seed)
+  with open(path, 'wb') as f:
+    f.write('run_group: "US-Preamble_Ignored"\n# AA-Preamble "Ignored"\n\n')
+    f.write('# AQ\n\n')
+    for i, name in enumerate(SiteNames(num_sites, seed)):
+      country_code = COUNTRY_CODES[i % len(COUNTRY_CODES)]
+      if i % 100 == 0:
+        f.write('# {}-TestSite_{} "Skipped"\nrun_group <\n'
+                '  run: "19700101_000000_L00000"\n>\n\n'.format(
+                    country_code, i))
+      lat = rng.uniform(-60, 70)
+      lon = rng.uniform(-180, 180)
+      f.write('# {}-{} "{}"\n'.format(country_code, name,
+                                      SpreadsheetName(name)))
+      f.write('# ({:.7f},{:.7f}) -- ({:.7f},{:.7f})\n'.format(
+          lat, lon, lat + rng.uniform(0, 0.05), lon + rng.uniform(0, 0.05)))
+      f.write('run_group <\n  name: "{}-{}"\n'.format(country_code, name))
+      for j in range(rng.randint(1, max_runs)):
+        f.write('  run: "2011{:02d}{:02d}_{:06d}_L{:05d}"\n'.format(
+            rng.randint(1, 12), rng.randint(1, 28), i, j))
+      f.write('>\n\n')
+    f.write('# XX-OrphanRuns "Orphans"\nrun_group <\n'
+            '  run: "19700101_000000_L99999"\n>\n')
+
+
+def GenerateSpreadsheet(path, num_sites, seed=0, legacy_overlap=0.5):
+  """Writes a country spreadsheet in the format Parser reads.
+
+  Args:
+    path: Output CSV file.
+    num_sites: Number of rows.
+    seed: Random seed; with the seed of GenerateRunGroupsConfig, a
+      legacy_overlap fraction of rows name sites from that config.
+    legacy_overlap: Fraction of rows that match a legacy site name.
+  """
+  rng = random.Random(seed + 1)
+  legacy_names = SiteNames(num_sites, seed)
+  with open(path, 'wb') as f:
+    writer = csv.writer(f)
+    writer.writerow(['Location Name', 'Equipment', 'Address'])
+    for i in range(num_sites):
+      if rng.random() < legacy_overlap:
+        name = SpreadsheetName(legacy_names[i])
+      else:
+        name = 'New Site {}'.format(i)
+      address = '{} {}, {}'.format(rng.randint(1, 999), rng.choice(STREETS),
+                                   rng.choice(COUNTRY_CODES))
+      writer.writerow([name, rng.choice(METHODS), address])
+
+
+def StubGeocode(address):
+  """Deterministic offline stand-in for Geocode."""
+  if not address:
+    return None, None
+  digest = int(hashlib.md5(address).hexdigest()[:12], 16)
+  lat = (digest % 1300000) / 10000.0 - 60.0
+  lon = (digest // 1300000 % 3600000) / 10000.0 - 180.0
+  return lat, lon
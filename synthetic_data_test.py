@@ -0,0 +1,67 @@
+"""Tests for the synthetic benchmark inputs."""
+
+import os
+import tempfile
+
+from google3.testing.pybase import googletest
+
+from google3.cityblock.special.legacy import collects_to_scout
+from google3.cityblock.special.legacy import parse_run_groups_config
+from google3.cityblock.special.legacy import synthetic_data
+
+
+class SyntheticDataTests(googletest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def _Path(self, name):
+    return os.path.join(self.directory, name)
+
+  def testGeneratorsAreSeeded(self):
+    """Test that the same seed writes the same files."""
+    for name, seed in (('a', 0), ('b', 0), ('c', 1)):
+      synthetic_data.GenerateRunGroupsConfig(self._Path(name + '.config'), 50,
+                                             seed)
+      synthetic_data.GenerateSpreadsheet(self._Path(name + '.csv'), 50, seed)
+
+    def Read(name):
+      with open(self._Path(name)) as f:
+        return f.read()
+
+    self.assertEqual(Read('a.config'), Read('b.config'))
+    self.assertEqual(Read('a.csv'), Read('b.csv'))
+    self.assertNotEqual(Read('a.config'), Read('c.config'))
+
+  def testInputsParseAndMerge(self):
+    """Test that every generated site parses and overlapping names merge."""
+    config = self._Path('run_groups.config')
+    spreadsheet = self._Path('sites.csv')
+    synthetic_data.GenerateRunGroupsConfig(config, 300, 7)
+    synthetic_data.GenerateSpreadsheet(spreadsheet, 300, 7,
+                                       legacy_overlap=0.5)
+
+    with open(config) as f:
+      legacy = parse_run_groups_config.ParseRunGroupsConfig(f)
+    current = collects_to_scout.Parser(spreadsheet,
+                                       synthetic_data.StubGeocode)
+    merged = collects_to_scout.Merger(current, legacy)
+
+    # the generated sites plus the orphan runs section
+    self.assertEqual(301, len(legacy))
+    self.assertTrue(all(site.lat is not None and site.runs
+                        for site in legacy[:-1]))
+    self.assertEqual(300, len(current))
+    overlap = 601 - len(merged)
+    self.assertTrue(100 < overlap < 200, overlap)
+
+  def testStubGeocode(self):
+    """Test that the stub geocoder is deterministic and in range."""
+    lat, lon = synthetic_data.StubGeocode('1 Main St, US')
+    self.assertEqual((lat, lon), synthetic_data.StubGeocode('1 Main St, US'))
+    self.assertTrue(-90 <= lat <= 90 and -180 <= lon <= 180)
+    self.assertEqual((None, None), synthetic_data.StubGeocode(''))
+
+
+if __name__ == '__main__':
+  googletest.main()